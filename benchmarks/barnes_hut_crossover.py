@@ -0,0 +1,91 @@
+""" @package barnes_hut_crossover
+
+@brief Crossover benchmark of Barnes-Hut tree against direct summation
+
+@details Times a single acceleration evaluation of `pairwise_accelerations` and `BarnesHutSolver` for growing numbers
+of bodies in a disk resembling `sun_earth_mars_debris` configuration, reports median relative force error of the
+tree and the smallest number of bodies for which the tree is faster. Both a full rebuild and a refit
+(tree topology reused, as happens between most right hand side evaluations) are timed.
+
+Usage example (run from repository root):
+@code
+  python -m benchmarks.barnes_hut_crossover --theta 0.5 --dim 2
+@endcode
+"""
+
+from src.Bodies import pairwise_accelerations
+from src.BarnesHut import BarnesHutSolver
+
+import argparse
+import time
+
+import numpy as np
+
+def best_time(function, repeats):
+  """Smallest wall time out of several runs
+  @param function Callable without arguments
+  @param repeats Number of runs
+  @returns Time in seconds
+  """
+  times = []
+  for _ in range(repeats):
+    start = time.perf_counter()
+    function()
+    times.append(time.perf_counter() - start)
+  return min(times)
+
+def debris_disk(n, dim, rng):
+  """Central star surrounded by a disk of light particles
+  @param n Number of bodies
+  @param dim Number of dimensions
+  @param rng `numpy` random generator
+  @returns Tuple of positions and masses
+  """
+  radius = rng.uniform(1.7e11, 2.1e11, n)
+  angle = rng.uniform(0, 2*np.pi, n)
+  positions = np.zeros((n, dim))
+  positions[:, 0], positions[:, 1] = radius*np.cos(angle), radius*np.sin(angle)
+  if dim == 3:
+    positions[:, 2] = rng.normal(0, 1e9, n)
+  positions[0] = 0
+  masses = np.full(n, 1e15)
+  masses[0] = 1.989e30
+  return positions, masses
+
+def main():
+  """Run benchmark and print a table"""
+  parser = argparse.ArgumentParser(description="Barnes-Hut vs direct summation crossover benchmark")
+  parser.add_argument("--theta", type=float, default=0.5, help="Opening angle, within [0, 1]")
+  parser.add_argument("--dim", type=int, choices=(2, 3), default=2, help="Number of dimensions")
+  parser.add_argument("--sizes", type=int, nargs='+', default=[16, 64, 256, 1024, 2048, 4096], help="Numbers of bodies")
+  parser.add_argument("--repeats", type=int, default=3, help="Repetitions of each measurement")
+  args = parser.parse_args()
+  if not 0 <= args.theta <= 1:
+    parser.error(f"--theta must lie within [0, 1], got {args.theta}")
+
+  rng = np.random.default_rng(0)
+  G = 6.67430e-11
+  crossover = None
+  print(f"{'N':>6} {'direct [ms]':>12} {'build [ms]':>11} {'refit [ms]':>11} {'median error':>13}")
+  for n in args.sizes:
+    positions, masses = debris_disk(n, args.dim, rng)
+    solver = BarnesHutSolver(theta=args.theta, rebuild_every=1)
+    direct = best_time(lambda: pairwise_accelerations(positions, masses, G), args.repeats)
+    build = best_time(lambda: solver.accelerations(positions, masses, G), args.repeats)
+    solver.rebuild_every = np.inf
+    refit = best_time(lambda: solver.accelerations(positions, masses, G), args.repeats)
+
+    reference = pairwise_accelerations(positions, masses, G)
+    approximation = solver.accelerations(positions, masses, G)
+    error = np.median(np.linalg.norm(approximation - reference, axis=1) / np.linalg.norm(reference, axis=1))
+    if crossover is None and refit < direct:
+      crossover = n
+    print(f"{n:>6} {direct*1e3:>12.2f} {build*1e3:>11.2f} {refit*1e3:>11.2f} {error:>13.2e}")
+
+  if crossover is None:
+    print("Barnes-Hut was not faster than direct summation for any tested size")
+  else:
+    print(f"Barnes-Hut (theta={args.theta}) is faster than direct summation from N={crossover}")
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,76 @@
+""" @package startup
+
+@brief Cold start benchmark of headless `solve` command
+
+@details Launches `python main.py solve <configuration>` repeatedly in fresh interpreters and reports
+median wall time of a whole run next to median wall time of a bare interpreter and of imports alone,
+so regressions in import time show up separately from solving time.
+Slowest imports of a single run (as reported by `python -X importtime`) are listed too.
+
+Usage example (run from repository root):
+@code
+  python -m benchmarks.startup --configuration butterfly --repeats 10
+@endcode
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+def median_time(command, repeats):
+  """Median wall time of a command
+  @param command List of command line arguments
+  @param repeats Number of runs
+  @returns Time in seconds
+  """
+  times = []
+  for _ in range(repeats):
+    start = time.perf_counter()
+    subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    times.append(time.perf_counter() - start)
+  return statistics.median(times)
+
+def slowest_imports(command, count):
+  """Modules with largest cumulative import time
+  @param command List of command line arguments, `-X importtime` is added
+  @param count Number of reported modules
+  @returns List of `(microseconds, module)` tuples
+  """
+  result = subprocess.run([sys.executable, '-X', 'importtime'] + command[1:], check=True, capture_output=True, text=True)
+  imports = []
+  for line in result.stderr.splitlines():
+    if not line.startswith('import time:') or 'cumulative' in line:
+      continue
+    _, cumulative, module = line[len('import time:'):].split('|')
+    imports.append((int(cumulative), module.rstrip()))
+  # only top level modules, nested ones are included in their parents' cumulative time
+  top_level = [(cumulative, module) for cumulative, module in imports if not module.startswith('  ')]
+  return sorted(top_level, reverse=True)[:count]
+
+def main():
+  """Run benchmark"""
+  parser = argparse.ArgumentParser(description="Cold start benchmark of headless solve command")
+  parser.add_argument("--configuration", type=str, default="butterfly", help="Solved configuration")
+  parser.add_argument("--repeats", type=int, default=5, help="Number of runs of each command")
+  args = parser.parse_args()
+
+  main_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'main.py')
+  with tempfile.TemporaryDirectory() as directory:
+    output = os.path.join(directory, 'solution.npz')
+    solve = [sys.executable, main_path, 'solve', args.configuration, '--output', output]
+    interpreter = median_time([sys.executable, '-c', 'pass'], args.repeats)
+    imports = median_time([sys.executable, '-c', 'import sys; sys.path.insert(0, sys.argv[1]); import src.Simulator', os.path.dirname(main_path)], args.repeats)
+    total = median_time(solve, args.repeats)
+    print(f"bare interpreter:   {interpreter:.3f}s")
+    print(f"solve imports:      {imports:.3f}s")
+    print(f"solve {args.configuration}: {total:.3f}s")
+    print("slowest top level imports:")
+    for microseconds, module in slowest_imports(solve, 5):
+      print(f"  {microseconds / 1e6:.3f}s {module.strip()}")
+
+if __name__ == "__main__":
+  main()
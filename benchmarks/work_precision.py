@@ -0,0 +1,262 @@
+""" @package work_precision
+
+@brief Work-precision benchmark across configurations, solvers and tolerances
+
+@details Runs configurations from `src/Configurations.py` (through their configuration functions) with every
+requested `scipy.integrate` solver and tolerance and records for each run:
+- wall time of integration
+- number of right hand side evaluations
+- accepted steps and rejected steps (rejected steps are derived from evaluation counts, so they are reported
+  only for explicit Runge-Kutta methods, whose every step attempt costs a fixed number of evaluations)
+- peak memory allocated during integration, measured with `tracemalloc` in a separate run so it does not distort timing
+- largest relative energy drift over all steps
+- relative error of final state against a `DOP853` reference with `rtol == atol == 1e-13`
+
+Additionally stages of `ThreeBodyPlotter` are timed once per configuration.
+By default only three-body configurations are benchmarked, configurations with additional bodies (e.g. the debris
+cloud, which is too large for implicit solvers) run only when named with `--configurations`.
+Results are printed as work-precision tables and saved as JSON, which can be passed back with `--compare`
+to report speedups and regressions against a previous baseline.
+
+Usage example (run from repository root):
+@code
+  python -m benchmarks.work_precision --output baseline.json
+  # ... change something ...
+  python -m benchmarks.work_precision --output new.json --compare baseline.json
+  python -m benchmarks.work_precision --configurations butterfly goggles --solvers RK45 DOP853 --no-plots
+@endcode
+"""
+
+import matplotlib
+matplotlib.use('Agg')
+
+from src.ArgsHandler import ThreeBodyArgParser
+from src.Simulator import ThreeBodySimulator
+from src.Plotter import ThreeBodyPlotter
+from src.Bodies import state_energy
+
+from scipy.integrate import RK23, RK45, DOP853, Radau, BDF, LSODA, solve_ivp
+
+import argparse
+import json
+import logging
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import scipy
+
+## Solvers available for benchmarking
+SOLVERS = {'RK23': RK23, 'RK45': RK45, 'DOP853': DOP853, 'Radau': Radau, 'BDF': BDF, 'LSODA': LSODA}
+
+## Plotter stages, timed in order
+PLOT_STAGES = ('plot_detailed', 'plot_phase', 'plot_phase_detailed_x', 'plot_positions', 'make_animation')
+
+def integrate(sim, method, t_end, rtol, atol):
+  """Integrate a system step by step, collecting step statistics
+  @param sim ThreeBodySimulator object
+  @param method Solver name, key of `SOLVERS`
+  @param t_end End of simulation time
+  @param rtol Relative tolerance
+  @param atol Absolute tolerance
+  @returns Dictionary with states of all steps (`y`), `nfev`, `accepted` and `rejected` steps
+  """
+  solver = SOLVERS[method](sim.system_of_equations, 0, sim.initial_conditions(), t_end, rtol=rtol, atol=atol)
+  states = [solver.y.copy()]
+  accepted, rejected = 0, 0
+  n_stages = getattr(solver, 'n_stages', None)
+  while solver.status == 'running':
+    nfev = solver.nfev
+    message = solver.step()
+    if solver.status == 'failed':
+      raise RuntimeError(f"{method} failed: {message}")
+    accepted += 1
+    if n_stages:
+      rejected += (solver.nfev - nfev) // n_stages - 1
+    states.append(solver.y.copy())
+  return {
+    'y': np.array(states).T,
+    'nfev': solver.nfev,
+    'accepted': accepted,
+    'rejected': rejected if n_stages else None,
+  }
+
+def relative_error(state, reference):
+  """Relative error of a state, positions and velocities are compared separately
+  @param state Final state
+  @param reference Final state of reference solution
+  @returns Larger of both relative errors
+  """
+  half = len(state) // 2
+  return max(
+    np.linalg.norm(state[part] - reference[part]) / np.linalg.norm(reference[part])
+    for part in (slice(0, half), slice(half, None))
+  )
+
+def benchmark_solver(params, method, tolerance, reference, measure_memory):
+  """Benchmark a single configuration, solver and tolerance
+  @param params Simulation parameters
+  @param method Solver name
+  @param tolerance Used as both relative and absolute tolerance
+  @param reference Final state of reference solution
+  @param measure_memory If set, peak memory is measured in an additional run
+  @returns Dictionary of measurements
+  """
+  sim = ThreeBodySimulator(params)
+  t_end = params['days'] * 24 * 3600
+  start = time.perf_counter()
+  run = integrate(sim, method, t_end, tolerance, tolerance)
+  wall = time.perf_counter() - start
+
+  peak = None
+  if measure_memory:
+    tracemalloc.start()
+    integrate(sim, method, t_end, tolerance, tolerance)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+  energy = state_energy(run['y'], sim.bodies, params['G'], params.get('softening', 0.0))
+  return {
+    'wall_time': wall,
+    'nfev': run['nfev'],
+    'accepted_steps': run['accepted'],
+    'rejected_steps': run['rejected'],
+    'peak_memory': peak,
+    'energy_error': float(np.max(np.abs((energy - energy[0]) / energy[0]))),
+    'final_error': relative_error(run['y'][:, -1], reference),
+  }
+
+def benchmark_plots(params, solution):
+  """Time every plotter stage for a solution, plots are written to a temporary directory
+  @param params Simulation parameters
+  @param solution Solution with dense output
+  @returns Dictionary `{stage: wall time}`
+  """
+  timings = {}
+  with tempfile.TemporaryDirectory() as directory:
+    plot_params = {
+      'detailed_file': os.path.join(directory, 'detailed.png'),
+      'trajectories_file': os.path.join(directory, 'trajectories.png'),
+      'phase_file': os.path.join(directory, 'phase.png'),
+      'detailed_phase_file': os.path.join(directory, 'detailed_phase.png'),
+      'animation_file': os.path.join(directory, 'animation.gif'),
+      'quiet': True,
+    }
+    plotter = ThreeBodyPlotter(solution, params | plot_params)
+    for stage in PLOT_STAGES:
+      start = time.perf_counter()
+      getattr(plotter, stage)()
+      timings[stage] = time.perf_counter() - start
+      matplotlib.pyplot.close('all')
+  return timings
+
+def print_table(name, records):
+  """Print work-precision table of a single configuration
+  @param name Configuration name
+  @param records List of measurements of this configuration
+  """
+  print(f"\n{name}")
+  print(f"{'solver':>8} {'tol':>7} {'wall [s]':>9} {'nfev':>8} {'accepted':>9} {'rejected':>9} {'peak [MiB]':>11} {'energy err':>11} {'final err':>10}")
+  for record in records:
+    rejected = '-' if record['rejected_steps'] is None else record['rejected_steps']
+    peak = '-' if record['peak_memory'] is None else f"{record['peak_memory'] / 2**20:.2f}"
+    print(
+      f"{record['solver']:>8} {record['tolerance']:>7.0e} {record['wall_time']:>9.3f} {record['nfev']:>8} "
+      f"{record['accepted_steps']:>9} {rejected:>9} {peak:>11} {record['energy_error']:>11.2e} {record['final_error']:>10.2e}"
+    )
+
+def compare(results, baseline_path, threshold):
+  """Print comparison against a previous baseline
+  @param results Current results
+  @param baseline_path Path to JSON file with previous results
+  @param threshold Relative wall time increase reported as a regression
+  """
+  with open(baseline_path) as file:
+    baseline = json.load(file)
+  previous = {(r['configuration'], r['solver'], r['tolerance']): r for r in baseline['runs']}
+  print(f"\nComparison against \"{baseline_path}\" (ratio > 1 means slower now)")
+  print(f"{'configuration':>22} {'solver':>8} {'tol':>7} {'wall ratio':>11} {'nfev ratio':>11} {'error ratio':>12}")
+  regressions = 0
+  for record in results['runs']:
+    old = previous.get((record['configuration'], record['solver'], record['tolerance']))
+    if old is None:
+      continue
+    wall_ratio = record['wall_time'] / old['wall_time']
+    nfev_ratio = record['nfev'] / old['nfev']
+    error_ratio = record['final_error'] / old['final_error'] if old['final_error'] else float('nan')
+    flag = '  REGRESSION' if wall_ratio > 1 + threshold else ''
+    regressions += bool(flag)
+    print(f"{record['configuration']:>22} {record['solver']:>8} {record['tolerance']:>7.0e} {wall_ratio:>11.2f} {nfev_ratio:>11.2f} {error_ratio:>12.2f}{flag}")
+  print(f"{regressions} regression(s) above {threshold:.0%} threshold")
+
+def body_count(params):
+  """Number of bodies of a configuration
+  @param params Simulation parameters
+  @returns Number of body keys in params
+  """
+  return sum(key.isdigit() for key in params)
+
+def main():
+  """Run benchmark suite"""
+  available = dict(ThreeBodyArgParser().available_modes)
+  names = list(available)
+  three_body = [name for name in names if body_count(available[name]()) == 3]
+  parser = argparse.ArgumentParser(description="Work-precision benchmark of configurations, solvers and tolerances")
+  parser.add_argument("--configurations", nargs='+', choices=names, default=three_body, help="Benchmarked configurations, defaults to three-body ones")
+  parser.add_argument("--solvers", nargs='+', choices=tuple(SOLVERS), default=list(SOLVERS), help="Benchmarked solvers")
+  parser.add_argument("--tolerances", nargs='+', type=float, default=[1e-4, 1e-6, 1e-8, 1e-10], help="Benchmarked tolerances")
+  parser.add_argument("--time-fraction", type=float, default=1.0, help="Fraction of each configuration's simulation time")
+  parser.add_argument("--no-memory", action='store_true', help="Skip peak memory measurement")
+  parser.add_argument("--no-plots", action='store_true', help="Skip timing of plotter stages")
+  parser.add_argument("--output", type=str, default="benchmark.json", help="JSON file results are saved to")
+  parser.add_argument("--compare", type=str, default=None, help="JSON baseline to compare results against")
+  parser.add_argument("--threshold", type=float, default=0.1, help="Relative slowdown reported as a regression")
+  args = parser.parse_args()
+  logging.getLogger("main").setLevel(logging.WARNING)
+
+  results = {
+    'environment': {
+      'python': platform.python_version(),
+      'numpy': np.__version__,
+      'scipy': scipy.__version__,
+      'machine': platform.machine(),
+      'processor': platform.processor(),
+    },
+    'runs': [],
+    'plots': {},
+  }
+  for name in args.configurations:
+    params = available[name]()
+    params['days'] *= args.time_fraction
+    t_end = params['days'] * 24 * 3600
+    sim = ThreeBodySimulator(params)
+    reference = solve_ivp(sim.system_of_equations, (0, t_end), sim.initial_conditions(), method='DOP853', rtol=1e-13, atol=1e-13)
+    records = []
+    for method in args.solvers:
+      for tolerance in args.tolerances:
+        try:
+          record = benchmark_solver(params, method, tolerance, reference.y[:, -1], not args.no_memory)
+        except Exception as e:
+          print(f"{name}: {method} with tolerance {tolerance:.0e} failed: {e}")
+          continue
+        records.append({'configuration': name, 'solver': method, 'tolerance': tolerance} | record)
+    print_table(name, records)
+    results['runs'] += records
+
+    if not args.no_plots:
+      solution = solve_ivp(sim.system_of_equations, (0, t_end), sim.initial_conditions(), dense_output=True, rtol=1e-8, atol=1e-8)
+      timings = benchmark_plots(params, solution)
+      results['plots'][name] = timings
+      print("plot stages: " + ', '.join(f"{stage} {seconds:.2f}s" for stage, seconds in timings.items()))
+
+  with open(args.output, 'w') as file:
+    json.dump(results, file, indent=2)
+  print(f"\nResults saved to \"{args.output}\"")
+  if args.compare:
+    compare(results, args.compare, args.threshold)
+
+if __name__ == "__main__":
+  main()
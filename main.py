@@ -1,40 +1,178 @@
 """ @package main
 
 @brief Program's entry point
-"""
-
-from src.Utils import *
-from src.Plotter import *
-from src.Simulator import *
-from src.Configurations import *
-from src.ArgsHandler import *
 
+@details Modules are imported lazily inside each command, so commands which do not plot (e.g. `solve`)
+never pay for importing `matplotlib`.
+"""
 
 # importing src/Logger.py initializes logging
 import src.Logger
 
+import sys
+
+def solve():
+  """Solve a configuration without any interactive facilities and save the solution to a file"""
+  from src.ArgsHandler import ThreeBodyArgParser
+
+  parser = ThreeBodyArgParser()
+  args = parser.handle_solve_args()
+  params = parser.get_configuration(args['configuration'])() | args
+
+  if params.get('plot', False):
+    # headless run, must be selected before pyplot is imported
+    import matplotlib
+    matplotlib.use('Agg')
+
+  from src.Simulator import ThreeBodySimulator
+  import numpy as np
+
+  if params.get('model_reduction', None) is not None:
+    from src.Hierarchical import HierarchicalSimulator
+    sim = HierarchicalSimulator(params)
+  else:
+    sim = ThreeBodySimulator(params)
+  solution = sim.solve_system_of_equations()
+  np.savez(
+    params['output'],
+    t=solution.t,
+    y=solution.y,
+    masses=sim.bodies.masses,
+    dim=sim.bodies.dim,
+    G=params['G'],
+    configuration=args['configuration']
+  )
+  sim.logger.info(f"Solution saved as \"{params['output']}\"")
+
+  if params.get('plot', False):
+    from src.Plotter import ThreeBodyPlotter
+
+    plotter = ThreeBodyPlotter(solution, params)
+    plotter.plot_detailed()
+    plotter.plot_phase()
+    plotter.plot_phase_detailed_x()
+    plotter.plot_positions()
+
+def sweep():
+  """Run a declarative parameter sweep"""
+  from src.ArgsHandler import ThreeBodyArgParser
+  from src.Sweep import ParameterSweep
+
+  parser = ThreeBodyArgParser()
+  spec = parser.handle_sweep_args()
+  params = parser.get_configuration(spec['configuration'])()
+  ParameterSweep(spec, params).run()
+
+def batch():
+  """Run many configurations in a process pool, each one writing to its own directory"""
+  from src.ArgsHandler import ThreeBodyArgParser
+  from src.Pipeline import BatchRunner
+
+  args = ThreeBodyArgParser().handle_batch_args()
+  runner = BatchRunner(args['configurations'], args['output_dir'], args['workers'], args['animation'])
+  results = runner.run()
+  runner.print_summary(results)
+  if any(result['status'] != 'ok' for result in results):
+    sys.exit(1)
+
+def ensemble():
+  """Integrate a configuration for every row of an initial condition table"""
+  from src.ArgsHandler import ThreeBodyArgParser
+  from src.Ensemble import EnsembleRun
+
+  parser = ThreeBodyArgParser()
+  args = parser.handle_ensemble_args()
+  params = parser.get_configuration(args.pop('configuration'))()
+  try:
+    ensemble = EnsembleRun(params, args.pop('table'), **args)
+  except (OSError, ValueError) as e:
+    parser.logger.critical(f"Could not start ensemble: {e}")
+    sys.exit(2)
+  ensemble.run()
+
+def orbits():
+  """Search for periodic orbits of a configuration"""
+  from src.ArgsHandler import ThreeBodyArgParser
+  from src.PeriodicOrbits import PeriodicOrbitFinder
+
+  parser = ThreeBodyArgParser()
+  args = parser.handle_orbits_args()
+  params = parser.get_configuration(args['configuration'])()
+  params['periodic_orbit'] = params.get('periodic_orbit', {}) | args['periodic_orbit']
+  finder = PeriodicOrbitFinder(params)
+  finder.save(finder.search(), args['output'])
+
+def serve():
+  """Run a local simulation service until interrupted"""
+  from src.ArgsHandler import ThreeBodyArgParser
+  from src.Service import SimulationService
+  import asyncio
+
+  args = ThreeBodyArgParser().handle_serve_args()
+  service = SimulationService(args['workers'], args['max_queue'])
+  try:
+    asyncio.run(service.serve(args['host'], args['port'], args['socket']))
+  except KeyboardInterrupt:
+    service.logger.info("Service stopped")
+
+def queue():
+  """Create, work on or merge a work queue on a shared directory"""
+  from src.ArgsHandler import ThreeBodyArgParser
+  from src.WorkQueue import WorkQueue, run_workers
+
+  parser = ThreeBodyArgParser()
+  args = parser.handle_queue_args()
+  work_queue = WorkQueue(args['directory'])
+  try:
+    if args['action'] == 'init':
+      work_queue.create(parser.get_configuration(args['configuration'])(), args['shard_size'], args['lease'])
+    elif args['action'] == 'work':
+      run_workers(args['directory'], args['workers'], args['poll'])
+    elif args['action'] == 'status':
+      if args['requeue_failed']:
+        parser.logger.info(f"{work_queue.requeue_failed()} failed shards returned to queue")
+      print(', '.join(f"{state}: {count}" for state, count in work_queue.status().items()))
+    else:
+      import matplotlib
+      matplotlib.use('Agg')
+      from src.Plotter import LyapunovPlotter
+
+      params = work_queue.params()
+      xs, exponents = work_queue.merge()
+      for x_0, exponent, stop_time, reason in zip(xs, exponents, work_queue.stop_times, work_queue.stop_reasons):
+        parser.logger.info(f"x_0={x_0:.4f}: exponent {exponent:.4f}, stopped after {stop_time:.4g} days ({reason})")
+      LyapunovPlotter(xs, exponents, params | {'lyapunov_file': args['lyapunov_file'], 'quiet': True}).plot_lyapunov()
+  except ValueError as e:
+    parser.logger.critical(str(e))
+    sys.exit(2)
+
+## Commands available besides running a configuration, `python main.py <command> ...`
+commands = {
+  'solve': solve,
+  'sweep': sweep,
+  'batch': batch,
+  'ensemble': ensemble,
+  'orbits': orbits,
+  'serve': serve,
+  'queue': queue,
+}
+
 def main():
   """Run chosen simulation"""
+  if len(sys.argv) > 1 and sys.argv[1] in commands:
+    return commands[sys.argv[1]]()
+
+  from src.ArgsHandler import ThreeBodyArgParser
+  from src.Pipeline import run_configuration
+  from src.Profiler import Profiler
+
   chosen_mode, plot_params = ThreeBodyArgParser().handle_args()
   params = chosen_mode()
   params = params | plot_params
-  
-  sim = ThreeBodySimulator(params)
-  solution = sim.solve_system_of_equations()
-
-  plotter = ThreeBodyPlotter(solution, params)
-  plotter.plot_detailed()
-  plotter.plot_phase()
-  plotter.plot_phase_detailed_x()
-  plotter.plot_positions()
-  plotter.make_animation()
-
-  if params.get('lyapunov', None):
-    lyapunov_sim = LyapunovAnalyzer(params)
-    xs, exponents = lyapunov_sim.analyze_x0()
 
-    lyapunov_plotter = LyapunovPlotter(xs, exponents, params)
-    lyapunov_plotter.plot_lyapunov()
+  profiler = Profiler(params.get('profile', False))
+  run_configuration(params, profiler)
+  profiler.save(params.get('profile_file', 'profile.json'))
 
 if __name__ == "__main__":
   main()
\ No newline at end of file
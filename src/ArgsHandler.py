@@ -15,11 +15,18 @@ Usage example:
   params = configuration_generator()
   params = params | plot_params
 @endcode
+
+Commands other than running a single configuration are dispatched by `main.py` to dedicated `handle_*_args` methods,
+e.g. `python main.py sweep spec.json` is parsed by `handle_sweep_args`.
 """
 
 from . import Configurations
+from .Scenarios import is_scenario_file, load_scenario
 
 import argparse
+import functools
+import json
+import os
 import sys
 import logging
 
@@ -31,28 +38,279 @@ class ThreeBodyArgParser:
     """Constructor for ThreeBodyArgParser
     @attention List of available modes is autogenerated based on contents of `src/Configurations` module
     """
-    ## Map `{function_name: function}` of functions defined in `src/Configurations`
-    self.available_modes = getmembers(Configurations, isfunction)
+    ## List of `(function_name, function)` pairs of public functions defined in `src/Configurations`, imported names are skipped
+    self.available_modes = [
+      (fun_name, fun) for fun_name, fun in getmembers(Configurations, isfunction)
+      if fun.__module__ == Configurations.__name__ and not fun_name.startswith('_')
+    ]
     ## List of function names defined in `src/Configurations`
-    self.mode_names = [fun_name for fun_name, _ in self.available_modes if fun_name not in ('dataclass')]
+    self.mode_names = [fun_name for fun_name, _ in self.available_modes]
     ## Global logger reference
     self.logger = logging.getLogger("main")
 
   def print_available_modes(self):
     """Generates a string containing all avaliable configurations"""
     mode_list = '\n - '.join(self.mode_names)
-    return f"Available configurations: \n - {mode_list}"
+    return f"Available configurations: \n - {mode_list}\nPath to a .toml or .json scenario file is accepted too, see `src/Scenarios.py`"
 
   def validator(self, string: str):
-    """Checks if string is a valid mode name
+    """Checks if string is a valid mode name or path to a scenario file
     @param string Checked string
     @returns String passed as input if validation succeeds, None otherwise
     @throws argparse.ArgumentTypeError Thrown if string does not contain a valid mode
     """
-    if not string in self.mode_names:
+    if not string in self.mode_names and not is_scenario_file(string):
       raise argparse.ArgumentTypeError(f"Mode \"{string}\" not supported\n\n{self.print_available_modes()}")
     return string
 
+  def get_configuration(self, name):
+    """Find configuration function by its name
+    @param name Configuration name
+    @returns Function that generates parameters for given configuration
+    @throws argparse.ArgumentTypeError Thrown if name is not a valid mode
+    """
+    self.validator(name)
+    if is_scenario_file(name):
+      return functools.partial(load_scenario, name)
+    return [mode[1] for mode in self.available_modes if mode[0] == name][0]
+
+  def add_output_arguments(self):
+    """Add arguments selecting output policy of a solution to current parser, see `src/Simulator.py`"""
+    self.parser.add_argument("--output-grid", required=False, type=int, default=None, metavar="POINTS", help="If set, solution is stored on given number of evenly spaced times instead of every solver step, without dense output, optional")
+    self.parser.add_argument("--output-events", action='store_true', help="If set, closest approaches of bodies are stored instead of every solver step, without dense output, optional")
+    self.parser.add_argument("--float32", action='store_true', help="If set, states are stored in single precision, meant for runs which only produce plots, optional")
+
+  def output_policy(self, args):
+    """Output policy selected by arguments added with `add_output_arguments`
+    @param args Parsed arguments
+    @returns Output policy dictionary, `None` if every solver step and dense output are stored
+    """
+    policy = {}
+    if args.output_grid is not None:
+      if args.output_grid < 2:
+        self.parser.error(f"--output-grid needs at least 2 points, got {args.output_grid}")
+      policy['grid'] = args.output_grid
+    if args.output_events:
+      policy['events'] = True
+    if args.float32:
+      policy['dtype'] = 'float32'
+    return policy or None
+
+  def handle_solve_args(self):
+    """
+    Parse arguments of headless `solve` command from command line
+    @returns Dictionary containing configuration name and parameters overriding or extending it
+    """
+    self.parser = argparse.ArgumentParser(
+      prog='main.py solve',
+      formatter_class=argparse.RawDescriptionHelpFormatter,
+      description='Solve a configuration and save solution (t, y, masses) to a .npz file, without interactive facilities\n',
+      epilog=self.print_available_modes()
+    )
+    self.parser.add_argument("configuration", type=self.validator, help="Specified configuration of bodies' positions, velocities and masses, mandatory")
+    self.parser.add_argument("--output", required=False, type=str, default=None, help="Name of solution file, defaults to <configuration>.npz, optional")
+    self.parser.add_argument("--plot", action='store_true', help="If set, static plots are saved next to solution file using a non-interactive backend, optional")
+    self.parser.add_argument("--rtol", required=False, type=float, default=None, help="Relative tolerance of solver, optional")
+    self.parser.add_argument("--atol", required=False, type=float, default=None, help="Absolute tolerance of solver, optional")
+    self.parser.add_argument("--model-reduction", action='store_true', help="If set, binary and escaper are propagated as Kepler orbits once a body escapes, optional")
+    self.add_output_arguments()
+    try:
+      args = self.parser.parse_args(sys.argv[2:])
+    except argparse.ArgumentError as e:
+      self.logger.critical(e)
+      sys.exit(2)
+
+    output = args.output or f"{os.path.splitext(os.path.basename(args.configuration))[0]}.npz"
+    stem = output[:-4] if output.endswith('.npz') else output
+    solve_params = {
+      "configuration": args.configuration,
+      "output": output,
+      "plot": args.plot,
+      "detailed_file": f"{stem}_detailed_plot.png",
+      "trajectories_file": f"{stem}_trajectories_plot.png",
+      "phase_file": f"{stem}_phase_plot.png",
+      "detailed_phase_file": f"{stem}_detailed_phase_plot.png",
+      "animation_file": f"{stem}_animation.gif",
+      "quiet": True
+    }
+    for key in ('rtol', 'atol'):
+      if getattr(args, key) is not None:
+        solve_params[key] = getattr(args, key)
+    if args.model_reduction:
+      solve_params["model_reduction"] = {}
+    if self.output_policy(args):
+      solve_params["output_policy"] = self.output_policy(args)
+    return solve_params
+
+  def handle_batch_args(self):
+    """
+    Parse arguments of `batch` command from command line
+    @returns Dictionary containing configuration names, output directory, number of workers and animation switch
+    """
+    self.parser = argparse.ArgumentParser(
+      prog='main.py batch',
+      description='Run many configurations in a process pool, files of each one are written to its own directory\n',
+      epilog=self.print_available_modes(),
+      formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    self.parser.add_argument("configurations", nargs='+', type=str, help="Configuration names, \"all\" (without heavy ones) or \"heavy\", mandatory")
+    self.parser.add_argument("--output-dir", required=False, type=str, default="gallery", help="Directory containing one subdirectory per configuration, optional")
+    self.parser.add_argument("--workers", required=False, type=int, default=None, help="Size of a process pool, defaults to number of available cores, optional")
+    self.parser.add_argument("--no-animation", action='store_true', help="If set, animations are not generated, optional")
+    args = self.parser.parse_args(sys.argv[2:])
+
+    groups = {
+      'all': [name for name in self.mode_names if name not in Configurations.HEAVY],
+      'heavy': list(Configurations.HEAVY),
+    }
+    names = list(dict.fromkeys(name for entry in args.configurations for name in groups.get(entry, [entry])))
+    try:
+      for name in names:
+        self.validator(name)
+    except argparse.ArgumentTypeError as e:
+      self.logger.critical(e)
+      sys.exit(2)
+    return {
+      "configurations": names,
+      "output_dir": args.output_dir,
+      "workers": args.workers,
+      "animation": not args.no_animation
+    }
+
+  def handle_ensemble_args(self):
+    """
+    Parse arguments of `ensemble` command from command line
+    @returns Dictionary containing base configuration name, table path and ensemble settings
+    """
+    self.parser = argparse.ArgumentParser(
+      prog='main.py ensemble',
+      description='Integrate a configuration for every row of a CSV or .npy table of initial conditions, see `src/Ensemble.py` for table format\n',
+      epilog=self.print_available_modes(),
+      formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    self.parser.add_argument("configuration", type=self.validator, help="Base configuration, parameters missing from the table are taken from it, mandatory")
+    self.parser.add_argument("table", type=str, help="Path to .csv or .npy table of initial conditions, mandatory")
+    self.parser.add_argument("--output", required=False, type=str, default="ensemble.csv", help="CSV file results are appended to, optional")
+    self.parser.add_argument("--chunk-size", required=False, type=int, default=256, help="Number of rows sent to a worker at once, optional")
+    self.parser.add_argument("--workers", required=False, type=int, default=None, help="Size of a process pool, optional")
+    self.parser.add_argument("--columns", required=False, nargs='+', default=None, help="Column names of a plain 2D .npy table, optional")
+    self.parser.add_argument("--observables", required=False, nargs='+', default=None, help="Computed observables, see `src/Sweep.py`, optional")
+    args = self.parser.parse_args(sys.argv[2:])
+    return {key: value for key, value in vars(args).items() if value is not None}
+
+  def handle_orbits_args(self):
+    """
+    Parse arguments of `orbits` command from command line
+    @returns Dictionary containing configuration name, output file and periodic orbit finder parameters overriding configuration's own
+    """
+    self.parser = argparse.ArgumentParser(
+      prog='main.py orbits',
+      description='Refine periodic orbits of a configuration with a Newton shooting method, see `src/PeriodicOrbits.py`\n',
+      epilog=self.print_available_modes(),
+      formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    self.parser.add_argument("configuration", type=self.validator, help="Base configuration providing positions and masses, mandatory")
+    self.parser.add_argument("--seed", required=False, type=float, nargs=3, action='append', dest='seeds', metavar=('VX', 'VY', 'T'), help="Seed velocity and guessed period, can be repeated, optional")
+    self.parser.add_argument("--vx-range", required=False, type=float, nargs=2, default=None, help="Range of grid of seed x velocities, optional")
+    self.parser.add_argument("--vy-range", required=False, type=float, nargs=2, default=None, help="Range of grid of seed y velocities, optional")
+    self.parser.add_argument("--points", required=False, type=int, default=None, help="Number of grid points per axis, optional")
+    self.parser.add_argument("--max-period", required=False, type=float, default=None, help="Longest period considered for grid seeds, optional")
+    self.parser.add_argument("--prefilter", required=False, type=float, default=None, help="Largest relative return distance passing the prefilter, optional")
+    self.parser.add_argument("--tol", required=False, type=float, default=None, help="Return residual at which an orbit counts as converged, optional")
+    self.parser.add_argument("--workers", required=False, type=int, default=None, help="Size of a process pool, optional")
+    self.parser.add_argument("--output", required=False, type=str, default="orbits.csv", help="CSV file found orbits are saved to, optional")
+    args = self.parser.parse_args(sys.argv[2:])
+
+    if (args.vx_range is None) != (args.vy_range is None) or (args.vx_range is not None and args.max_period is None):
+      self.parser.error("grid search needs --vx-range, --vy-range and --max-period")
+    settings = {
+      key: value for key, value in vars(args).items()
+      if value is not None and key not in ('configuration', 'output')
+    }
+    return {"configuration": args.configuration, "output": args.output, "periodic_orbit": settings}
+
+  def handle_serve_args(self):
+    """
+    Parse arguments of `serve` command from command line
+    @returns Dictionary containing listening address and job queue limits
+    """
+    self.parser = argparse.ArgumentParser(
+      prog='main.py serve',
+      description='Run a local HTTP/JSON simulation service with a job queue, see `src/Service.py` for its endpoints\n',
+      formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    self.parser.add_argument("--host", required=False, type=str, default="127.0.0.1", help="Interface to listen on, optional")
+    self.parser.add_argument("--port", required=False, type=int, default=8765, help="TCP port to listen on, optional")
+    self.parser.add_argument("--socket", required=False, type=str, default=None, help="Listen on a Unix socket instead of TCP, optional")
+    self.parser.add_argument("--workers", required=False, type=int, default=None, help="Number of concurrently running jobs, optional")
+    self.parser.add_argument("--max-queue", required=False, type=int, default=100, help="Largest number of queued jobs, optional")
+    args = self.parser.parse_args(sys.argv[2:])
+    return vars(args)
+
+  def handle_queue_args(self):
+    """
+    Parse arguments of `queue` command from command line
+    @returns Dictionary containing queue action and its parameters
+    """
+    self.parser = argparse.ArgumentParser(
+      prog='main.py queue',
+      description='Split a Lyapunov analysis between machines through a shared directory, see `src/WorkQueue.py`\n',
+      epilog=self.print_available_modes(),
+      formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    actions = self.parser.add_subparsers(dest="action", required=True)
+    init = actions.add_parser("init", help="Create a queue of shards of a configuration's Lyapunov analysis")
+    init.add_argument("configuration", type=self.validator, help="Configuration defining Lyapunov analysis, mandatory")
+    init.add_argument("directory", type=str, help="Shared queue directory, mandatory")
+    init.add_argument("--shard-size", required=False, type=int, default=1, help="Number of parameter values per shard, optional")
+    init.add_argument("--lease", required=False, type=float, default=600, help="Seconds after which a shard of a silent worker is recovered, optional")
+    work = actions.add_parser("work", help="Compute shards until none is left")
+    work.add_argument("directory", type=str, help="Shared queue directory, mandatory")
+    work.add_argument("--workers", required=False, type=int, default=1, help="Number of worker processes on this machine, optional")
+    work.add_argument("--poll", required=False, type=float, default=5.0, help="Seconds between checks for recovered shards, optional")
+    status = actions.add_parser("status", help="Show number of shards in every state")
+    status.add_argument("directory", type=str, help="Shared queue directory, mandatory")
+    status.add_argument("--requeue-failed", action="store_true", help="Move failed shards back to the queue, optional")
+    merge = actions.add_parser("merge", help="Combine computed shards and plot Lyapunov exponents")
+    merge.add_argument("directory", type=str, help="Shared queue directory, mandatory")
+    merge.add_argument("--lyapunov-file", required=False, type=str, default="lyapunov.png", help="Name of Lyapunov exponent plot file, optional")
+    args = self.parser.parse_args(sys.argv[2:])
+    return vars(args)
+
+  def handle_sweep_args(self):
+    """
+    Parse arguments of `sweep` command from command line
+    @returns Dictionary containing sweep specification, loaded from JSON file and updated with command line overrides
+    """
+    self.parser = argparse.ArgumentParser(
+      prog='main.py sweep',
+      description='Run a declarative parameter sweep described by a JSON file, see `src/Sweep.py` for its format\n',
+      epilog=self.print_available_modes(),
+      formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    self.parser.add_argument("spec", type=str, help="Path to JSON sweep specification, mandatory")
+    self.parser.add_argument("--output", required=False, type=str, default=None, help="CSV file results are appended to, optional")
+    self.parser.add_argument("--workers", required=False, type=int, default=None, help="Size of a process pool, optional")
+    self.parser.add_argument("--design", required=False, choices=('grid', 'lhs', 'sobol'), default=None, help="Design of experiment, optional")
+    self.parser.add_argument("--samples", required=False, type=int, default=None, help="Number of lhs/sobol samples, optional")
+    args = self.parser.parse_args(sys.argv[2:])
+
+    try:
+      with open(args.spec) as file:
+        spec = json.load(file)
+    except (OSError, json.JSONDecodeError) as e:
+      self.logger.critical(f"Could not load sweep specification: {e}")
+      sys.exit(2)
+    for key in ('output', 'workers', 'design', 'samples'):
+      if getattr(args, key) is not None:
+        spec[key] = getattr(args, key)
+    try:
+      self.validator(spec.get('configuration', ''))
+    except argparse.ArgumentTypeError as e:
+      self.logger.critical(e)
+      sys.exit(2)
+    return spec
+
   def handle_args(self):
     """
     Parse arguments from command line
@@ -75,7 +333,16 @@ class ThreeBodyArgParser:
     self.parser.add_argument("--detailed-phase-file", required=False, type=str, default="detailed_phase_plot.png", help="Name of detailed phase plot file, optional")
     self.parser.add_argument("--animation-file", required=False, type=str, default="three_body_animation.gif", help="Name of animation file, optional")
     self.parser.add_argument("--lyapunov-file", required=False, type=str, default="lyapunov.png", help="Name of Lyapunov exponent plot file, optional")
+    self.parser.add_argument("--stability-map-file", required=False, type=str, default="stability_map.png", help="Name of stability map plot file, optional")
     self.parser.add_argument("-q", "--quiet", action='store_true', help="If set, no interactive windows will pop up, plots will still be saved, optional")
+    self.parser.add_argument("--profile", action='store_true', help="If set, per-stage timings, solver statistics and peak memory are measured and saved, optional")
+    self.parser.add_argument("--profile-file", required=False, type=str, default="profile.json", help="Name of profiling metrics file, .csv extension selects CSV format, JSON otherwise, optional")
+    self.parser.add_argument("--live", action='store_true', help="If set, bodies are drawn while the system is being integrated, optional")
+    self.parser.add_argument("--live-file", required=False, type=str, default=None, help="Name of file live frames are written to as they arrive (.gif or .mp4), optional")
+    self.parser.add_argument("--parareal", required=False, type=int, default=None, metavar="SLICES", help="If set, solve with time-parallel Parareal algorithm using given number of time slices, optional")
+    self.parser.add_argument("--parareal-coarse", required=False, choices=('leapfrog', 'rk'), default='leapfrog', help="Coarse propagator used by Parareal, optional")
+    self.parser.add_argument("--model-reduction", action='store_true', help="If set, binary and escaper are propagated as Kepler orbits once a body escapes, optional")
+    self.add_output_arguments()
 
     try:
       args = self.parser.parse_args()
@@ -92,6 +359,23 @@ class ThreeBodyArgParser:
       "detailed_phase_file": args.detailed_phase_file,
       "animation_file": args.animation_file,
       "lyapunov_file": args.lyapunov_file,
-      "quiet": args.quiet
+      "stability_map_file": args.stability_map_file,
+      "quiet": args.quiet,
+      "profile": args.profile,
+      "profile_file": args.profile_file,
+      "live": args.live or args.live_file is not None,
+      "live_file": args.live_file
     }
-    return [mode[1] for mode in self.available_modes if mode[0] == args.configuration][0], plot_params
+    if args.parareal is not None and args.parareal < 1:
+      self.parser.error(f"--parareal needs at least one time slice, got {args.parareal}")
+    if args.parareal and plot_params["live"]:
+      self.logger.warning("Live view is not available with Parareal, it will be disabled")
+    if args.model_reduction and plot_params["live"]:
+      self.logger.warning("Live view is not available with model reduction, it will be disabled")
+    if args.parareal:
+      plot_params["parareal"] = {"slices": args.parareal, "coarse": args.parareal_coarse}
+    if args.model_reduction:
+      plot_params["model_reduction"] = {}
+    if self.output_policy(args):
+      plot_params["output_policy"] = self.output_policy(args)
+    return self.get_configuration(args.configuration), plot_params
@@ -0,0 +1,203 @@
+""" @package BarnesHut
+
+@brief Barnes-Hut tree force evaluation for large numbers of bodies
+
+@details This module defines BarnesHutSolver class, an alternative to `pairwise_accelerations` from `src/Bodies.py`
+which evaluates gravitational accelerations in O(N log N) instead of O(N^2).
+Bodies are grouped in a quadtree (2D) or an octree (3D); distant groups are approximated by their total
+mass placed at their centre of mass. A group of extent `s` seen from distance `d` is approximated
+when `s / d < theta`, so `theta` (opening angle) trades accuracy for speed, `theta == 0` is exact.
+`theta` is limited to `[0, 1]`: above 1 a node could be accepted by a body it contains, adding its self-interaction.
+
+Both tree construction and traversal are vectorized level by level with `numpy`, there is no per-body Python loop.
+Tree topology changes slowly between consecutive right hand side evaluations, therefore it is rebuilt only every
+`rebuild_every` calls. In between, the tree is refitted: masses, centres of mass and extents of nodes are recomputed
+for current positions while assignment of bodies to nodes is kept.
+
+Usage example:
+@code
+  solver = BarnesHutSolver(theta=0.5)
+  acc = solver.accelerations(positions, masses, G)
+@endcode
+"""
+
+import numpy as np
+
+def _expand(starts, counts):
+  """Expand `(start, count)` ranges into a flat array of indices
+  @param starts Array of range beginnings
+  @param counts Array of range lengths
+  @returns Concatenation of `arange(start, start + count)` for all ranges
+  """
+  offsets = np.cumsum(counts) - counts
+  return np.arange(counts.sum()) - np.repeat(offsets - starts, counts)
+
+class BarnesHutSolver:
+  """Class that evaluates gravitational accelerations with Barnes-Hut approximation"""
+  def __init__(self, theta=0.5, leaf_size=8, max_depth=32, rebuild_every=10):
+    """Constructor for BarnesHutSolver
+    @param theta Opening angle, smaller is more accurate
+    @param leaf_size Maximal number of bodies in a leaf node, these interact directly
+    @param max_depth Depth limit of a tree, guards against coincident bodies
+    @param rebuild_every Number of evaluations after which tree topology is rebuilt, tree is only refitted in between
+    @throws ValueError Thrown if theta is outside `[0, 1]`
+    """
+    if not 0 <= theta <= 1:
+      raise ValueError(f"Barnes-Hut opening angle must lie within [0, 1], got {theta}")
+    ## Opening angle
+    self.theta = theta
+    ## Maximal number of bodies in a leaf node
+    self.leaf_size = leaf_size
+    ## Depth limit of a tree
+    self.max_depth = max_depth
+    ## Number of evaluations between tree rebuilds
+    self.rebuild_every = rebuild_every
+    ## Evaluations since last rebuild, `None` if tree was never built
+    self.evaluations = None
+
+  def build(self, positions):
+    """Build tree topology for given positions
+    @param positions Array of shape `(N, dim)`
+    """
+    n, dim = positions.shape
+    low, high = positions.min(axis=0), positions.max(axis=0)
+    centers = [(low + high)[np.newaxis, :] / 2]
+    halves = [np.array([max(np.max(high - low) / 2, np.finfo(float).tiny)])]
+    # path[level][i] is a node containing body i at a given level, -1 below body's leaf
+    path = []
+    child_start, child_count, leaf_start, leaf_count, leaf_particles = [], [], [], [], []
+
+    active = np.arange(n)
+    active_node = np.zeros(n, dtype=np.int64)
+    level_first, level_size, next_leaf = 0, 1, 0
+    for depth in range(self.max_depth + 1):
+      level = np.full(n, -1, dtype=np.int64)
+      level[active] = active_node
+      path.append(level)
+
+      local = active_node - level_first
+      counts = np.bincount(local, minlength=level_size)
+      is_leaf = (counts <= self.leaf_size) | (depth == self.max_depth)
+
+      # bodies of leaf nodes are stored contiguously, ordered by node
+      in_leaf = is_leaf[local]
+      leaf_bodies = active[in_leaf]
+      leaf_bodies = leaf_bodies[np.argsort(local[in_leaf], kind='stable')]
+      leaf_particles.append(leaf_bodies)
+      counts_in_leaves = np.where(is_leaf, counts, 0)
+      leaf_start.append(next_leaf + np.cumsum(counts_in_leaves) - counts_in_leaves)
+      leaf_count.append(counts_in_leaves)
+      next_leaf += len(leaf_bodies)
+
+      # remaining bodies descend into children, a child is created only if it contains any bodies
+      active, local = active[~in_leaf], local[~in_leaf]
+      center, half = centers[-1][local], halves[-1][local]
+      upper = positions[active] >= center
+      octant = (upper * (1 << np.arange(dim))).sum(axis=1)
+      keys, inverse = np.unique(local * (1 << dim) + octant, return_inverse=True)
+      parents = keys >> dim
+      next_first = level_first + level_size
+      child_count.append(np.bincount(parents, minlength=level_size))
+      child_start.append(next_first + np.cumsum(child_count[-1]) - child_count[-1])
+      if len(keys) == 0:
+        break
+
+      bits = (keys[:, np.newaxis] >> np.arange(dim)) & 1
+      child_half = halves[-1][parents] / 2
+      centers.append(centers[-1][parents] + (2 * bits - 1) * child_half[:, np.newaxis])
+      halves.append(child_half)
+      active_node = next_first + inverse.reshape(-1)
+      level_first, level_size = next_first, len(keys)
+
+    ## Bodies contained by each level's nodes, used by refit
+    self.path = path
+    ## Index of first child of each node
+    self.child_start = np.concatenate(child_start)
+    ## Number of children of each node
+    self.child_count = np.concatenate(child_count)
+    ## Index of first body of each leaf node in `leaf_particles`
+    self.leaf_start = np.concatenate(leaf_start)
+    ## Number of bodies of each leaf node, `0` for internal nodes
+    self.leaf_count = np.concatenate(leaf_count)
+    ## Bodies of all leaf nodes, grouped by node
+    self.leaf_particles = np.concatenate(leaf_particles)
+    ## Total number of nodes
+    self.n_nodes = len(self.child_count)
+    self.evaluations = 0
+
+  def refit(self, positions, masses):
+    """Recompute masses, centres of mass and extents of all nodes for current positions
+    @param positions Array of shape `(N, dim)`
+    @param masses Array of shape `(N,)`
+    """
+    dim = positions.shape[1]
+    self.mass = np.zeros(self.n_nodes)
+    self.com = np.zeros((self.n_nodes, dim))
+    self.radius = np.zeros(self.n_nodes)
+    for level in self.path:
+      members = np.nonzero(level >= 0)[0]
+      nodes = level[members]
+      self.mass += np.bincount(nodes, weights=masses[members], minlength=self.n_nodes)
+      for axis in range(dim):
+        self.com[:, axis] += np.bincount(nodes, weights=masses[members] * positions[members, axis], minlength=self.n_nodes)
+    # massless nodes keep their centre at the origin, they never contribute any force
+    self.com /= np.where(self.mass > 0, self.mass, 1.0)[:, np.newaxis]
+    for level in self.path:
+      members = np.nonzero(level >= 0)[0]
+      nodes = level[members]
+      distance = np.sqrt(((positions[members] - self.com[nodes])**2).sum(axis=1))
+      np.maximum.at(self.radius, nodes, distance)
+
+  def accelerations(self, positions, masses, G, softening=0.0):
+    """Gravitational accelerations of all bodies, signature matches `pairwise_accelerations`
+    @param positions Array of shape `(N, dim)`
+    @param masses Array of shape `(N,)`
+    @param G Gravitational constant
+    @param softening Plummer softening length, `0` means exact Newtonian gravity
+    @returns Array of shape `(N, dim)`
+    """
+    n, dim = positions.shape
+    if self.evaluations is None or self.evaluations >= self.rebuild_every or len(self.path[0]) != n:
+      self.build(positions)
+    self.refit(positions, masses)
+    self.evaluations += 1
+
+    acc = np.zeros((n, dim))
+    softening_sq = softening**2
+    theta_sq = self.theta**2
+
+    def add(bodies, displacement, weights):
+      """Accumulate `weights * displacement / |displacement|^3` into accelerations of `bodies`"""
+      dist_sq = (displacement**2).sum(axis=1) + softening_sq
+      factor = weights * dist_sq**-1.5
+      for axis in range(dim):
+        acc[:, axis] += np.bincount(bodies, weights=factor * displacement[:, axis], minlength=n)
+
+    # interaction list of (body, node) pairs, every body starts at the root
+    bodies = np.arange(n)
+    nodes = np.zeros(n, dtype=np.int64)
+    while len(bodies):
+      displacement = self.com[nodes] - positions[bodies]
+      dist_sq = (displacement**2).sum(axis=1)
+      # a node containing the body always has (2 * radius)^2 >= dist_sq, so it is never accepted as theta <= 1
+      accepted = 4 * self.radius[nodes]**2 < theta_sq * dist_sq
+      add(bodies[accepted], displacement[accepted], self.mass[nodes[accepted]])
+
+      rejected = ~accepted
+      bodies, nodes = bodies[rejected], nodes[rejected]
+      leaf = self.leaf_count[nodes] > 0
+
+      # leaves interact directly, body by body
+      counts = self.leaf_count[nodes[leaf]]
+      sources = self.leaf_particles[_expand(self.leaf_start[nodes[leaf]], counts)]
+      targets = np.repeat(bodies[leaf], counts)
+      other = sources != targets
+      sources, targets = sources[other], targets[other]
+      add(targets, positions[sources] - positions[targets], masses[sources])
+
+      # remaining nodes are opened
+      counts = self.child_count[nodes[~leaf]]
+      nodes = _expand(self.child_start[nodes[~leaf]], counts)
+      bodies = np.repeat(bodies[~leaf], counts)
+
+    return G * acc
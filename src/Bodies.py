@@ -0,0 +1,190 @@
+""" @package Bodies
+
+@brief Struct-of-arrays body table and vectorized gravity kernel
+
+@details This module converts per-body `ObjectParams2D`/`ObjectParams3D` entries of a params dictionary
+into contiguous arrays and defines vectorized acceleration kernel used by simulators, along with its analytic
+Jacobian used by variational equations.
+Bodies are held under consecutive numeric string keys `1`, `2`, ..., `N`, so three body configurations
+are loaded unchanged and adding a moon or a planet is a matter of adding another key.
+
+State vector layout used across the program is `[positions, velocities]`, each flattened body by body:
+`[x1, y1, (z1), x2, y2, (z2), ..., vx1, vy1, (vz1), ...]`. Simulation is two dimensional unless any body
+is described by `ObjectParams3D`, in which case all bodies are simulated in 3D.
+For three bodies in 2D this is exactly the historical 12 element layout.
+
+Usage example:
+@code
+  bodies = BodyTable.from_params(params)
+  state = bodies.state()
+  acc = pairwise_accelerations(bodies.positions, bodies.masses, params['G'])
+  jacobian = acceleration_jacobian(bodies.positions[:, :bodies.dim], bodies.masses, params['G'])
+  x_of_body_2 = solution.y[bodies.position_index(2, 0)]
+@endcode
+"""
+
+from .Utils import *
+
+import dataclasses
+import hashlib
+import json
+
+def body_keys(params):
+  """Find keys of all bodies in params dictionary
+  @param params Simulation parameters
+  @returns List of keys `['1', '2', ..., 'N']`
+  @throws KeyError Thrown if body numbering is not consecutive
+  """
+  numbers = sorted(int(key) for key in params if isinstance(key, str) and key.isdigit())
+  if numbers != list(range(1, len(numbers) + 1)):
+    raise KeyError(f"Bodies must be numbered consecutively starting from 1, got {numbers}")
+  return [str(number) for number in numbers]
+
+def system_fingerprint(params, **settings):
+  """Hash of parameters which determine a trajectory: bodies, `G`, `softening` and force solver settings.
+  Results kept between runs are tagged with it, so results of a changed configuration are never mixed in
+  @param params Simulation parameters
+  @param settings Further settings hashed together with the system, e.g. tolerances
+  @returns Hex digest
+  """
+  def encode(value):
+    if dataclasses.is_dataclass(value):
+      return dataclasses.asdict(value)
+    if isinstance(value, (np.ndarray, np.generic)):
+      return value.tolist()
+    raise TypeError(f"Cannot fingerprint {type(value).__name__}")
+
+  system = {key: params[key] for key in body_keys(params)}
+  for key in ('G', 'softening', 'force_solver', 'opening_angle'):
+    system[key] = params.get(key, None)
+  data = json.dumps([system, settings], sort_keys=True, default=encode)
+  return hashlib.sha256(data.encode()).hexdigest()
+
+def pairwise_accelerations(positions, masses, G, softening=0.0):
+  """Gravitational accelerations of all bodies, direct O(N^2) summation
+  @param positions Array of shape `(N, dim)`
+  @param masses Array of shape `(N,)`
+  @param G Gravitational constant
+  @param softening Plummer softening length, `0` means exact Newtonian gravity
+  @returns Array of shape `(N, dim)`
+  """
+  # displacement[i, j] = r_j - r_i
+  displacement = positions - positions[:, np.newaxis]
+  dist_sq = (displacement * displacement).sum(axis=2)
+  if softening:
+    dist_sq += softening**2
+  # body does not attract itself
+  dist_sq.flat[::len(masses) + 1] = np.inf
+  weights = (G * masses) * dist_sq**-1.5
+  return (weights[:, :, np.newaxis] * displacement).sum(axis=1)
+
+def acceleration_jacobian(positions, masses, G, softening=0.0):
+  """Analytic Jacobian of gravitational accelerations with respect to positions, direct O(N^2) summation
+  @param positions Array of shape `(N, dim)`
+  @param masses Array of shape `(N,)`
+  @param G Gravitational constant
+  @param softening Plummer softening length, `0` means exact Newtonian gravity
+  @returns Array of shape `(N*dim, N*dim)`, element `[dim*i + a, dim*j + b]` is derivative of
+  acceleration component `a` of body `i` with respect to position component `b` of body `j`
+  """
+  n, dim = positions.shape
+  displacement = positions - positions[:, np.newaxis]
+  dist_sq = (displacement * displacement).sum(axis=2)
+  if softening:
+    dist_sq += softening**2
+  dist_sq.flat[::n + 1] = np.inf
+  # d a_i / d r_j = G m_j (I / r^3 - 3 d d^T / r^5) for j != i
+  weights = (G * masses) * dist_sq**-1.5
+  blocks = weights[:, :, np.newaxis, np.newaxis] * (
+    np.eye(dim) - 3 * displacement[:, :, :, np.newaxis] * displacement[:, :, np.newaxis, :] / dist_sq[:, :, np.newaxis, np.newaxis]
+  )
+  # a_i depends on r_i only through differences r_j - r_i, so d a_i / d r_i balances other blocks of a row
+  blocks[np.arange(n), np.arange(n)] = -blocks.sum(axis=1)
+  return blocks.transpose(0, 2, 1, 3).reshape(n * dim, n * dim)
+
+class BodyTable:
+  """Struct-of-arrays representation of all bodies in a simulation"""
+  def __init__(self, positions, velocities, masses, dim):
+    ## Positions, array of shape `(N, 3)`
+    self.positions = np.ascontiguousarray(positions, dtype=np.float64)
+    ## Velocities, array of shape `(N, 3)`
+    self.velocities = np.ascontiguousarray(velocities, dtype=np.float64)
+    ## Masses, array of shape `(N,)`
+    self.masses = np.ascontiguousarray(masses, dtype=np.float64)
+    ## Number of simulated spatial dimensions, `2` or `3`
+    self.dim = dim
+
+  @classmethod
+  def from_params(cls, params):
+    """Build body table from params dictionary
+    @param params Simulation parameters containing bodies under keys `1`..`N`
+    @returns BodyTable object
+    """
+    bodies = [params[key] for key in body_keys(params)]
+    positions = np.zeros((len(bodies), 3))
+    velocities = np.zeros((len(bodies), 3))
+    masses = np.zeros(len(bodies))
+    dim = 2
+    for i, body in enumerate(bodies):
+      positions[i, :2] = body.x_0, body.y_0
+      velocities[i, :2] = body.vx_0, body.vy_0
+      if isinstance(body, ObjectParams3D):
+        positions[i, 2] = body.z_0
+        velocities[i, 2] = body.vz_0
+        dim = 3
+      masses[i] = body.m
+    return cls(positions, velocities, masses, dim)
+
+  @property
+  def n(self):
+    """Number of bodies"""
+    return len(self.masses)
+
+  def state(self):
+    """Flattened state vector `[positions, velocities]` in simulated dimensions"""
+    return np.concatenate((self.positions[:, :self.dim].ravel(), self.velocities[:, :self.dim].ravel()))
+
+  def position_index(self, body_no, axis):
+    """Index of a position component in a state vector
+    @param body_no Body number, starting from 1
+    @param axis `0`, `1` or `2` for x, y and z respectively
+    """
+    return self.dim * (body_no - 1) + axis
+
+  def velocity_index(self, body_no, axis):
+    """Index of a velocity component in a state vector
+    @param body_no Body number, starting from 1
+    @param axis `0`, `1` or `2` for x, y and z respectively
+    """
+    return self.n * self.dim + self.dim * (body_no - 1) + axis
+
+def total_energy(positions, velocities, masses, G, softening=0.0):
+  """Total (kinetic and potential) energy of a system of bodies
+  @param positions Array of shape `(N, dim)`
+  @param velocities Array of shape `(N, dim)`
+  @param masses Array of shape `(N,)`
+  @param G Gravitational constant
+  @param softening Plummer softening length, must match the one used for integration
+  @returns Energy in units implied by `G`
+  """
+  kinetic = 0.5 * np.sum(masses * np.sum(velocities**2, axis=1))
+  i, j = np.triu_indices(len(masses), 1)
+  distance = np.sqrt(np.sum((positions[i] - positions[j])**2, axis=1) + softening**2)
+  potential = -G * np.sum(masses[i] * masses[j] / distance)
+  return kinetic + potential
+
+def state_energy(state, bodies, G, softening=0.0):
+  """Total energy of a flattened state vector
+  @param state State vector `[positions, velocities]`, or an array of shape `(state_size, steps)`
+  @param bodies BodyTable describing the state layout and masses
+  @param G Gravitational constant
+  @param softening Plummer softening length
+  @returns Energy, or array of energies for every step
+  """
+  state = np.asarray(state)
+  if state.ndim == 2:
+    return np.array([state_energy(column, bodies, G, softening) for column in state.T])
+  half = len(state) // 2
+  positions = state[:half].reshape(bodies.n, bodies.dim)
+  velocities = state[half:].reshape(bodies.n, bodies.dim)
+  return total_energy(positions, velocities, bodies.masses, G, softening)
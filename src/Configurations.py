@@ -4,14 +4,21 @@
 
 @details This module defines predefined configurations of various three body problems which can be selected from command line.
 Each function defined here returns a dictionary containing all data needed for differential equation solver
-to solve a given problem. Each dictionary **must** contain exactly 3 `ObjectParams2D` objects under `1`, `2` and `3`
-dictionary keys, `days` parameter, and `G` parameter. Other parameters are optional, but may disable some parts
+to solve a given problem. Each dictionary **must** contain `ObjectParams2D` objects under `1`, `2` and `3`
+dictionary keys, `days` parameter, and `G` parameter. Additional bodies (planets, moons) can be added under
+consecutive keys `4`, `5`, ..., and any body described by `ObjectParams3D` switches simulation to 3D. Other parameters are optional, but may disable some parts
 of the program (e.g. not specifying `frames` results in lack of animation generation).
 
 Parameters overview:
 - `1`/`2`/`3` - `ObjectParams2D`s containing initial conditions and masses of each body
+- `4`, `5`, ... - optional additional bodies
 - `G` - value of gravitational constant, some configurations run with `G == 1`, some with real life value
 - `days` - upper bound of simulation time, it might be fractional (e.g. value 1/24 specifies one hour)
+- `softening` - optional Plummer softening length, prevents singular accelerations in close encounters, defaults to `0`
+- `force_solver` - optional, `direct` (default) O(N^2) summation or `barnes_hut` tree approximation for large numbers of bodies
+- `opening_angle` - accuracy parameter of `barnes_hut` solver within `[0, 1]`, smaller is more accurate, defaults to `0.5`
+- `rtol`/`atol` - optional relative and absolute tolerances of differential equation solver, default to `1e-8`
+- `plot_bodies` - optional number of leading bodies drawn individually, remaining ones are drawn as a cloud of points
 - `frames` - total animation frames, this parameter is directly passed to `matplotlib.animation.FuncAnimation` handler, ommitting it disables animation generation
 - `title` - if set, plots will have this string displayed above them
 - `phase_detailed_x` - creating such dictionary implies zoomed phase plot generation for x/vx parameters of specified body
@@ -23,6 +30,20 @@ Parameters overview:
   - `range` defines an iterable containing a range of change for a given parameter TODO this is hardcoded 
   - `param` sets a label for x axis, this argument is passed directly to `matplotlib.pyplot`
   - `days` specifies maximum simulation time for each Lyapunov exponent, it is usually shorter than normal simulation time
+  - `early_stopping` - if set (default), each point stops integrating once its running estimate converges, see `LyapunovAnalyzer.estimate_exponent`
+  - `check_steps`, `tol`, `patience` - convergence check interval in solver steps, tolerance and number of consecutive passed checks, default to `1000`, `0.05` and `3`
+  - `regular_below`/`chaotic_above` - optional thresholds which stop a point as soon as its running estimate crosses them
+  - `stall` - a point stops once its solver advances by less than this fraction of `days` over `check_steps` steps (a close encounter its step size collapsed in), defaults to `1e-9`, `None` disables it
+- `stability_map` - creating such dictionary implies generating a 2D stability map over two initial condition parameters, see `src/StabilityMap.py` for available keys
+- `parareal` - creating such dictionary implies solving with time-parallel Parareal algorithm, see `src/Parareal.py` for available keys
+- `model_reduction` - creating such dictionary (even an empty one) implies propagating binary and escaper as Kepler orbits once a body escapes, see `src/Hierarchical.py` for available keys
+- `output_policy` - optional dictionary selecting stored output (output grid, closest approach events, dense output, precision), see `src/Simulator.py` for available keys
+- `periodic_orbit` - optional settings of `orbits` command, see `src/PeriodicOrbits.py` for available keys
+
+Configurations can also be loaded from TOML or JSON scenario files holding the same parameters, see `src/Scenarios.py`.
+
+Configurations listed in `HEAVY` take far longer than the rest (a 2000 body debris cloud, a stability map), `batch all`
+leaves them out and `batch heavy` runs them.
 
 Usage example:
 @code
@@ -37,6 +58,9 @@ Usage example:
 
 from .Utils import *
 
+## Configurations excluded from `batch all`, selected with `batch heavy`
+HEAVY = ('sun_earth_mars_debris', 'burrau_stability_map')
+
 def sun_earth_mars():
   """Sun-Earth-Mars system
   @returns Dictionary with simulation parameters
@@ -51,6 +75,33 @@ def sun_earth_mars():
   params['title'] = "Sun-Earth-Mars system"
   return params
 
+def sun_earth_mars_debris():
+  """Sun-Earth-Mars system with a debris cloud of 2000 particles between Earth and Mars orbits
+  @returns Dictionary with simulation parameters
+  """
+  params = sun_earth_mars()
+  rng = np.random.default_rng(0)
+  debris_count = 2000
+  radius = rng.uniform(1.7e11, 2.1e11, debris_count)
+  angle = rng.uniform(0, 2*np.pi, debris_count)
+  speed = np.sqrt(params['G'] * params['1'].m / radius)
+  for i in range(debris_count):
+    params[str(4 + i)] = ObjectParams2D(
+      radius[i]*np.cos(angle[i]),
+      radius[i]*np.sin(angle[i]),
+      -speed[i]*np.sin(angle[i]),
+      speed[i]*np.cos(angle[i]),
+      1e15
+    )
+  params['days'] = 30
+  params['frames'] = 100
+  params['rtol'] = 1e-6
+  params['force_solver'] = 'barnes_hut'
+  params['opening_angle'] = 0.5
+  params['plot_bodies'] = 3
+  params['title'] = "Sun-Earth-Mars system with debris cloud"
+  return params
+
 def newton_problem():
   """Sun-Earth-Moon system
   @returns Dictionary with simulation parameters
@@ -65,6 +116,26 @@ def newton_problem():
   params['title'] = "Newton problem (Sun-Earth-Moon system)"
   return params
 
+def sun_earth_moon_mars():
+  """Sun-Earth-Moon-Mars system, with Moon's orbit inclined to the ecliptic
+  @returns Dictionary with simulation parameters
+  """
+  params = {}
+  params['G'] = 6.67430e-11
+  inclination = np.radians(5.145)
+  params['1'] = ObjectParams2D(0, 0, 0, 0, 1.989e30)            # sun
+  params['2'] = ObjectParams2D(0, 1.5e11, 29.78e3, 0, 5.97e24)  # earth
+  params['3'] = ObjectParams2D(0, 2.28e11, 24.07e3, 0, 6.42e23) # mars
+  params['4'] = ObjectParams3D(                                 # moon
+    0, 1.5e11+384_400_000, 0,
+    29.78e3+1022*np.cos(inclination), 0, 1022*np.sin(inclination),
+    7.35e22
+  )
+  params['days'] = 365
+  params['frames'] = 500
+  params['title'] = "Sun-Earth-Moon-Mars system"
+  return params
+
 def triangle():
   """Equilateral triangle
   @returns Dictionary with simulation parameters
@@ -160,6 +231,28 @@ def burrau_less_shifted():
 
   return params
 
+def burrau_stability_map():
+  """Burrau problem (3-4-5 triangle) with an escape time map over initial position of body 3
+  @see https://en.wikipedia.org/wiki/Three-body_problem#Special-case_solutions
+  @returns Dictionary with simulation parameters
+  """
+  params = burrau()
+  del params['lyapunov']
+  params['title'] = "Burrau problem"
+
+  params['stability_map'] = {}
+  params['stability_map']['x'] = (3, 'x_0')
+  params['stability_map']['xrange'] = (-1, 1)
+  params['stability_map']['y'] = (3, 'y_0')
+  params['stability_map']['yrange'] = (3, 5)
+  params['stability_map']['indicator'] = 'escape'
+  params['stability_map']['days'] = 20
+  params['stability_map']['coarse'] = 9
+  params['stability_map']['levels'] = 2
+  params['stability_map']['file'] = 'burrau_stability_map'
+
+  return params
+
 # https://arxiv.org/pdf/1705.00527
 
 def xiaoming_li_et_all_1():
@@ -0,0 +1,187 @@
+""" @package Ensemble
+
+@brief Ensemble runs over tables of initial conditions
+
+@details This module defines EnsembleRun class which evaluates a configuration for every row of a table of
+initial conditions (CSV or `.npy`, see `src/Scenarios.py`). Column names are parameter paths, same as in
+sweeps (`G`, `days` or `<body_no>.<field>`, e.g. `2.x_0`), parameters missing from the table keep values of the
+base configuration. A plain 2D `.npy` array without column names is accepted if it holds every field of every
+body, body after body, in dataclass order (`1.x_0`, `1.y_0`, `1.vx_0`, `1.vy_0`, `1.m`, `2.x_0`, ... in 2D).
+
+Columns are validated once, before anything is integrated. The table is then streamed in chunks: at most
+two chunks per worker are in flight, so memory use does not depend on table size. Rows containing
+non-finite values or non-positive masses are rejected with a vectorized check per chunk.
+
+Each row computes the same observables as a sweep (see `src/Sweep.py`). Results are appended to a CSV file
+with a `row` column and one column per observable. Rows already present in the output file are skipped,
+so an interrupted run resumes where it stopped.
+
+Usage example:
+@code
+  ensemble = EnsembleRun(Configurations.burrau(), 'ics.npy', 'ensemble.csv', chunk_size=256)
+  ensemble.run()
+@endcode
+"""
+
+from .Scenarios import InitialConditionTable
+from .Sweep import OBSERVABLES, check_parameter_path, _run_point
+
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import csv
+import dataclasses
+import logging
+import os
+import sys
+
+import numpy as np
+
+def default_columns(params):
+  """Column names of a table holding every field of every body
+  @param params Simulation parameters
+  @returns List of parameter paths
+  """
+  from .Bodies import body_keys
+  return [
+    f"{key}.{field.name}"
+    for key in body_keys(params)
+    for field in dataclasses.fields(params[key])
+  ]
+
+def _run_chunk(base_params, columns, start, rows, observables, rtol, atol, lyapunov_body):
+  """Integrate every row of a chunk, executed in worker processes
+  @param base_params Base simulation parameters
+  @param columns Parameter paths of table columns
+  @param start Index of first row of the chunk
+  @param rows 2D array of parameter values
+  @param observables List of observables names
+  @param rtol Relative tolerance
+  @param atol Absolute tolerance
+  @param lyapunov_body Body used by `lyapunov` observable
+  @returns List of `(row, results, error)` tuples, `results` is `None` for failed rows
+  """
+  output = []
+  for offset, values in enumerate(rows):
+    point = dict(zip(columns, values.tolist()))
+    try:
+      _, results, _ = _run_point(base_params, point, observables, rtol, atol, lyapunov_body)
+      output.append((start + offset, results, None))
+    except Exception as e:
+      output.append((start + offset, None, f"{type(e).__name__}: {e}"))
+  return output
+
+class EnsembleRun:
+  """Class that integrates a configuration for every row of an initial condition table"""
+  def __init__(self, params, table_path, output='ensemble.csv', chunk_size=256, workers=None, observables=OBSERVABLES, columns=None, rtol=1e-6, atol=1e-6, lyapunov_body=1):
+    """Constructor for EnsembleRun, validates table columns up front
+    @param params Base simulation parameters
+    @param table_path Path to `.csv` or `.npy` table of initial conditions
+    @param output CSV file results are appended to
+    @param chunk_size Number of rows sent to a worker at once
+    @param workers Size of a process pool, defaults to number of available cores
+    @param observables List of computed observables, see `src/Sweep.py`
+    @param columns Column names of a plain 2D `.npy` table, all fields of all bodies if not set
+    @param rtol Relative tolerance
+    @param atol Absolute tolerance
+    @param lyapunov_body Body used by `lyapunov` observable
+    @throws ValueError Thrown if table columns or observables are invalid
+    """
+    ## Base simulation parameters
+    self.params = params
+    ## Output CSV file
+    self.output = output
+    ## Number of rows per chunk
+    self.chunk_size = chunk_size
+    ## Size of a process pool
+    self.workers = workers or os.cpu_count()
+    ## Computed observables
+    self.observables = list(observables)
+    ## Solver tolerances and body used by `lyapunov` observable
+    self.arguments = (self.observables, rtol, atol, lyapunov_body)
+    ## Global logger reference
+    self.logger = logging.getLogger("main")
+
+    for observable in self.observables:
+      if observable not in OBSERVABLES:
+        raise ValueError(f"Unknown observable \"{observable}\", available: {', '.join(OBSERVABLES)}")
+    ## Table of initial conditions
+    self.table = InitialConditionTable(table_path, columns or default_columns(params))
+    for path in self.table.columns:
+      check_parameter_path(params, path)
+    ## Indices of mass columns, checked for positive values
+    self.mass_columns = [i for i, path in enumerate(self.table.columns) if path.endswith('.m')]
+
+  def completed(self):
+    """Indices of rows already present in output file
+    @returns Set of row indices
+    @throws ValueError Thrown if output file has different columns
+    """
+    if not os.path.exists(self.output):
+      return set()
+    with open(self.output, newline='') as file:
+      reader = csv.DictReader(file)
+      if reader.fieldnames != ['row'] + self.observables:
+        raise ValueError(f"Output file \"{self.output}\" has different columns, choose another one")
+      return {int(row['row']) for row in reader}
+
+  def chunks(self, done):
+    """Valid, not yet computed chunks of the table
+    @param done Set of row indices already computed
+    @returns Generator of `(start, rows)` tuples, rows already computed or invalid are dropped
+    """
+    for start, rows in self.table.chunks(self.chunk_size):
+      indices = np.arange(start, start + len(rows))
+      valid = np.isfinite(rows).all(axis=1)
+      if self.mass_columns:
+        valid &= (rows[:, self.mass_columns] > 0).all(axis=1)
+      for index in indices[~valid]:
+        self.logger.error(f"Row {index} of \"{self.table.path}\" has non-finite values or non-positive masses, skipping it")
+      pending = valid & ~np.isin(indices, list(done))
+      # keep chunks contiguous, so row index is start + offset
+      for run_start, run_stop in self.runs(pending):
+        yield start + run_start, rows[run_start:run_stop]
+
+  @staticmethod
+  def runs(mask):
+    """Contiguous runs of set values of a boolean mask
+    @returns List of `(start, stop)` tuples
+    """
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    return list(zip(np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)))
+
+  def run(self):
+    """Integrate all rows which are not present in output file yet
+    @returns Number of computed rows
+    """
+    from tqdm import tqdm
+
+    done = self.completed()
+    self.logger.warning(f"Running ensemble from \"{self.table.path}\" ({len(done)} rows already computed), it will take some time")
+    new_file = not os.path.exists(self.output)
+    computed = 0
+    with open(self.output, 'a', newline='') as file, ProcessPoolExecutor(max_workers=self.workers) as executor, tqdm(file=sys.stdout) as progress:
+      writer = csv.writer(file)
+      if new_file:
+        writer.writerow(['row'] + self.observables)
+      in_flight = set()
+      chunks = self.chunks(done)
+      while True:
+        for start, rows in chunks:
+          in_flight.add(executor.submit(_run_chunk, self.params, self.table.columns, start, rows, *self.arguments))
+          if len(in_flight) >= 2 * self.workers:
+            break
+        if not in_flight:
+          break
+        finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+        for future in finished:
+          for row, results, error in future.result():
+            if error is not None:
+              self.logger.error(f"Row {row} failed, it will be retried on next run: {error}")
+              continue
+            writer.writerow([row] + [repr(float(results[name])) for name in self.observables])
+            computed += 1
+          file.flush()
+          progress.update(len(future.result()))
+
+    self.logger.info(f"Ensemble done, {computed} rows computed, results saved to \"{self.output}\"")
+    return computed
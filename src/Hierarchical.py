@@ -0,0 +1,523 @@
+""" @package Hierarchical
+
+@brief Adaptive model reduction of hierarchical three body systems
+
+@details This module defines HierarchicalSimulator class which solves the same problem as ThreeBodySimulator,
+but stops resolving the full three body interaction once one body leaves a bound binary. Chaotic runs (e.g.
+`burrau`) often end with an ejection, from then on the system is a binary and a distant receding body whose
+motion is almost exactly two Kepler orbits: the binary's relative orbit and the escaper's orbit around the
+binary's centre of mass.
+
+Solution is built from three kinds of segments:
+- `full` - full equations of motion, stepped with `RK45` exactly like `ThreeBodySimulator`
+- `encke` - both Kepler orbits are propagated analytically and only their small deviations, caused by the
+  escaper's tidal field, are integrated (Encke's method); deviations obey the exact equations of motion, so
+  this segment is not an approximation, it is only cheaper while the deviations are small
+- `kepler` - pure analytic propagation once tidal perturbation is negligible
+
+Decoupling is detected from the closest pair of bodies every `check_steps` solver steps. The pair must be bound,
+the third body must be receding, its distance must exceed `distance_ratio` apocentre distances of the binary and
+tidal parameter `2 m_k / (m_i + m_j) (Q / R)^3` (`Q` apocentre of the binary, `R` distance of the third body)
+must drop below `tidal_threshold`. Encke segments are rectified (deviations folded into new reference orbits)
+once deviations exceed 1% of reference orbits and switch to pure Kepler propagation once tidal parameter drops
+below `correction_threshold`. Whenever the escaper comes back (tidal parameter grows above threshold times
+`hysteresis`, or the closest pair changes), integration switches back to the previous mode. Sign of the escaper's
+orbital energy (escape or wide excursion) is logged when decoupling is detected.
+
+Kepler orbits are propagated with universal variables (Stumpff functions), valid for elliptic, parabolic and
+hyperbolic orbits in 2D and 3D. Reduced segments are sampled `samples_per_period` times per binary period (at most
+`max_samples` samples per segment), so plotters receive a complete trajectory in `solution.t`/`solution.y` and
+`solution.sol` interpolates over all segments.
+
+Model reduction parameters are held in `params['model_reduction']` dictionary:
+- `distance_ratio` - smallest distance of the escaper in binary apocentre distances, defaults to `5`
+- `tidal_threshold` - tidal parameter below which deviations from Kepler orbits are integrated, defaults to `1e-3`
+- `correction_threshold` - tidal parameter below which deviations are neglected, defaults to `1e-6`
+- `hysteresis` - factor applied to thresholds when switching back, defaults to `2`
+- `check_steps` - number of full solver steps between decoupling checks, defaults to `10`
+- `samples_per_period` - samples of reduced segments per binary period, defaults to `40`
+- `max_samples` - largest number of samples per reduced segment, defaults to `20000`
+
+Only three bodies without softening are reduced, other systems are solved as usual.
+
+Usage example:
+@code
+  params['model_reduction'] = {'tidal_threshold': 1e-4}
+  sim = HierarchicalSimulator(params)
+  solution = sim.solve_system_of_equations()
+  print(sim.segments)
+@endcode
+"""
+
+from .Simulator import ThreeBodySimulator
+
+from scipy.integrate import RK45, OdeSolution
+from scipy.optimize import OptimizeResult
+
+import math
+import sys
+
+import numpy as np
+
+def stumpff(z):
+  """Stumpff functions `C(z)` and `S(z)` used by universal variable formulation
+  @param z Argument, float
+  @returns Tuple `(C, S)`
+  @throws OverflowError if `z` is a large negative number
+  """
+  if z > 0.1:
+    root = math.sqrt(z)
+    return 2 * math.sin(root / 2)**2 / z, (root - math.sin(root)) / root**3
+  if z < -0.1:
+    root = math.sqrt(-z)
+    return (math.cosh(root) - 1) / -z, (math.sinh(root) - root) / root**3
+
+  # series expansions avoid cancellation close to parabolic orbits
+  c, s, term_c, term_s = 0.0, 0.0, 1 / 2, 1 / 6
+  for k in range(8):
+    c += term_c
+    s += term_s
+    term_c *= -z / ((2 * k + 3) * (2 * k + 4))
+    term_s *= -z / ((2 * k + 4) * (2 * k + 5))
+  return c, s
+
+def universal_anomaly(dt, r0n, rv, alpha, sqrt_mu, guess=None):
+  """Solve universal Kepler equation for a single time
+  @param dt Time since initial state
+  @param r0n Initial distance
+  @param rv Dot product of initial position and velocity
+  @param alpha Inverse semi-major axis, `2 / r0 - v0^2 / mu`
+  @param sqrt_mu Square root of gravitational parameter
+  @param guess Initial guess, e.g. anomaly of a nearby time, `None` if there is none
+  @returns Universal anomaly `chi`
+  """
+  def equation(chi):
+    """Universal Kepler equation and its derivative (distance over sqrt(mu), always positive)"""
+    try:
+      c, s = stumpff(alpha * chi**2)
+    except OverflowError:
+      # far from the root of hyperbolic orbits terms overflow, equation is increasing so its sign follows `chi`
+      return math.copysign(math.inf, chi), math.inf
+    f = rv / sqrt_mu * chi**2 * c + (1 - alpha * r0n) * chi**3 * s + r0n * chi - sqrt_mu * dt
+    df = rv / sqrt_mu * chi * (1 - alpha * chi**2 * s) + (1 - alpha * r0n) * chi**2 * c + r0n
+    return f, df
+
+  if guess is not None:
+    # a close guess converges in a few plain Newton steps, otherwise fall back to the safeguarded solution below
+    chi, step = guess, math.inf
+    for _ in range(6):
+      f, df = equation(chi)
+      newton = -f / df
+      if not abs(newton) < 0.5 * step:
+        break
+      chi, step = chi + newton, abs(newton)
+      if step <= 1e-12 * max(1.0, abs(chi)):
+        return chi
+
+  # equation is monotonic in chi, bracket the root by doubling, then use Newton steps safeguarded by bisection
+  sign = -1.0 if dt < 0 else 1.0
+  bound = max(sqrt_mu * abs(dt) / r0n, sys.float_info.min)
+  while sign * equation(sign * bound)[0] < 0:
+    bound *= 2
+  low, high = min(0.0, sign * bound), max(0.0, sign * bound)
+  chi = sqrt_mu * dt / r0n
+  step = high - low
+  for _ in range(200):
+    f, df = equation(chi)
+    if f == 0:
+      break
+    low, high = (chi, high) if f < 0 else (low, chi)
+    newton = chi - f / df
+    # Newton steps crawl on the exponential branch of hyperbolic orbits, bisect unless they halve the previous step
+    if low < newton < high and abs(newton - chi) < 0.5 * abs(step):
+      step, chi = newton - chi, newton
+      # convergence is quadratic, error of the new iterate is far below the last step
+      if abs(step) <= 1e-12 * max(1.0, abs(chi)):
+        break
+    else:
+      step, chi = (low + high) / 2 - chi, (low + high) / 2
+      if high - low <= 1e-15 * max(1.0, abs(chi)):
+        break
+  return chi
+
+class KeplerOrbit:
+  """Two body relative orbit propagated analytically with universal variables, valid for any eccentricity"""
+  def __init__(self, r0, v0, mu):
+    """Constructor for KeplerOrbit
+    @param r0 Initial relative position, vector of length 2 or 3
+    @param v0 Initial relative velocity
+    @param mu Gravitational parameter `G (m_1 + m_2)`
+    """
+    ## Initial relative position
+    self.r0 = np.asarray(r0, dtype=float)
+    ## Initial relative velocity
+    self.v0 = np.asarray(v0, dtype=float)
+    ## Square root of gravitational parameter
+    self.sqrt_mu = math.sqrt(mu)
+    ## Initial distance
+    self.r0n = math.sqrt(np.dot(self.r0, self.r0))
+    ## Dot product of initial position and velocity
+    self.rv = float(np.dot(self.r0, self.v0))
+    ## Inverse semi-major axis, negative for hyperbolic orbits
+    self.alpha = 2 / self.r0n - float(np.dot(self.v0, self.v0)) / mu
+    ## Orbital period, `None` unless the orbit is elliptic
+    self.period = 2 * math.pi / math.sqrt(mu * self.alpha**3) if self.alpha * self.r0n > 1e-12 else None
+    ## Time, anomaly and distance of the last solved time, used as a warm start since consecutive times are close
+    self.last = None
+
+  def __call__(self, dt):
+    """Relative position and velocity at given times
+    @param dt Scalar or array of times since initial state
+    @returns Tuple of arrays `(r, v)` of shape `(len(dt), dim)`
+    """
+    dt = np.atleast_1d(np.asarray(dt, dtype=float))
+    r0n, alpha, sqrt_mu = self.r0n, self.alpha, self.sqrt_mu
+
+    # Lagrange coefficients, solved per time with scalar arithmetic which is much cheaper than numpy for single values
+    coefficients = np.empty((len(dt), 4))
+    for n, time in enumerate(dt):
+      if self.period is not None:
+        # position is periodic, shortest equivalent time keeps iterations well conditioned
+        time -= self.period * round(time / self.period)
+      guess = None
+      if self.last is not None:
+        # anomaly grows as sqrt(mu) / r
+        last_time, last_chi, last_rn = self.last
+        guess = last_chi + sqrt_mu * (time - last_time) / last_rn
+      chi = universal_anomaly(time, r0n, self.rv, alpha, sqrt_mu, guess)
+      z = alpha * chi**2
+      c, s = stumpff(z)
+      f = 1 - chi**2 / r0n * c
+      g = time - chi**3 / sqrt_mu * s
+      # distance equals derivative of Kepler equation
+      rn = self.rv / sqrt_mu * chi * (1 - z * s) + (1 - alpha * r0n) * chi**2 * c + r0n
+      coefficients[n] = f, g, sqrt_mu / (rn * r0n) * (z * s - 1) * chi, 1 - chi**2 / rn * c
+      self.last = time, chi, rn
+    f, g, fdot, gdot = coefficients.T
+    r = f[:, None] * self.r0 + g[:, None] * self.v0
+    v = fdot[:, None] * self.r0 + gdot[:, None] * self.v0
+    return r, v
+
+class ReducedSegment:
+  """Interpolant of a reduced segment: two Kepler reference orbits and optional integrated deviations"""
+  def __init__(self, simulator, hierarchy, epoch, state, deviations=None):
+    """Constructor for ReducedSegment
+    @param simulator HierarchicalSimulator providing masses and state composition
+    @param hierarchy Dictionary describing the hierarchy, see `HierarchicalSimulator.hierarchy`
+    @param epoch Time of reference state
+    @param state Full state vector at `epoch`
+    @param deviations `OdeSolution` of deviations `[dr, drho, dr', drho']`, `None` for pure Kepler segments
+    """
+    ## Simulator providing masses and state composition
+    self.simulator = simulator
+    ## Description of the hierarchy
+    self.hierarchy = hierarchy
+    ## Time of reference state
+    self.epoch = epoch
+    ## Centre of mass, its velocity and reference relative coordinates `(r, r', rho, rho')` at `epoch`
+    self.reference = simulator.split(state, hierarchy)
+    _, _, r0, rd0, rho0, rhod0 = self.reference
+    ## Kepler reference orbits of the binary and of the escaper
+    self.orbits = KeplerOrbit(r0, rd0, hierarchy['mu_binary']), KeplerOrbit(rho0, rhod0, hierarchy['mu_outer'])
+    ## Integrated deviations from reference orbits
+    self.deviations = deviations
+
+  def reference_orbits(self, t):
+    """Relative coordinates `(r, r', rho, rho')` of Kepler reference orbits at given times, arrays of shape `(len(t), dim)`"""
+    dt = np.atleast_1d(t) - self.epoch
+    binary, outer = self.orbits
+    return *binary(dt), *outer(dt)
+
+  def states(self, t, deviations=None):
+    """Full state vectors at given times
+    @param t Array of times
+    @param deviations Deviations from reference orbits, shape `(len(t), 4 * dim)`, `None` if there are none
+    @returns Array of shape `(n_state, len(t))`
+    """
+    relative = self.reference_orbits(t)
+    if deviations is not None:
+      # deviations are ordered as positions followed by velocities, `[dr, drho, dr', drho']`
+      dr, drho, drd, drhod = np.split(deviations, 4, axis=1)
+      relative = [orbit + part for orbit, part in zip(relative, (dr, drd, drho, drhod))]
+    cm, vcm = self.reference[:2]
+    return self.simulator.compose(cm + np.outer(t - self.epoch, vcm), vcm, self.hierarchy, *relative)
+
+  def __call__(self, t):
+    """Full state vectors at given times
+    @param t Scalar or array of times
+    @returns Array of shape `(n_state,)` for scalar `t`, `(n_state, len(t))` otherwise
+    """
+    times = np.atleast_1d(t)
+    states = self.states(times, None if self.deviations is None else self.deviations(times).T)
+    return states[:, 0] if np.ndim(t) == 0 else states
+
+class HierarchicalSimulator(ThreeBodySimulator):
+  """Class that generates solution of a three body problem, switching to Kepler propagation once a body escapes"""
+  def __init__(self, system_params):
+    super().__init__(system_params)
+    settings = system_params.get('model_reduction', None) or {}
+    ## Smallest distance of the escaper in binary apocentre distances
+    self.distance_ratio = settings.get('distance_ratio', 5.0)
+    ## Tidal parameter below which deviations from Kepler orbits are integrated
+    self.tidal_threshold = settings.get('tidal_threshold', 1e-3)
+    ## Tidal parameter below which deviations are neglected
+    self.correction_threshold = settings.get('correction_threshold', 1e-6)
+    ## Factor applied to thresholds when switching back
+    self.hysteresis = settings.get('hysteresis', 2.0)
+    ## Number of full solver steps between decoupling checks
+    self.check_steps = int(settings.get('check_steps', 10))
+    ## Samples of reduced segments per binary period
+    self.samples_per_period = settings.get('samples_per_period', 40)
+    ## Largest number of samples per reduced segment
+    self.max_samples = int(settings.get('max_samples', 20000))
+    ## Segments of the last solution, list of `(t_start, t_end, mode)` tuples
+    self.segments = []
+
+  def hierarchy(self, state):
+    """Describe a state as a binary (closest pair) and a third body
+    @param state Full state vector
+    @returns Dictionary with body indices `i`, `j` (binary) and `k`, gravitational parameters `mu_binary` and
+    `mu_outer`, binary apocentre distance `apocentre`, escaper's distance ratio `ratio`, tidal parameter `epsilon`,
+    escaper's orbital energy `outer_energy` and `receding` flag, or `None` if the closest pair is not bound
+    """
+    dim, masses, G = self.bodies.dim, self.bodies.masses, self.params['G']
+    x = state[:3 * dim].reshape(3, dim)
+    v = state[3 * dim:].reshape(3, dim)
+    i, j, k = min(((0, 1, 2), (0, 2, 1), (1, 2, 0)), key=lambda pair: np.linalg.norm(x[pair[1]] - x[pair[0]]))
+    binary_mass = masses[i] + masses[j]
+    mu_binary = G * binary_mass
+
+    r, rd = x[j] - x[i], v[j] - v[i]
+    rn = np.linalg.norm(r)
+    energy = 0.5 * np.dot(rd, rd) - mu_binary / rn
+    if energy >= 0:
+      return None
+    a = -mu_binary / (2 * energy)
+    angular_momentum = np.dot(r, r) * np.dot(rd, rd) - np.dot(r, rd)**2
+    eccentricity = np.sqrt(max(0.0, 1 + 2 * energy * angular_momentum / mu_binary**2))
+    apocentre = a * (1 + eccentricity)
+
+    rho = x[k] - (masses[i] * x[i] + masses[j] * x[j]) / binary_mass
+    rhod = v[k] - (masses[i] * v[i] + masses[j] * v[j]) / binary_mass
+    R = np.linalg.norm(rho)
+    mu_outer = G * masses.sum()
+    return {
+      'i': i, 'j': j, 'k': k,
+      'mu_binary': mu_binary,
+      'mu_outer': mu_outer,
+      'apocentre': apocentre,
+      'period': 2 * np.pi * np.sqrt(a**3 / mu_binary),
+      'ratio': R / apocentre,
+      'epsilon': 2 * masses[k] / binary_mass * (apocentre / R)**3,
+      'outer_energy': 0.5 * np.dot(rhod, rhod) - mu_outer / R,
+      'receding': np.dot(rho, rhod) > 0,
+    }
+
+  def decoupled(self, hierarchy):
+    """Check if a hierarchy allows reduced propagation"""
+    return (
+      hierarchy is not None
+      and hierarchy['receding']
+      and hierarchy['ratio'] > self.distance_ratio
+      and hierarchy['epsilon'] < self.tidal_threshold
+    )
+
+  def split(self, state, hierarchy):
+    """Split a full state into centre of mass and relative coordinates of a hierarchy
+    @returns Tuple `(cm, vcm, r, r', rho, rho')`, `r` is binary separation, `rho` escaper position relative to binary
+    """
+    dim, masses = self.bodies.dim, self.bodies.masses
+    x = state[:3 * dim].reshape(3, dim)
+    v = state[3 * dim:].reshape(3, dim)
+    i, j, k = hierarchy['i'], hierarchy['j'], hierarchy['k']
+    binary_mass = masses[i] + masses[j]
+    xb = (masses[i] * x[i] + masses[j] * x[j]) / binary_mass
+    vb = (masses[i] * v[i] + masses[j] * v[j]) / binary_mass
+    cm = masses @ x / masses.sum()
+    vcm = masses @ v / masses.sum()
+    return cm, vcm, x[j] - x[i], v[j] - v[i], x[k] - xb, v[k] - vb
+
+  def compose(self, cm, vcm, hierarchy, r, rd, rho, rhod):
+    """Inverse of `split`, vectorized over time
+    @param cm Centre of mass positions, shape `(T, dim)`
+    @param vcm Centre of mass velocity, shape `(dim,)`
+    @returns Full state vectors, shape `(n_state, T)`
+    """
+    masses = self.bodies.masses
+    i, j, k = hierarchy['i'], hierarchy['j'], hierarchy['k']
+    total, binary_mass = masses.sum(), masses[i] + masses[j]
+    positions, velocities = np.empty((3,) + r.shape), np.empty((3,) + r.shape)
+    for out, centre, outer, inner in ((positions, cm, rho, r), (velocities, vcm, rhod, rd)):
+      binary = centre - masses[k] / total * outer
+      out[k] = centre + binary_mass / total * outer
+      out[i] = binary - masses[j] / binary_mass * inner
+      out[j] = binary + masses[i] / binary_mass * inner
+    return np.concatenate((positions.transpose(1, 0, 2).reshape(len(r), -1), velocities.transpose(1, 0, 2).reshape(len(r), -1)), axis=1).T
+
+  def deviation_equations(self, segment):
+    """Right hand side of Encke's equations for deviations from reference orbits of a segment"""
+    masses, G = self.bodies.masses, self.params['G']
+    hierarchy = segment.hierarchy
+    i, j, k = hierarchy['i'], hierarchy['j'], hierarchy['k']
+    binary_mass = masses[i] + masses[j]
+    dim = self.bodies.dim
+
+    def equations(t, deviation):
+      r_ref, _, rho_ref, _ = (array[0] for array in segment.reference_orbits(t))
+      r, rho = r_ref + deviation[:dim], rho_ref + deviation[dim:2 * dim]
+      # separations of the escaper from both binary components
+      u_i = rho + masses[j] / binary_mass * r
+      u_j = rho - masses[i] / binary_mass * r
+      u_i3, u_j3 = np.linalg.norm(u_i)**3, np.linalg.norm(u_j)**3
+      r_acc = -hierarchy['mu_binary'] * r / np.linalg.norm(r)**3 + G * masses[k] * (u_j / u_j3 - u_i / u_i3)
+      rho_acc = -G * masses.sum() / binary_mass * (masses[i] * u_i / u_i3 + masses[j] * u_j / u_j3)
+      r_ref_acc = -hierarchy['mu_binary'] * r_ref / np.linalg.norm(r_ref)**3
+      rho_ref_acc = -hierarchy['mu_outer'] * rho_ref / np.linalg.norm(rho_ref)**3
+      return np.concatenate((deviation[2 * dim:], r_acc - r_ref_acc, rho_acc - rho_ref_acc))
+    return equations
+
+  def full_phase(self, t0, y0, t_end):
+    """Integrate full equations of motion until decoupling is detected or time span ends
+    @returns Tuple `(breakpoints, interpolants, times, states, nfev, hierarchy, failed)`, `hierarchy` is `None`
+    unless integration stopped because of decoupling
+    """
+    solver = RK45(self.system_of_equations, t0, y0, t_end, rtol=self.params.get('rtol', 1e-8), atol=self.params.get('atol', 1e-8))
+    breakpoints, interpolants, states = [t0], [], []
+    steps = 0
+    while solver.status == 'running':
+      solver.step()
+      if solver.status == 'failed':
+        return breakpoints, interpolants, breakpoints[1:], states, solver.nfev, None, True
+      breakpoints.append(solver.t)
+      interpolants.append(solver.dense_output())
+      states.append(solver.y)
+      steps += 1
+      if steps % self.check_steps == 0 and solver.status == 'running':
+        hierarchy = self.hierarchy(solver.y)
+        if self.decoupled(hierarchy):
+          return breakpoints, interpolants, breakpoints[1:], states, solver.nfev, hierarchy, False
+    return breakpoints, interpolants, breakpoints[1:], states, solver.nfev, None, False
+
+  def encke_phase(self, t0, y0, hierarchy, t_end):
+    """Integrate deviations from Kepler orbits until they have to be rectified, can be neglected or the escaper comes back
+    @returns Tuple `(t, state, segment, nfev, next_mode)`, `next_mode` is `encke` after rectification, `kepler` or `full`
+    """
+    segment = ReducedSegment(self, hierarchy, t0, y0)
+    dim = self.bodies.dim
+    equations = self.deviation_equations(segment)
+    solver = RK45(equations, t0, np.zeros(4 * dim), t_end, rtol=self.params.get('rtol', 1e-8), atol=self.params.get('atol', 1e-8))
+    breakpoints, interpolants = [t0], []
+    next_mode = 'end'
+    while solver.status == 'running':
+      solver.step()
+      if solver.status == 'failed':
+        next_mode = 'full'
+        break
+      breakpoints.append(solver.t)
+      interpolants.append(solver.dense_output())
+      r_ref, _, rho_ref, _ = (array[0] for array in segment.reference_orbits(solver.t))
+      current = self.hierarchy(segment.states(np.array([solver.t]), solver.y[None, :])[:, 0])
+      if current is None or (current['i'], current['j']) != (hierarchy['i'], hierarchy['j']) \
+          or current['epsilon'] > self.tidal_threshold * self.hysteresis or current['ratio'] < self.distance_ratio / self.hysteresis:
+        next_mode = 'full'
+        break
+      if current['epsilon'] < self.correction_threshold:
+        next_mode = 'kepler'
+        break
+      if np.linalg.norm(solver.y[:dim]) > 1e-2 * np.linalg.norm(r_ref) or np.linalg.norm(solver.y[dim:2 * dim]) > 1e-2 * np.linalg.norm(rho_ref):
+        next_mode = 'encke'
+        break
+    segment.deviations = OdeSolution(breakpoints, interpolants) if interpolants else None
+    return breakpoints[-1], segment(breakpoints[-1]), segment, solver.nfev, next_mode
+
+  def kepler_phase(self, t0, y0, hierarchy, t_end):
+    """Propagate both Kepler orbits until tidal perturbation becomes significant again or time span ends
+    @returns Tuple `(t, state, segment, next_mode)`, `next_mode` is `encke` or `end`
+    """
+    segment = ReducedSegment(self, hierarchy, t0, y0)
+    outer = segment.orbits[1]
+    _, _, _, _, rho, rhod = segment.reference
+    masses = self.bodies.masses
+    binary_mass = masses[hierarchy['i']] + masses[hierarchy['j']]
+    t = t0
+    while t < t_end:
+      # escaper moves by a tenth of its distance per check, so pericentre passages are not skipped
+      t = min(t + 0.1 * np.linalg.norm(rho) / np.linalg.norm(rhod), t_end)
+      rho, rhod = (array[0] for array in outer(t - t0))
+      epsilon = 2 * masses[hierarchy['k']] / binary_mass * (hierarchy['apocentre'] / np.linalg.norm(rho))**3
+      if epsilon > self.correction_threshold * self.hysteresis:
+        return t, segment(t), segment, 'encke'
+    return t_end, segment(t_end), segment, 'end'
+
+  def samples(self, segment, t0, t1):
+    """Evenly spaced samples of a reduced segment, excluding its start
+    @returns Tuple `(times, states)`
+    """
+    count = int(np.clip(np.ceil((t1 - t0) / segment.hierarchy['period'] * self.samples_per_period), 1, self.max_samples))
+    times = np.linspace(t0, t1, count + 1)[1:]
+    return list(times), list(segment(times).T)
+
+  def solve_system_of_equations(self):
+    """Solve system of ODEs reflecting a three body problem, reducing it to Kepler orbits after an escape
+    @returns `OdeSolution`-like object containing solutions for all parameters, with `t`, `y` and `sol` members
+    """
+    y0 = self.initial_conditions()
+    t_end = self.params['days'] * 24 * 3600
+    if self.bodies.n != 3 or self.params.get('softening', 0.0) or self.params.get('force_solver', 'direct') != 'direct':
+      self.logger.warning("Model reduction supports three bodies without softening only, solving full problem")
+      return super().solve_system_of_equations()
+
+    self.logger.info("Solving problem with model reduction...")
+    self.segments = []
+    breakpoints, interpolants, times, states = [0.0], [], [0.0], [y0]
+    nfev, mode, hierarchy, success = 0, 'full', None, True
+    t, y = 0.0, y0
+    while t < t_end and success:
+      start = t
+      if mode == 'full':
+        segment_breakpoints, segment_interpolants, segment_times, segment_states, segment_nfev, hierarchy, failed = self.full_phase(t, y, t_end)
+        breakpoints += segment_breakpoints[1:]
+        interpolants += segment_interpolants
+        times += segment_times
+        states += segment_states
+        nfev += segment_nfev
+        success = not failed
+        t, y = breakpoints[-1], states[-1]
+        self.segments.append((start, t, 'full'))
+        if hierarchy is not None:
+          kind = 'escapes' if hierarchy['outer_energy'] > 0 else 'leaves on a wide bound orbit'
+          self.logger.info(f"t={t / (24 * 3600):.4g} days: body {hierarchy['k'] + 1} {kind} binary ({hierarchy['i'] + 1}, {hierarchy['j'] + 1}), tidal parameter {hierarchy['epsilon']:.2e}, switching to Kepler orbits")
+          mode = 'encke'
+        continue
+
+      if mode == 'encke':
+        t, y, segment, segment_nfev, next_mode = self.encke_phase(t, y, hierarchy, t_end)
+        nfev += segment_nfev
+      else:
+        t, y, segment, next_mode = self.kepler_phase(t, y, hierarchy, t_end)
+      if t > start:
+        breakpoints.append(t)
+        interpolants.append(segment)
+        sample_times, sample_states = self.samples(segment, start, t)
+        times += sample_times
+        states += sample_states
+        self.segments.append((start, t, mode))
+      if next_mode == 'full':
+        self.logger.info(f"t={t / (24 * 3600):.4g} days: body {hierarchy['k'] + 1} approaches binary again, switching to full equations")
+      mode = next_mode
+
+    reduced = sum(end - begin for begin, end, kind in self.segments if kind != 'full')
+    self.logger.info(f"Solving done, {reduced / t_end:.0%} of time span propagated analytically")
+    return self.reduce_output(OptimizeResult(
+      t=np.array(times),
+      y=np.array(states).T,
+      sol=OdeSolution(breakpoints, interpolants) if interpolants else None,
+      t_events=None,
+      y_events=None,
+      nfev=nfev,
+      njev=0,
+      nlu=0,
+      status=0 if success else -1,
+      message='The solver successfully reached the end of the integration interval.' if success else 'Required step size is less than spacing between numbers.',
+      success=success
+    ))
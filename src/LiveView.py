@@ -0,0 +1,171 @@
+""" @package LiveView
+
+@brief Live visualization of a running integration
+
+@details This module defines LiveView class which draws bodies while the system is being integrated, instead of
+animating a finished solution. States are taken from `ThreeBodySimulator.stream_states`, which steps the solver
+and yields evenly spaced frames as soon as they are reached, so the first frame is shown after a few milliseconds
+instead of after the whole time span is solved.
+
+Interactive view uses `FuncAnimation` with blitting, only bodies and their traces are redrawn. Traces are kept in
+bounded buffers of the last `trace_length` frames (`100` by default, `live_trace_length` parameter), so memory
+does not grow with run length. Axis limits grow whenever a body leaves them. Frames can additionally be written
+to a file as they arrive (`--live-file`), which also works without a display. Closing the window does not stop
+integration, remaining frames are integrated without drawing.
+
+Once streaming is done the complete solution is available, solver takes the same steps as a regular solve, so
+the remaining stages (plots, Lyapunov analysis) reuse it instead of solving again.
+
+Usage example:
+@code
+  view = LiveView(ThreeBodySimulator(params), params)
+  solution = view.run()
+@endcode
+"""
+
+from collections import deque
+
+import logging
+import os
+import time
+
+import matplotlib.pyplot as plt
+import matplotlib.animation as animation
+import numpy as np
+
+class LiveView:
+  """Class that draws bodies while they are being integrated"""
+  def __init__(self, simulator, params):
+    """Constructor for LiveView
+    @param simulator ThreeBodySimulator integrating the system
+    @param params Simulation parameters merged with plot parameters
+    """
+    ## Simulator integrating the system
+    self.simulator = simulator
+    ## Simulator parameters
+    self.params = params
+    ## Global logger reference
+    self.logger = logging.getLogger('main')
+    ## Table of bodies
+    self.bodies = simulator.bodies
+    ## Number of leading bodies drawn individually, remaining ones are drawn as a cloud
+    self.plotted_bodies = min(params.get('plot_bodies', self.bodies.n), self.bodies.n)
+    ## Number of frames over whole time span
+    self.frames = params.get('frames', None) or 500
+    ## Number of frames kept in traces
+    self.trace_length = params.get('live_trace_length', 100)
+    ## File frames are written to, `None` if not set
+    self.live_path = params.get('live_file', None)
+    ## Whether a window is shown
+    self.interactive = not params['quiet'] and "DISPLAY" in os.environ
+
+  def setup(self):
+    """Build figure, artists and trace buffers"""
+    ## Live figure
+    self.fig, self.ax = plt.subplots(figsize=(10, 8))
+    self.ax.set_xlabel('$x$ [m]')
+    self.ax.set_ylabel('$y$ [m]')
+    self.ax.set_aspect('equal')
+    self.ax.grid(True, linestyle='--', alpha=0.5)
+    if self.params.get('title', None):
+      self.ax.set_title(self.params['title'] + ', live')
+    positions = self.xy(self.simulator.bodies.state())
+    ## Current half-width of axis limits
+    self.extent = max(np.max(np.abs(positions)) * 1.2, np.finfo(float).tiny)
+    self.ax.set_xlim(-self.extent, self.extent)
+    self.ax.set_ylim(-self.extent, self.extent)
+
+    ## Trajectory traces, one per individually drawn body
+    self.lines = [
+      self.ax.plot([], [], '-', color=self.body_color(body_no), alpha=0.3, linewidth=1, label=f'Body {body_no}', animated=True)[0]
+      for body_no in range(1, self.plotted_bodies + 1)
+    ]
+    ## Current positions, one per individually drawn body
+    self.points = [
+      self.ax.plot([], [], 'o', color=self.body_color(body_no), markersize=10, animated=True)[0]
+      for body_no in range(1, self.plotted_bodies + 1)
+    ]
+    ## Bodies which are not drawn individually share a single artist
+    self.cloud, = self.ax.plot([], [], '.', color='grey', markersize=1, animated=True)
+    ## Elapsed time label
+    self.label = self.ax.text(0.02, 0.97, '', transform=self.ax.transAxes, va='top', animated=True)
+    ## Bounded trace buffers, `(x, y)` pairs of the last `trace_length` frames per body
+    self.traces = [deque(maxlen=self.trace_length) for _ in range(self.plotted_bodies)]
+    self.ax.legend(loc='upper right')
+    self.fig.tight_layout()
+
+  def body_color(self, body_no):
+    """Colour of a body, same as in `ThreeBodyPlotter`"""
+    colors = ('red', 'green', 'blue')
+    if body_no <= len(colors):
+      return colors[body_no - 1]
+    return plt.get_cmap('tab10')(body_no % 10)
+
+  def xy(self, state):
+    """XY projection of every body's position in a state vector, shape (bodies, 2)"""
+    return state[:self.bodies.n * self.bodies.dim].reshape(self.bodies.n, self.bodies.dim)[:, :2]
+
+  def update(self, frame):
+    """Draw a single frame
+    @param frame `(t, state)` tuple yielded by the simulator
+    @returns Updated artists
+    """
+    t, state = frame
+    xy = self.xy(state)
+    for body, (line, point, trace) in enumerate(zip(self.lines, self.points, self.traces)):
+      trace.append(xy[body])
+      line.set_data(*np.array(trace).T)
+      point.set_data([xy[body, 0]], [xy[body, 1]])
+    self.cloud.set_data(xy[self.plotted_bodies:, 0], xy[self.plotted_bodies:, 1])
+    self.label.set_text(f"$t$ = {t / (24 * 3600):.2f} days")
+
+    if np.max(np.abs(xy[:self.plotted_bodies])) > self.extent:
+      self.extent = np.max(np.abs(xy[:self.plotted_bodies])) * 1.5
+      self.ax.set_xlim(-self.extent, self.extent)
+      self.ax.set_ylim(-self.extent, self.extent)
+      # redraw static background with new ticks, blitting caches it again since view changed
+      if self.interactive:
+        self.fig.canvas.draw()
+
+    if self.first_frame is None:
+      self.first_frame = time.perf_counter() - self.start
+      self.logger.info(f"First live frame after {self.first_frame * 1000:.1f} ms")
+    if self.writer is not None:
+      self.writer.grab_frame()
+    return *self.lines, *self.points, self.cloud, self.label
+
+  def run(self):
+    """Integrate system while drawing it
+    @returns Solution of the whole time span, same as returned by `solve_system_of_equations`
+    """
+    ## Start time of streaming
+    self.start = time.perf_counter()
+    ## Time to first frame in seconds, set once it is drawn
+    self.first_frame = None
+    ## Frame writer, `None` if frames are not written to a file
+    self.writer = None
+    stream = self.simulator.stream_states(self.frames)
+    if not self.interactive and not self.live_path:
+      self.logger.warning("Live view needs a display or --live-file, integrating without drawing")
+      for _ in stream:
+        pass
+      return self.simulator.solution
+
+    self.setup()
+    if self.live_path:
+      self.writer = animation.FFMpegWriter(fps=50) if self.live_path.endswith('.mp4') else animation.PillowWriter(fps=50)
+      self.writer.setup(self.fig, self.live_path)
+    try:
+      if self.interactive:
+        anim = animation.FuncAnimation(self.fig, self.update, frames=stream, interval=1, blit=True, repeat=False, cache_frame_data=False)
+        plt.show()
+      for frame in stream:
+        # window was closed or there is no display, keep writing frames or just finish integration
+        if self.writer is not None:
+          self.update(frame)
+    finally:
+      if self.writer is not None:
+        self.writer.finish()
+        self.logger.info(f"Live frames saved as \"{self.live_path}\"")
+      plt.close(self.fig)
+    return self.simulator.solution
@@ -0,0 +1,228 @@
+""" @package Parareal
+
+@brief Time-parallel integration of a single long trajectory
+
+@details This module defines PararealSimulator class which solves the same problem as ThreeBodySimulator,
+but splits simulation time into slices which are integrated concurrently in a process pool.
+A cheap coarse propagator (loose tolerance Runge-Kutta or a fixed step leapfrog) is used to seed
+initial conditions of every slice, then each slice is refined with a fine propagator (same tolerances
+as ThreeBodySimulator) and slice boundaries are corrected until they stop changing.
+
+Algorithm outline (Parareal):
+- `U[0]` is the initial condition, `U[n+1] = G(U[n])` seeds slice boundaries with the coarse propagator `G`
+- in each iteration all unconverged slices are integrated with the fine propagator `F` in parallel
+- boundaries are corrected serially with `U_new[n+1] = G(U_new[n]) + F(U_old[n]) - G(U_old[n])`
+- iteration stops once relative boundary change drops below `tol` (positions and velocities are checked separately),
+  after `slices` iterations the result is identical to serial integration of slices
+
+Parareal parameters are held in `params['parareal']` dictionary:
+- `slices` - number of time slices, defaults to number of available cores
+- `workers` - size of a process pool, defaults to `slices`
+- `coarse` - coarse propagator, `leapfrog` (default) or `rk`
+- `coarse_rtol` - tolerance of `rk` coarse propagator, defaults to `1e-3`
+- `coarse_steps` - number of `leapfrog` steps per slice, defaults to `200`
+- `tol` - convergence threshold for slice boundaries, defaults to `1e-7`
+- `max_iterations` - upper bound of Parareal iterations, defaults to `slices`
+
+After a run `report` holds number of `iterations`, whether it `converged`, `wall_time` and:
+- `serial_fine_time` - estimated duration of a serial solve, sum of the last fine solve of every slice
+- `fine_work_time` - fine solving time summed over all slices and iterations, i.e. total work spent by workers
+- `speedup` - `serial_fine_time / wall_time`, speedup over serial integration with the fine propagator
+- `efficiency` - `serial_fine_time / fine_work_time`, fraction of fine work which a serial solve would have done too
+
+Usage example:
+@code
+  params['parareal'] = {'slices': 8}
+  sim = PararealSimulator(params)
+  solution = sim.solve_system_of_equations()
+  print(sim.report['iterations'], sim.report['speedup'])
+@endcode
+"""
+
+from .Simulator import ThreeBodySimulator
+
+from concurrent.futures import ProcessPoolExecutor
+from scipy.integrate import solve_ivp, OdeSolution
+from scipy.optimize import OptimizeResult
+
+import numpy as np
+import os
+import time
+
+def _fine_propagate(rhs, t0, t1, y0, rtol, atol):
+  """Integrate a single time slice with fine propagator, executed in worker processes
+  @param rhs Right hand side of the system of equations
+  @param t0 Beginning of a slice
+  @param t1 End of a slice
+  @param y0 State at `t0`
+  @param rtol Relative tolerance
+  @param atol Absolute tolerance
+  @returns Tuple of `(OdeSolution-like result, elapsed wall time)`
+  """
+  start = time.perf_counter()
+  solution = solve_ivp(rhs, (t0, t1), y0, dense_output=True, rtol=rtol, atol=atol)
+  return solution, time.perf_counter() - start
+
+class PararealSimulator(ThreeBodySimulator):
+  """Class that generates solution of a three body problem using Parareal time-parallel integration"""
+  def __init__(self, system_params):
+    super().__init__(system_params)
+    parareal = system_params.get('parareal', None) or {}
+    ## Number of time slices
+    self.slices = int(parareal.get('slices', None) or os.cpu_count() or 1)
+    ## Size of a process pool
+    self.workers = int(parareal.get('workers', self.slices))
+    ## Coarse propagator, `rk` or `leapfrog`
+    self.coarse = parareal.get('coarse', 'leapfrog')
+    ## Relative and absolute tolerance of `rk` coarse propagator
+    self.coarse_rtol = parareal.get('coarse_rtol', 1e-3)
+    ## Number of `leapfrog` steps per slice
+    self.coarse_steps = int(parareal.get('coarse_steps', 200))
+    ## Convergence threshold of slice boundaries
+    self.tol = parareal.get('tol', 1e-7)
+    ## Maximum number of Parareal iterations
+    self.max_iterations = int(parareal.get('max_iterations', self.slices))
+    ## Statistics of the last run: iterations, convergence, timings and achieved speedup
+    self.report = {}
+    if self.coarse not in ('rk', 'leapfrog'):
+      raise ValueError(f"Unknown Parareal coarse propagator \"{self.coarse}\"")
+
+  def coarse_propagate(self, t0, t1, y0):
+    """Cheap approximation of a state at `t1` given a state at `t0`
+    @param t0 Beginning of a slice
+    @param t1 End of a slice
+    @param y0 State at `t0`
+    @returns State at `t1`
+    """
+    if self.coarse == 'rk':
+      solution = solve_ivp(
+        self.system_of_equations,
+        (t0, t1),
+        y0,
+        dense_output=False,
+        rtol=self.coarse_rtol,
+        atol=self.coarse_rtol
+      )
+      return solution.y[:, -1]
+
+    # kick-drift-kick leapfrog, symplectic so long slices do not drift in energy
+    half = len(y0) // 2
+    h = (t1 - t0) / self.coarse_steps
+    pos, vel = np.array(y0[:half], dtype=np.float64), np.array(y0[half:], dtype=np.float64)
+    t = t0
+    acc = self.system_of_equations(t, np.concatenate((pos, vel)))[half:]
+    for _ in range(self.coarse_steps):
+      vel = vel + 0.5 * h * acc
+      pos = pos + h * vel
+      t += h
+      acc = self.system_of_equations(t, np.concatenate((pos, vel)))[half:]
+      vel = vel + 0.5 * h * acc
+    return np.concatenate((pos, vel))
+
+  def boundary_change(self, new, old):
+    """Relative change of slice boundaries, positions and velocities are measured separately
+    since their magnitudes differ by orders of magnitude in SI units
+    @param new Array of boundary states, shape `(slices + 1, state_size)`
+    @param old Array of boundary states, shape `(slices + 1, state_size)`
+    @returns Largest relative change
+    """
+    half = new.shape[1] // 2
+    change = 0.0
+    for part in (slice(0, half), slice(half, None)):
+      scale = np.max(np.abs(new[:, part])) or 1.0
+      change = max(change, np.max(np.abs(new[:, part] - old[:, part])) / scale)
+    return change
+
+  def solve_system_of_equations(self):
+    """Solve system of PDEs reflecting a three body problem with Parareal algorithm
+    @returns `OdeSolution`-like object containing solutions for all parameters, with `t`, `y` and `sol` members
+    """
+    start = time.perf_counter()
+    t_bounds = np.linspace(0, self.params['days'] * 24 * 3600, self.slices + 1)
+
+    # coarse sweep seeds slice boundaries
+    self.logger.info(f"Solving problem with Parareal ({self.slices} slices, {self.coarse} coarse propagator)...")
+    boundaries = np.empty((self.slices + 1, len(self.initial_conditions())))
+    boundaries[0] = self.initial_conditions()
+    coarse = np.empty_like(boundaries)
+    for n in range(self.slices):
+      coarse[n + 1] = self.coarse_propagate(t_bounds[n], t_bounds[n + 1], boundaries[n])
+      boundaries[n + 1] = coarse[n + 1]
+
+    fine = [None] * self.slices
+    fine_times = [0.0] * self.slices
+    fine_work_time = 0.0
+    iterations = 0
+    converged = False
+    with ProcessPoolExecutor(max_workers=self.workers) as executor:
+      while iterations < self.max_iterations:
+        # after k iterations first k slices are exact, only the rest has to be refined
+        futures = {
+          n: executor.submit(
+            _fine_propagate, self.system_of_equations, t_bounds[n], t_bounds[n + 1], boundaries[n],
+            self.params.get('rtol', 1e-8), self.params.get('atol', 1e-8)
+          ) for n in range(iterations, self.slices)
+        }
+        for n, future in futures.items():
+          fine[n], fine_times[n] = future.result()
+          fine_work_time += fine_times[n]
+
+        # serial correction sweep, starting from the first slice refined in this iteration
+        new_boundaries = boundaries.copy()
+        for n in range(iterations, self.slices):
+          new_coarse = self.coarse_propagate(t_bounds[n], t_bounds[n + 1], new_boundaries[n])
+          new_boundaries[n + 1] = new_coarse + fine[n].y[:, -1] - coarse[n + 1]
+          coarse[n + 1] = new_coarse
+        iterations += 1
+        change = self.boundary_change(new_boundaries, boundaries)
+        boundaries = new_boundaries
+        self.logger.debug(f"Parareal iteration {iterations}, boundary change {change:.3e}")
+        if change < self.tol or iterations == self.slices:
+          converged = True
+          break
+
+    if not converged:
+      self.logger.warning(f"Parareal did not converge in {iterations} iterations, trajectory may be discontinuous")
+
+    wall_time = time.perf_counter() - start
+    # last fine solve of every slice integrates the converged trajectory, as a serial solve would
+    serial_estimate = sum(fine_times)
+    self.report = {
+      'slices': self.slices,
+      'iterations': iterations,
+      'converged': converged,
+      'wall_time': wall_time,
+      'serial_fine_time': serial_estimate,
+      'fine_work_time': fine_work_time,
+      'speedup': serial_estimate / wall_time if wall_time else float('nan'),
+      'efficiency': serial_estimate / fine_work_time if fine_work_time else float('nan'),
+    }
+    self.logger.info(
+      f"Solving done, {iterations} Parareal iterations, {wall_time:.2f}s wall time, "
+      f"estimated speedup {self.report['speedup']:.2f}x, {fine_work_time:.2f}s of fine solving in total "
+      f"({self.report['efficiency']:.0%} of it needed by a serial solve)"
+    )
+    return self.reduce_output(self.merge_slices(fine))
+
+  def merge_slices(self, fine):
+    """Concatenate fine solutions of all slices into a single solution object
+    @param fine List of fine solutions, one per slice
+    @returns `OdeSolution`-like object with `t`, `y` and `sol` members
+    """
+    t = np.concatenate([fine[0].t] + [part.t[1:] for part in fine[1:]])
+    y = np.concatenate([fine[0].y] + [part.y[:, 1:] for part in fine[1:]], axis=1)
+    ts = np.concatenate([fine[0].sol.ts] + [part.sol.ts[1:] for part in fine[1:]])
+    interpolants = [interpolant for part in fine for interpolant in part.sol.interpolants]
+    return OptimizeResult(
+      t=t,
+      y=y,
+      sol=OdeSolution(ts, interpolants),
+      t_events=None,
+      y_events=None,
+      nfev=sum(part.nfev for part in fine),
+      njev=0,
+      nlu=0,
+      status=0,
+      message="Parareal integration finished",
+      success=True
+    )
@@ -0,0 +1,273 @@
+""" @package PeriodicOrbits
+
+@brief Search and refinement of periodic three body orbits with a shooting method
+
+@details This module defines PeriodicOrbitFinder class which refines periodic orbits of the family used by
+choreography configurations (`butterfly`, `bumblebee`, `goggles`, `yinyang`, ...): bodies start at positions of
+the base configuration, bodies 1 and 2 share initial velocity `(vx, vy)` and body 3 moves so that total momentum
+is zero, i.e. `-(m1 + m2) / m3 * (vx, vy)`.
+
+Unknowns `(vx, vy, T)` are refined with Newton's method applied to the return residual `F = x(T) - x(0)`.
+Its Jacobian is assembled from the monodromy matrix `M = dx(T)/dx(0)`, integrated along with the orbit from
+variational equations `dM/dt = A(t) M`, where `A` holds analytic acceleration Jacobian (see `src/Bodies.py`):
+`dF/d(vx, vy) = (M - I) dx(0)/d(vx, vy)` and `dF/dT = f(x(T))`. The system is overdetermined, so every step is
+a least squares solution, damped by halving until residual decreases.
+
+Many seeds are processed in a process pool. A cheap prefilter integrates each seed without variational
+equations and keeps only seeds returning close to their initial state (closest return also provides the
+initial guess of `T`), so Newton iterations are spent on promising seeds only.
+
+Finder parameters are held in `params['periodic_orbit']` dictionary, all of them are optional:
+- `seeds` - list of `(vx, vy, T)` guesses, defaults to velocity of body 1 and `days` of the base configuration
+- `vx_range`/`vy_range` - tuples `(min, max)` spanning a grid of seeds, used instead of `seeds` if set
+- `points` - number of grid points per axis, defaults to `10`
+- `max_period` - longest period considered for grid seeds, in simulation time units (seconds)
+- `prefilter` - largest relative distance of closest return which passes the prefilter, defaults to `0.1`
+- `tol` - norm of return residual at which an orbit counts as converged, defaults to `1e-9`
+- `max_iterations` - upper bound of Newton iterations per seed, defaults to `25`
+- `rtol` - tolerance of shooting integration, defaults to `1e-11`
+- `workers` - size of a process pool, defaults to `1` (no pool)
+
+Found orbits are reported with their period (in simulation time units and as `days`, ready to be pasted into
+a configuration), norm of return residual, number of Newton iterations and largest modulus of monodromy matrix
+eigenvalues, which is `1` for linearly stable orbits.
+
+Usage example:
+@code
+  params = Configurations.butterfly()
+  params['periodic_orbit'] = {'vx_range': (0.2, 0.4), 'vy_range': (0.1, 0.3), 'points': 20, 'max_period': 30}
+  orbits = PeriodicOrbitFinder(params).search()
+  for orbit in orbits:
+    print(orbit['vx'], orbit['vy'], orbit['period'], orbit['return_error'])
+@endcode
+"""
+
+from .Simulator import ThreeBodySimulator
+from .Bodies import acceleration_jacobian
+
+from concurrent.futures import ProcessPoolExecutor
+from scipy.integrate import solve_ivp
+
+import numpy as np
+import csv
+import itertools
+import sys
+
+def _prefilter_seeds(finder, seeds):
+  """Closest returns of a list of seeds, executed in worker processes
+  @param finder PeriodicOrbitFinder object
+  @param seeds List of seeds, see `PeriodicOrbitFinder.closest_return`
+  @returns List of `(distance, time)` tuples
+  """
+  return [finder.closest_return(*seed) for seed in seeds]
+
+def _refine_seed(finder, seed):
+  """Refine a single seed, executed in worker processes
+  @param finder PeriodicOrbitFinder object
+  @param seed Tuple `(vx, vy, T)`
+  @returns Orbit dictionary, see `PeriodicOrbitFinder.refine`
+  """
+  return finder.refine(*seed)
+
+class PeriodicOrbitFinder(ThreeBodySimulator):
+  """Class that finds periodic orbits with a Newton shooting method"""
+  def __init__(self, system_params):
+    super().__init__(system_params)
+    if self.bodies.n != 3 or self.bodies.dim != 2:
+      raise ValueError("Periodic orbit search supports three bodies in 2D only")
+    ## Finder parameters
+    self.settings = system_params.get('periodic_orbit', {})
+    ## Number of position (and velocity) components of a state
+    self.half = self.bodies.n * self.bodies.dim
+    ## Derivative of initial state with respect to `(vx, vy)`, array of shape `(state_size, 2)`
+    self.directions = np.zeros((2 * self.half, 2))
+    masses = self.bodies.masses
+    for axis in range(2):
+      self.directions[self.bodies.velocity_index(1, axis), axis] = 1
+      self.directions[self.bodies.velocity_index(2, axis), axis] = 1
+      self.directions[self.bodies.velocity_index(3, axis), axis] = -(masses[0] + masses[1]) / masses[2]
+    ## Initial state with velocities set to zero
+    self.base_state = self.initial_conditions()
+    self.base_state[self.half:] = 0
+
+  def initial_state(self, vx, vy):
+    """Initial state of an orbit of the family
+    @param vx Initial velocity of bodies 1 and 2 in x axis
+    @param vy Initial velocity of bodies 1 and 2 in y axis
+    @returns State vector
+    """
+    return self.base_state + self.directions @ (vx, vy)
+
+  def variational_equations(self, t, y):
+    """Equations of motion extended with variational equations of the monodromy matrix
+    @param t Time
+    @param y State vector followed by flattened monodromy matrix
+    @returns Derivatives
+    """
+    size = 2 * self.half
+    state, monodromy = y[:size], y[size:].reshape(size, size)
+    positions = state[:self.half].reshape(self.bodies.n, self.bodies.dim)
+    jacobian = acceleration_jacobian(positions, self.bodies.masses, self.params['G'], self.params.get('softening', 0.0))
+    # A = [[0, I], [J, 0]]
+    derivative = np.concatenate((monodromy[self.half:], jacobian @ monodromy[:self.half]))
+    return np.concatenate((self.system_of_equations(t, state), derivative.ravel()))
+
+  def residual(self, vx, vy, period):
+    """Return residual of an orbit and its Jacobian
+    @param vx Initial velocity of bodies 1 and 2 in x axis
+    @param vy Initial velocity of bodies 1 and 2 in y axis
+    @param period Integration time
+    @returns A tuple containing:
+    - residual `x(T) - x(0)`
+    - Jacobian of residual with respect to `(vx, vy, T)`, array of shape `(state_size, 3)`
+    - monodromy matrix
+    """
+    size = 2 * self.half
+    start = self.initial_state(vx, vy)
+    rtol = self.settings.get('rtol', 1e-11)
+    solution = solve_ivp(
+      self.variational_equations,
+      (0, period),
+      np.concatenate((start, np.eye(size).ravel())),
+      method='DOP853',
+      rtol=rtol,
+      atol=rtol
+    )
+    end = solution.y[:size, -1]
+    monodromy = solution.y[size:, -1].reshape(size, size)
+    jacobian = np.column_stack((monodromy @ self.directions - self.directions, self.system_of_equations(period, end)))
+    return end - start, jacobian, monodromy
+
+  def closest_return(self, vx, vy, t_min, t_max):
+    """Find closest return of an orbit to its initial state, used as a cheap prefilter
+    @param vx Initial velocity of bodies 1 and 2 in x axis
+    @param vy Initial velocity of bodies 1 and 2 in y axis
+    @param t_min Returns before this time are ignored
+    @param t_max Integration time
+    @returns Tuple `(distance, time)`, distance is relative to norm of initial state
+    """
+    start = self.initial_state(vx, vy)
+    solution = solve_ivp(self.system_of_equations, (0, t_max), start, rtol=1e-8, atol=1e-8)
+    distance = np.linalg.norm(solution.y - start[:, np.newaxis], axis=0) / np.linalg.norm(start)
+    # skip the initial part, where the orbit has not left the neighbourhood of its initial state yet
+    left = np.flatnonzero(distance > self.settings.get('prefilter', 0.1))
+    valid = (solution.t >= t_min) & (np.arange(len(distance)) > (left[0] if len(left) else len(distance)))
+    if not valid.any():
+      return np.inf, np.nan
+    best = np.flatnonzero(valid)[np.argmin(distance[valid])]
+    return distance[best], solution.t[best]
+
+  def refine(self, vx, vy, period):
+    """Refine a seed with damped Newton iterations
+    @param vx Initial guess of velocity of bodies 1 and 2 in x axis
+    @param vy Initial guess of velocity of bodies 1 and 2 in y axis
+    @param period Initial guess of period
+    @returns Dictionary with `vx`, `vy`, `period`, `period_days`, `return_error`, `iterations`, `converged`
+    and `stability` (largest modulus of monodromy matrix eigenvalues, above `1` for unstable orbits)
+    """
+    tol = self.settings.get('tol', 1e-9)
+    guess = np.array([vx, vy, period], dtype=np.float64)
+    residual, jacobian, monodromy = self.residual(*guess)
+    error = np.linalg.norm(residual)
+    iterations = 0
+    while error > tol and iterations < self.settings.get('max_iterations', 25):
+      iterations += 1
+      step = np.linalg.lstsq(jacobian, -residual, rcond=None)[0]
+      damping = 1.0
+      while damping > 1e-3:
+        trial = guess + damping * step
+        if trial[2] > 0:
+          trial_residual, trial_jacobian, trial_monodromy = self.residual(*trial)
+          if np.linalg.norm(trial_residual) < error:
+            break
+        damping /= 2
+      else:
+        # no step decreases residual, seed is stuck in a local minimum
+        break
+      guess, residual, jacobian, monodromy = trial, trial_residual, trial_jacobian, trial_monodromy
+      error = np.linalg.norm(residual)
+
+    return {
+      'vx': float(guess[0]),
+      'vy': float(guess[1]),
+      'period': float(guess[2]),
+      'period_days': float(guess[2] / (24 * 3600)),
+      'return_error': float(error),
+      'iterations': iterations,
+      'converged': bool(error <= tol),
+      'stability': float(np.max(np.abs(np.linalg.eigvals(monodromy)))),
+    }
+
+  def seeds(self):
+    """Generate prefilter seeds
+    @returns List of `(vx, vy, t_min, t_max)` tuples
+    """
+    if 'vx_range' in self.settings:
+      points = self.settings.get('points', 10)
+      t_max = self.settings['max_period']
+      grid = itertools.product(np.linspace(*self.settings['vx_range'], points), np.linspace(*self.settings['vy_range'], points))
+      return [(vx, vy, 0.0, t_max) for vx, vy in grid]
+    seeds = self.settings.get('seeds', None)
+    if seeds is None:
+      body = self.params['1']
+      seeds = [(body.vx_0, body.vy_0, self.params['days'] * 24 * 3600)]
+    # closest return is looked up around guessed period
+    return [(vx, vy, 0.5 * period, 1.5 * period) for vx, vy, period in seeds]
+
+  def search(self):
+    """Prefilter seeds, refine the promising ones and drop duplicates
+    @returns List of orbit dictionaries (see `refine`), converged orbits first, sorted by return error
+    """
+    from tqdm import tqdm
+
+    seeds = self.seeds()
+    workers = self.settings.get('workers', 1)
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+      self.logger.warning(f"Prefiltering {len(seeds)} seeds, it will take some time")
+      batches = [seeds[start:start + 16] for start in range(0, len(seeds), 16)]
+      if executor is None:
+        returns = (_prefilter_seeds(self, batch) for batch in batches)
+      else:
+        returns = executor.map(_prefilter_seeds, [self] * len(batches), batches)
+      returns = [result for batch in tqdm(returns, total=len(batches), file=sys.stdout) for result in batch]
+
+      threshold = self.settings.get('prefilter', 0.1)
+      candidates = [(vx, vy, time) for (vx, vy, _, _), (distance, time) in zip(seeds, returns) if distance < threshold]
+      self.logger.info(f"{len(candidates)}/{len(seeds)} seeds passed return proximity prefilter, refining them")
+      if executor is None:
+        orbits = [_refine_seed(self, candidate) for candidate in tqdm(candidates, file=sys.stdout)]
+      else:
+        orbits = list(tqdm(executor.map(_refine_seed, [self] * len(candidates), candidates), total=len(candidates), file=sys.stdout))
+    finally:
+      if executor is not None:
+        executor.shutdown()
+
+    # several seeds usually converge to the same orbit, keep the best refined copy of each
+    unique = {}
+    for orbit in orbits:
+      key = (round(orbit['vx'], 6), round(orbit['vy'], 6), round(orbit['period'], 4))
+      if key not in unique or orbit['return_error'] < unique[key]['return_error']:
+        unique[key] = orbit
+    orbits = sorted(unique.values(), key=lambda orbit: (not orbit['converged'], orbit['return_error']))
+    self.logger.info(f"Found {sum(orbit['converged'] for orbit in orbits)} periodic orbits")
+    return orbits
+
+  def save(self, orbits, path):
+    """Log found orbits and save them to a CSV file
+    @param orbits List of orbit dictionaries returned by `search`
+    @param path Output CSV file
+    """
+    columns = ('vx', 'vy', 'period', 'period_days', 'return_error', 'iterations', 'converged', 'stability')
+    with open(path, 'w', newline='') as file:
+      writer = csv.writer(file)
+      writer.writerow(columns)
+      for orbit in orbits:
+        writer.writerow([repr(orbit[column]) if isinstance(orbit[column], float) else orbit[column] for column in columns])
+    for orbit in orbits:
+      self.logger.info(
+        f"vx={orbit['vx']:.12f} vy={orbit['vy']:.12f} T={orbit['period']:.10f} ({orbit['period_days']:.6e} days), "
+        f"return error {orbit['return_error']:.2e}, {orbit['iterations']} iterations, "
+        f"{'converged' if orbit['converged'] else 'not converged'}, stability {orbit['stability']:.3f}"
+      )
+    self.logger.info(f"Periodic orbits saved as \"{path}\"")
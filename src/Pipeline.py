@@ -0,0 +1,212 @@
+""" @package Pipeline
+
+@brief Running complete configurations, one at a time or as a batch
+
+@details This module defines `run_configuration` function which performs every step of a single run
+(solving, plots, animation, Lyapunov analysis and stability map, depending on configuration) and
+BatchRunner class which runs many configurations in a process pool.
+
+Every batch job writes all of its files (plots, animation, stability map, `profile.json` and `run.log`)
+to its own directory `<output_dir>/<configuration>`. Workers select a non-interactive backend and import
+simulation and plotting modules once when started, so jobs scheduled on the same worker share warm imports.
+A failing job is logged and reported, remaining jobs keep running. A summary table is printed at the end.
+
+Usage example:
+@code
+  runner = BatchRunner(['butterfly', 'goggles'], 'gallery', workers=4)
+  results = runner.run()
+  runner.print_summary(results)
+@endcode
+"""
+
+from .Logger import log_format, time_format
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import logging
+import os
+import time
+import traceback
+
+def run_configuration(params, profiler=None):
+  """Run all stages of a configuration
+  @param params Simulation parameters merged with plot parameters
+  @param profiler Profiler measuring stages, disabled unless provided
+  """
+  from .Simulator import ThreeBodySimulator, LyapunovAnalyzer
+  from .Parareal import PararealSimulator
+  from .StabilityMap import StabilityMapAnalyzer
+  from .Plotter import ThreeBodyPlotter, LyapunovPlotter, StabilityMapPlotter
+  from .Profiler import Profiler
+
+  profiler = profiler or Profiler()
+
+  if params.get('parareal', None):
+    sim = PararealSimulator(params)
+  elif params.get('model_reduction', None) is not None:
+    from .Hierarchical import HierarchicalSimulator
+    sim = HierarchicalSimulator(params)
+  else:
+    sim = ThreeBodySimulator(params)
+  with profiler.stage('solve'):
+    if params.get('live', False) and not params.get('parareal', None) and params.get('model_reduction', None) is None:
+      from .LiveView import LiveView
+      solution = LiveView(sim, params).run()
+    else:
+      solution = sim.solve_system_of_equations()
+  profiler.record('solve', nfev=solution.nfev, njev=solution.njev, nlu=solution.nlu, steps=getattr(solution, 'steps', len(solution.t) - 1))
+
+  plotter = ThreeBodyPlotter(solution, params, profiler)
+  with profiler.stage('plot_detailed'):
+    plotter.plot_detailed()
+  with profiler.stage('plot_phase'):
+    plotter.plot_phase()
+  with profiler.stage('plot_phase_detailed_x'):
+    plotter.plot_phase_detailed_x()
+  with profiler.stage('plot_positions'):
+    plotter.plot_positions()
+  if params.get('animation', True):
+    with profiler.stage('animation'):
+      plotter.make_animation()
+
+  if params.get('lyapunov', None):
+    lyapunov_sim = LyapunovAnalyzer(params)
+    with profiler.stage('lyapunov'):
+      xs, exponents = lyapunov_sim.analyze_x0()
+    profiler.record('lyapunov', points=len(xs), nfev=lyapunov_sim.nfev, steps=lyapunov_sim.steps, integrated_days=sum(lyapunov_sim.stop_times))
+
+    lyapunov_plotter = LyapunovPlotter(xs, exponents, params)
+    with profiler.stage('plot_lyapunov'):
+      lyapunov_plotter.plot_lyapunov()
+
+  if params.get('stability_map', None):
+    map_sim = StabilityMapAnalyzer(params)
+    with profiler.stage('stability_map'):
+      xs, ys, values = map_sim.analyze()
+
+    map_plotter = StabilityMapPlotter(xs, ys, values, params)
+    with profiler.stage('plot_stability_map'):
+      map_plotter.plot_stability_map()
+
+def _init_worker():
+  """Select non-interactive backend and import modules once per worker process"""
+  import matplotlib
+  matplotlib.use('Agg')
+  from . import Simulator, Parareal, StabilityMap, Plotter
+
+def _run_job(name, directory, animation):
+  """Run a single configuration with all of its files written to a directory, executed in worker processes
+  @param name Configuration name
+  @param directory Output directory of this job
+  @param animation If not set, animation is skipped
+  @returns Dictionary with `configuration`, `status`, `wall_time`, `directory`, `error` and stage timings
+  """
+  from .ArgsHandler import ThreeBodyArgParser
+  from .Profiler import Profiler
+  import matplotlib.pyplot as plt
+
+  os.makedirs(directory, exist_ok=True)
+  logger = logging.getLogger("main")
+  handler = logging.FileHandler(os.path.join(directory, 'run.log'), mode='w')
+  handler.setFormatter(logging.Formatter(log_format, time_format))
+  logger.addHandler(handler)
+  logger.propagate = False
+
+  result = {'configuration': name, 'status': 'ok', 'wall_time': 0.0, 'directory': directory, 'error': '', 'stages': {}}
+  profiler = Profiler(enabled=True)
+  start = time.perf_counter()
+  try:
+    params = ThreeBodyArgParser().get_configuration(name)()
+    params |= {
+      "detailed_file": os.path.join(directory, "detailed_plot.png"),
+      "trajectories_file": os.path.join(directory, "trajectories_plot.png"),
+      "phase_file": os.path.join(directory, "phase_plot.png"),
+      "detailed_phase_file": os.path.join(directory, "detailed_phase_plot.png"),
+      "animation_file": os.path.join(directory, "three_body_animation.gif"),
+      "lyapunov_file": os.path.join(directory, "lyapunov.png"),
+      "stability_map_file": os.path.join(directory, "stability_map.png"),
+      "animation": animation,
+      "quiet": True
+    }
+    if params.get('stability_map', None):
+      settings = params['stability_map']
+      params['stability_map'] = settings | {'file': os.path.join(directory, os.path.basename(settings.get('file', 'stability_map')))}
+    run_configuration(params, profiler)
+  except Exception as e:
+    logger.error(traceback.format_exc())
+    result['status'] = 'failed'
+    result['error'] = f"{type(e).__name__}: {e}"
+  finally:
+    result['wall_time'] = time.perf_counter() - start
+    result['stages'] = {stage: metrics['wall_time'] for stage, metrics in profiler.stages.items() if 'wall_time' in metrics}
+    profiler.save(os.path.join(directory, 'profile.json'))
+    plt.close('all')
+    logger.removeHandler(handler)
+    handler.close()
+    logger.propagate = True
+  return result
+
+class BatchRunner:
+  """Class that runs many configurations in a process pool"""
+  def __init__(self, names, output_dir, workers=None, animation=True):
+    """Constructor for BatchRunner
+    @param names List of configuration names
+    @param output_dir Directory containing one subdirectory per configuration
+    @param workers Size of a process pool, defaults to number of available cores
+    @param animation If not set, animations are skipped
+    """
+    ## Configurations to run, in submission order
+    self.names = list(names)
+    ## Directory containing per-job directories
+    self.output_dir = output_dir
+    ## Size of a process pool
+    self.workers = min(workers or os.cpu_count(), len(self.names)) or 1
+    ## If not set, animations are skipped
+    self.animation = animation
+    ## Global logger reference
+    self.logger = logging.getLogger("main")
+
+  @staticmethod
+  def job_name(name):
+    """Name of job directory, scenario files are named after their file name without extension"""
+    return os.path.splitext(os.path.basename(name))[0]
+
+  def run(self):
+    """Run all configurations, failures of single jobs do not stop the batch
+    @returns List of job results (see `_run_job`), in order of configuration names
+    """
+    self.logger.warning(f"Running {len(self.names)} configurations with {self.workers} workers, it will take some time")
+    results = {}
+    with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker) as executor:
+      futures = {
+        executor.submit(_run_job, name, os.path.join(self.output_dir, self.job_name(name)), self.animation): name
+        for name in self.names
+      }
+      for future in as_completed(futures):
+        name = futures[future]
+        try:
+          result = future.result()
+        except Exception as e:
+          # worker died (e.g. killed for running out of memory), job did not get a chance to report
+          result = {'configuration': name, 'status': 'failed', 'wall_time': float('nan'), 'directory': os.path.join(self.output_dir, self.job_name(name)), 'error': f"{type(e).__name__}: {e}", 'stages': {}}
+        results[name] = result
+        if result['status'] == 'ok':
+          self.logger.info(f"{name} done in {result['wall_time']:.1f}s")
+        else:
+          self.logger.error(f"{name} failed: {result['error']}, see \"{os.path.join(result['directory'], 'run.log')}\"")
+    return [results[name] for name in self.names]
+
+  def print_summary(self, results):
+    """Print summary table of a batch
+    @param results List of job results returned by `run`
+    """
+    width = max(len('configuration'), *(len(result['configuration']) for result in results))
+    print(f"\n{'configuration':<{width}} {'status':>7} {'wall [s]':>9} {'solve [s]':>10} {'plots [s]':>10}  details")
+    for result in results:
+      stages = result['stages']
+      solve = stages.get('solve', float('nan'))
+      plots = sum(seconds for stage, seconds in stages.items() if stage.startswith('plot') or stage == 'animation')
+      details = result['error'] or result['directory']
+      print(f"{result['configuration']:<{width}} {result['status']:>7} {result['wall_time']:>9.1f} {solve:>10.2f} {plots:>10.2f}  {details}")
+    failed = sum(result['status'] != 'ok' for result in results)
+    print(f"{len(results) - failed}/{len(results)} configurations succeeded")
@@ -3,12 +3,18 @@
 @brief Plotting facilities
 
 @details This module defines classes which visualize solutions for a given three body problem.
-Module two plotters, one for visualizing general solutions and one designed to plot Lyapunov exponents.
+Module defines plotters, one for visualizing general solutions and one designed to plot Lyapunov exponents.
 Their usage is specified in each classes' documentation.
 
 Classes overview:
 - `ThreeBodyPlotter` - general plotter, capable of visualizing bodies' tragectories, phase diagrams and animating solution
 - `LyapunovPlotter` - plotter specialized for plotting Lyapunov exponents
+- `StabilityMapPlotter` - plotter specialized for plotting 2D stability maps
+
+Static plots are drawn by a shared FigureRenderer (see `src/Renderer.py`), which builds every kind of figure once
+and only swaps its data for later plots, so repeated plotting neither rebuilds figures nor leaves them open.
+Plots use stored solution times, solutions stored without dense output (see output policy in `src/Simulator.py`)
+are animated by linear interpolation between stored states.
 
 Usage example:
 @code
@@ -28,6 +34,10 @@ Usage example:
 @endcode
 """
 
+from .Bodies import BodyTable
+from .Profiler import Profiler
+from .Renderer import default_renderer
+
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.animation as animation
@@ -36,8 +46,8 @@ import os
 import logging
 
 class ThreeBodyPlotter:
-  """Generate plots from solution of a three body problem"""
-  def __init__(self, solution, params):
+  """Generate plots from solution of a three body problem, any number of bodies is supported"""
+  def __init__(self, solution, params, profiler=None, renderer=None):
     
     ## Precalculated solution
     self.solution = solution
@@ -55,134 +65,173 @@ class ThreeBodyPlotter:
     self.phase_detailed_path = params['detailed_phase_file']
     ## Animation file path
     self.animation_path = params['animation_file']
+    ## Profiler measuring animation encoding, disabled unless provided
+    self.profiler = profiler or Profiler()
+    ## Renderer reusing figure templates between plots
+    self.renderer = renderer or default_renderer
     ## If set to true script will not show an interactive window
     self.quiet = params['quiet']
+    ## Table of bodies, used to locate each body's components in a solution
+    self.bodies = BodyTable.from_params(params)
+    ## Number of leading bodies drawn individually, remaining ones are drawn as a cloud
+    self.plotted_bodies = min(params.get('plot_bodies', self.bodies.n), self.bodies.n)
     if "DISPLAY" not in os.environ:
       self.logger.warning("Interactive plots not supported")
       self.interactive_supported = False
     else:
       self.logger.info("Interactive plots supported")
       self.interactive_supported = True
+    ## Whether plots are shown in an interactive window after saving
+    self.show = not self.quiet and self.interactive_supported
+
+  def body_color(self, body_no):
+    """Colour used for a given body across all plots
+    @param body_no Body number, starting from 1
+    """
+    colors = ('red', 'green', 'blue')
+    if body_no <= len(colors):
+      return colors[body_no - 1]
+    return plt.get_cmap('tab10')(body_no % 10)
+
+  def positions(self, body_no, y=None):
+    """Position components of a body
+    @param body_no Body number, starting from 1
+    @param y State array to take components from, defaults to `solution.y`
+    @returns List of arrays, one per simulated dimension
+    """
+    y = self.solution.y if y is None else y
+    return [y[self.bodies.position_index(body_no, axis)] for axis in range(self.bodies.dim)]
+
+  def velocities(self, body_no, y=None):
+    """Velocity components of a body
+    @param body_no Body number, starting from 1
+    @param y State array to take components from, defaults to `solution.y`
+    @returns List of arrays, one per simulated dimension
+    """
+    y = self.solution.y if y is None else y
+    return [y[self.bodies.velocity_index(body_no, axis)] for axis in range(self.bodies.dim)]
+
+  def states(self, t):
+    """States at given times, from dense output if solution keeps it, linearly interpolated between stored states otherwise
+    @param t Array of times
+    @returns Array of shape `(n_state, len(t))`
+    """
+    if self.solution.sol is not None:
+      return self.solution.sol(t)
+    return np.array([np.interp(t, self.solution.t, component) for component in self.solution.y])
 
   def plot_detailed(self):
-    """Plot the solutions for all 6 variables with respect to time
+    """Plot the solutions for all variables with respect to time
     Plot is saved to file specified in `--detailed-file` cmdline argument or to default one.
     Plot is shown is `--quiet` was not passed.
     """
-
-    x1, y1 = self.solution.y[0], self.solution.y[1]
-    x2, y2 = self.solution.y[2], self.solution.y[3]
-    x3, y3 = self.solution.y[4], self.solution.y[5]
-    vx1, vy1 = self.solution.y[6], self.solution.y[7]
-    vx2, vy2 = self.solution.y[8], self.solution.y[9]
-    vx3, vy3 = self.solution.y[10], self.solution.y[11]
-
-    t = np.linspace(self.solution.t[0], self.solution.t[-1], len(x1))
-
-    # Position components
-    fig, axes = plt.subplots(3, 2)
-    fig.set_size_inches((15, 10))
-    if self.params['title']:
-      fig.suptitle(self.params['title'] + ', detailed plots')
-
-    # setup basic properties for r plots
-    for i, j in zip((0,1,2), (0,0,0)):
-      axes[i][j].set_xlabel("$t$ [s]")
-      axes[i][j].set_ylabel("$r$ [m]")
-      axes[i][j].grid(True)
-    axes[0][0].plot(t, np.sqrt(x1**2 + y1**2), label='$r$ (Body 1)', color='red')
-    axes[1][0].plot(t, np.sqrt(x2**2 + y2**2), label='$r$ (Body 2)', color='green')
-    axes[2][0].plot(t, np.sqrt(x3**2 + y3**2), label='$r$ (Body 3)', color='blue')
-
-    # setup basic properties for v plots
-    for i, j in zip((0,1,2), (1,1,1)):
-      axes[i][j].set_xlabel("$t$ [s]")
-      axes[i][j].set_ylabel("$v$ [m/s]")
-      axes[i][j].grid(True)
-    axes[0][1].plot(t, np.sqrt(vx1**2 + vy1**2), label='$v$ (Body 1)', color='red')
-    axes[1][1].plot(t, np.sqrt(vx2**2 + vy2**2), label='$v$ (Body 2)', color='green')
-    axes[2][1].plot(t, np.sqrt(vx3**2 + vy3**2), label='$v$ (Body 3)', color='blue')
-
-    fig.legend(bbox_to_anchor=(1.05, 1), loc='upper left')
-    fig.tight_layout()
-    plt.savefig(self.detailed_path)
+    t = self.solution.t
+
+    def build(fig):
+      axes = fig.subplots(self.plotted_bodies, 2, squeeze=False)
+      fig.set_size_inches((15, 10 * self.plotted_bodies / 3))
+      lines = []
+      for body_no in range(1, self.plotted_bodies + 1):
+        # setup basic properties for r plots
+        ax = axes[body_no - 1][0]
+        ax.set_xlabel("$t$ [s]")
+        ax.set_ylabel("$r$ [m]")
+        ax.grid(True)
+        r_line, = ax.plot([], [], label=f'$r$ (Body {body_no})', color=self.body_color(body_no))
+
+        # setup basic properties for v plots
+        ax = axes[body_no - 1][1]
+        ax.set_xlabel("$t$ [s]")
+        ax.set_ylabel("$v$ [m/s]")
+        ax.grid(True)
+        v_line, = ax.plot([], [], label=f'$v$ (Body {body_no})', color=self.body_color(body_no))
+        lines.append((r_line, v_line))
+      fig.legend(bbox_to_anchor=(1.05, 1), loc='upper left')
+      return {'title': fig.suptitle(''), 'lines': lines}
+
+    def update(artists):
+      artists['title'].set_text(self.params['title'] + ', detailed plots' if self.params['title'] else '')
+      for body_no, (r_line, v_line) in enumerate(artists['lines'], start=1):
+        r_line.set_data(t, np.sqrt(sum(component**2 for component in self.positions(body_no))))
+        v_line.set_data(t, np.sqrt(sum(component**2 for component in self.velocities(body_no))))
+        for line in (r_line, v_line):
+          line.axes.relim()
+          line.axes.autoscale_view()
+
+    self.renderer.render('detailed', self.plotted_bodies, build, update, self.detailed_path, self.show)
     self.logger.info(f"Detailed plot saved as \"{self.detailed_path}\"")
-    if not self.quiet and self.interactive_supported:
-      plt.show()
 
   def plot_positions(self):
-    """Plot positions of 3 bodies on XY plane
+    """Plot positions of all bodies on XY plane
     Plot is saved to file specified in `--trajectories-file` cmdline argument or to default one.
     Plot is shown is `--quiet` was not passed.
     """
-    fig, ax = plt.subplots()
-    fig.set_size_inches((10, 10))
-    
-    x1, y1 = self.solution.y[0], self.solution.y[1]
-    x2, y2 = self.solution.y[2], self.solution.y[3]
-    x3, y3 = self.solution.y[4], self.solution.y[5]
-
-    # Position components
-    ax.plot(x1, y1, label='Body 1', color='red')
-    ax.plot(x2, y2, label='Body 2', color='green')
-    ax.plot(x3, y3, label='Body 3', color='blue')
-    if self.params['title']:
-      ax.set_title(self.params['title'] + ', trajectories')
-    ax.set_xlabel('$x$ (m)')
-    ax.set_ylabel('$y$ (m)')
-    ax.legend(bbox_to_anchor=(1.05, 1), loc='upper left')
-    ax.grid(True)
-    
-    ax.set_aspect('equal', 'box')
-    fig.tight_layout()
-    plt.savefig(self.trajectories_path)
+    def build(fig):
+      ax = fig.subplots()
+      fig.set_size_inches((10, 10))
+      lines = [ax.plot([], [], label=f'Body {body_no}', color=self.body_color(body_no))[0] for body_no in range(1, self.plotted_bodies + 1)]
+      # remaining bodies share a single artist, their trajectories are separated by NaNs
+      cloud, = ax.plot([], [], color='grey', linewidth=0.3, alpha=0.3)
+      ax.set_xlabel('$x$ (m)')
+      ax.set_ylabel('$y$ (m)')
+      ax.legend(bbox_to_anchor=(1.05, 1), loc='upper left')
+      ax.grid(True)
+      ax.set_aspect('equal', 'box')
+      return {'ax': ax, 'lines': lines, 'cloud': cloud}
+
+    def update(artists):
+      ax = artists['ax']
+      # Position components, 3D trajectories are projected onto XY plane
+      for body_no, line in enumerate(artists['lines'], start=1):
+        line.set_data(*self.positions(body_no)[:2])
+      if self.plotted_bodies < self.bodies.n:
+        cloud = np.array([self.positions(body_no)[:2] for body_no in range(self.plotted_bodies + 1, self.bodies.n + 1)])
+        gaps = np.full((len(cloud), 2, 1), np.nan)
+        cloud = np.concatenate((cloud, gaps), axis=2)
+        artists['cloud'].set_data(cloud[:, 0].ravel(), cloud[:, 1].ravel())
+      else:
+        artists['cloud'].set_data([], [])
+      ax.set_title(self.params['title'] + ', trajectories' if self.params['title'] else '')
+      ax.relim()
+      ax.autoscale_view()
+
+    self.renderer.render('positions', self.plotted_bodies, build, update, self.trajectories_path, self.show)
     self.logger.info(f"Trajectories plot saved as \"{self.trajectories_path}\"")
-    if not self.quiet and self.interactive_supported:
-      plt.show()
 
   def plot_phase(self):
-    """Plot phase portraits (position, velocity) of 3 bodies
+    """Plot phase portraits (position, velocity) of all bodies
     Plot is saved to file specified in `--phase-file` cmdline argument or to default one.
     Plot is shown is `--quiet` was not passed.
     """
-    fig, axes = plt.subplots(3, 2)
-    fig.set_size_inches((20, 15))
-    
-    x1, y1 = self.solution.y[0], self.solution.y[1]
-    x2, y2 = self.solution.y[2], self.solution.y[3]
-    x3, y3 = self.solution.y[4], self.solution.y[5]
-    vx1, vy1 = self.solution.y[6], self.solution.y[7]
-    vx2, vy2 = self.solution.y[8], self.solution.y[9]
-    vx3, vy3 = self.solution.y[10], self.solution.y[11]
-
-    # setup basic properties for x plots
-    for i, j, body_no in zip((0,1,2), (0,0,0), (1,2,3)):
-      axes[i][j].set_xlabel("$x$ [m]")
-      axes[i][j].set_ylabel("$v_x$ [m/s]")
-      axes[i][j].grid(True)
-      axes[i][j].set_title(f"Body {body_no}")
-    axes[0][0].plot(x1, vx1, label='Body 1', color='red')
-    axes[1][0].plot(x2, vx2, label='Body 2', color='green')
-    axes[2][0].plot(x3, vx3, label='Body 3', color='blue')
-
-    # setup basic properties for y plots
-    for i, j, body_no in zip((0,1,2), (1,1,1), (1,2,3)):
-      axes[i][j].set_xlabel("$y$ [m]")
-      axes[i][j].set_ylabel("$v_y$ [m/s]")
-      axes[i][j].grid(True)
-      axes[i][j].set_title(f"Body {body_no}")
-    axes[0][1].plot(y1, vy1, label='Body 1', color='red')
-    axes[1][1].plot(y2, vy2, label='Body 2', color='green')
-    axes[2][1].plot(y3, vy3, label='Body 3', color='blue')
-
-    if self.params['title']:
-      fig.suptitle(self.params['title'] + ', phase plots')
-    fig.legend(bbox_to_anchor=(1.05, 1), loc='upper left')
-    
-    plt.savefig(self.phase_path)
+    def build(fig):
+      axes = fig.subplots(self.plotted_bodies, self.bodies.dim, squeeze=False)
+      fig.set_size_inches((10 * self.bodies.dim, 15 * self.plotted_bodies / 3))
+      lines = []
+      for body_no in range(1, self.plotted_bodies + 1):
+        # one column per axis: x/vx, y/vy and z/vz
+        for axis, name in zip(range(self.bodies.dim), 'xyz'):
+          ax = axes[body_no - 1][axis]
+          ax.set_xlabel(f"${name}$ [m]")
+          ax.set_ylabel(f"$v_{name}$ [m/s]")
+          ax.grid(True)
+          ax.set_title(f"Body {body_no}")
+          lines.append(ax.plot([], [], label=f'Body {body_no}' if axis == 0 else None, color=self.body_color(body_no))[0])
+      fig.legend(bbox_to_anchor=(1.05, 1), loc='upper left')
+      return {'title': fig.suptitle(''), 'lines': lines}
+
+    def update(artists):
+      lines = iter(artists['lines'])
+      for body_no in range(1, self.plotted_bodies + 1):
+        positions, velocities = self.positions(body_no), self.velocities(body_no)
+        for axis in range(self.bodies.dim):
+          line = next(lines)
+          line.set_data(positions[axis], velocities[axis])
+          line.axes.relim()
+          line.axes.autoscale_view()
+      artists['title'].set_text(self.params['title'] + ', phase plots' if self.params['title'] else '')
+
+    self.renderer.render('phase', (self.plotted_bodies, self.bodies.dim), build, update, self.phase_path, self.show, tight=False)
     self.logger.info(f"Phase plot saved as \"{self.phase_path}\"")
-    if not self.quiet and self.interactive_supported:
-      plt.show()
 
   def plot_phase_detailed_x(self):
     """Generate zoomed phase portraits with respect to x and vx for a given body.
@@ -192,29 +241,27 @@ class ThreeBodyPlotter:
     # check if detailed phase plot params are set, otherwise exit
     if not self.params.get('phase_detailed_x', None):
       return
-    fig, ax = plt.subplots()
-    fig.set_size_inches((15, 10))
-    
     body_no = self.params['phase_detailed_x']['body_no']
-    x = self.solution.y[2*(body_no-1)]
-    vx = self.solution.y[6 + 2*(body_no-1)]
-
-    # setup basic properties for x plots
-    ax.set_xlabel("$x$ [m]")
-    ax.set_ylabel("$v_x$ [m/s]")
-    ax.set_xlim(self.params['phase_detailed_x']['xrange'])
-    ax.set_ylim(self.params['phase_detailed_x']['yrange'])
-    ax.grid(True)
-    ax.plot(x, vx, '-r|', label=f'Body {body_no}', markersize=4)
-
-    if self.params['title']:
-      fig.suptitle(self.params['title'] + f', body {body_no}\'s $x$ parameters\' detailed phase plot')
-    fig.legend(bbox_to_anchor=(1.05, 1), loc='upper left')
-    
-    plt.savefig(self.phase_detailed_path)
+
+    def build(fig):
+      ax = fig.subplots()
+      fig.set_size_inches((15, 10))
+      # setup basic properties for x plots
+      ax.set_xlabel("$x$ [m]")
+      ax.set_ylabel("$v_x$ [m/s]")
+      ax.grid(True)
+      line, = ax.plot([], [], '-r|', label=f'Body {body_no}', markersize=4)
+      fig.legend(bbox_to_anchor=(1.05, 1), loc='upper left')
+      return {'ax': ax, 'line': line, 'title': fig.suptitle('')}
+
+    def update(artists):
+      artists['line'].set_data(self.positions(body_no)[0], self.velocities(body_no)[0])
+      artists['ax'].set_xlim(self.params['phase_detailed_x']['xrange'])
+      artists['ax'].set_ylim(self.params['phase_detailed_x']['yrange'])
+      artists['title'].set_text(self.params['title'] + f', body {body_no}\'s $x$ parameters\' detailed phase plot' if self.params['title'] else '')
+
+    self.renderer.render('phase_detailed_x', body_no, build, update, self.phase_detailed_path, self.show, tight=False)
     self.logger.info(f"Detailed phase plot saved as \"{self.phase_detailed_path}\"")
-    if not self.quiet and self.interactive_supported:
-      plt.show()
 
   def make_animation(self):
     """Generates animation out of precalculated solution.
@@ -227,7 +274,9 @@ class ThreeBodyPlotter:
     
     # Interpolate solution to get smooth animation
     t = np.linspace(self.solution.t[0], self.solution.t[-1], self.params['frames'])
-    sol = self.solution.sol(t)
+    sol = self.states(t)
+    # XY projection of each body's position, shape (bodies, 2, frames)
+    xy = np.array([self.positions(body_no, sol)[:2] for body_no in range(1, self.bodies.n + 1)])
     
     # Prepare the figure and axis
     fig, ax = plt.subplots(figsize=(10, 8))
@@ -235,81 +284,46 @@ class ThreeBodyPlotter:
     ax.set_ylabel('$y$ [m]')
     
     # Compute max position for axis limits
-    max_pos = np.max(np.abs(sol[:6]))
+    max_pos = np.max(np.abs(xy))
     ax.set_xlim(-max_pos*1.2, max_pos*1.2)
     ax.set_ylim(-max_pos*1.2, max_pos*1.2)
     ax.set_aspect('equal')
     ax.grid(True, linestyle='--', alpha=0.5)
     
     # Initialize plot objects
-    line1, = ax.plot([], [], 'r-', alpha=0.3, linewidth=1, label='Body 1')
-    line2, = ax.plot([], [], 'b-', alpha=0.3, linewidth=1, label='Body 2')
-    line3, = ax.plot([], [], 'g-', alpha=0.3, linewidth=1, label='Body 3')
-    
-    point1, = ax.plot([], [], 'ro', markersize=10)
-    point2, = ax.plot([], [], 'bo', markersize=10)
-    point3, = ax.plot([], [], 'go', markersize=10)
+    lines = [
+      ax.plot([], [], '-', color=self.body_color(body_no), alpha=0.3, linewidth=1, label=f'Body {body_no}')[0]
+      for body_no in range(1, self.plotted_bodies + 1)
+    ]
+    points = [
+      ax.plot([], [], 'o', color=self.body_color(body_no), markersize=10)[0]
+      for body_no in range(1, self.plotted_bodies + 1)
+    ]
+    # bodies which are not drawn individually share a single artist
+    cloud, = ax.plot([], [], '.', color='grey', markersize=1)
     
     # Traces for trajectories
     trace_length = min(100, self.params['frames'])
-    traces = [[], [], []]
     
     def init():
       """Initialize the animation"""
-      traces[0].clear()
-      traces[1].clear()
-      traces[2].clear()
-
-      line1.set_data([], [])
-      line2.set_data([], [])
-      line3.set_data([], [])
-      point1.set_data([], [])
-      point2.set_data([], [])
-      point3.set_data([], [])
-      return line1, line2, line3, point1, point2, point3
+      for line, point in zip(lines, points):
+        line.set_data([], [])
+        point.set_data([], [])
+      cloud.set_data([], [])
+      return *lines, *points, cloud
     
     def animate(frame_num):
       """Animation update function"""
-      # Current positions
-      x1, y1 = sol[0, frame_num], sol[1, frame_num]
-      x2, y2 = sol[2, frame_num], sol[3, frame_num]
-      x3, y3 = sol[4, frame_num], sol[5, frame_num]
-      
-      # Traces disappear once animation loops back
-      if frame_num == 0:
-        traces[0].clear()
-        traces[1].clear()
-        traces[2].clear()
-
-      # Update traces
-      traces[0].append((x1, y1))
-      traces[1].append((x2, y2))
-      traces[2].append((x3, y3))
-      
-      # Limit trace length
-      traces[0] = traces[0][-trace_length:]
-      traces[1] = traces[1][-trace_length:]
-      traces[2] = traces[2][-trace_length:]
-      
-      # Unpack traces
-      x1_trace = [p[0] for p in traces[0]]
-      y1_trace = [p[1] for p in traces[0]]
-      x2_trace = [p[0] for p in traces[1]]
-      y2_trace = [p[1] for p in traces[1]]
-      x3_trace = [p[0] for p in traces[2]]
-      y3_trace = [p[1] for p in traces[2]]
-      
-      # Update lines and points
-      line1.set_data(x1_trace, y1_trace)
-      line2.set_data(x2_trace, y2_trace)
-      line3.set_data(x3_trace, y3_trace)
-      
-      # Ensure data is a list for set_data
-      point1.set_data([x1], [y1])
-      point2.set_data([x2], [y2])
-      point3.set_data([x3], [y3])
-      
-      return line1, line2, line3, point1, point2, point3
+      # Traces disappear once animation loops back, so they start at frame 0
+      first = max(0, frame_num + 1 - trace_length)
+      for body, (line, point) in enumerate(zip(lines, points)):
+        # Update lines and points
+        line.set_data(xy[body, 0, first:frame_num + 1], xy[body, 1, first:frame_num + 1])
+        # Ensure data is a list for set_data
+        point.set_data([xy[body, 0, frame_num]], [xy[body, 1, frame_num]])
+      cloud.set_data(xy[self.plotted_bodies:, 0, frame_num], xy[self.plotted_bodies:, 1, frame_num])
+      return *lines, *points, cloud
     
     # Create animation
     self.logger.info("Generating animation...")
@@ -329,17 +343,19 @@ class ThreeBodyPlotter:
     # Save animation 
     try:
       self.logger.info("Saving animation (this might take a while)...")
-      anim.save(self.animation_path, writer='pillow')
+      with self.profiler.stage('animation_encoding'):
+        anim.save(self.animation_path, writer='pillow')
       self.logger.info(f"Animation saved as \"{self.animation_path}\"")
     except Exception as e:
       self.logger.critical(f"Could not save animation: {e}")
     
-    if not self.quiet and self.interactive_supported:
+    if self.show:
       plt.show()
+    plt.close(fig)
   
 class LyapunovPlotter:
   """Class that implements plotting of Lyapunov exponents with respect to x_0 of an arbitrary body"""
-  def __init__(self, xs, ys, params):
+  def __init__(self, xs, ys, params, renderer=None):
     ## Simulator parameters
     self.params = params
     ## Global logger reference
@@ -352,12 +368,16 @@ class LyapunovPlotter:
     self.ys = ys
     ## If set to true script will not show an interactive window
     self.quiet = params['quiet']
+    ## Renderer reusing figure templates between plots
+    self.renderer = renderer or default_renderer
     if "DISPLAY" not in os.environ:
       self.logger.warning("Interactive plots not supported")
       self.interactive_supported = False
     else:
       self.logger.info("Interactive plots supported")
       self.interactive_supported = True
+    ## Whether plots are shown in an interactive window after saving
+    self.show = not self.quiet and self.interactive_supported
 
   def plot_lyapunov(self):
     """Plot Lyapunov exponents with respect to given x_0 range for arbitrary body.
@@ -368,23 +388,93 @@ class LyapunovPlotter:
     if not self.params.get('lyapunov', None):
       return
     
-    fig, ax = plt.subplots()
-    fig.set_size_inches((10, 10))
-
-    plot_color =  'red' if self.params['lyapunov']['body_no'] == 1 \
-           else 'green' if self.params['lyapunov']['body_no'] == 2 \
-           else 'blue'
-
-    # Position components
-    ax.plot(self.xs, self.ys, color=plot_color, marker='o', linestyle='dashed')
-    if self.params['title']:
-      ax.set_title(self.params['title'] + f", Lyapunov exponent for parameter $x_0$ of body {self.params['lyapunov']['body_no']}")
-    ax.set_xlabel(self.params['lyapunov']['param'] + ' of body ' + str(self.params['lyapunov']['body_no']))
-    ax.set_ylabel('Lyapunov exponent')
-    ax.grid(True)
-    
-    fig.tight_layout()
-    plt.savefig(self.lyapunov_path)
+    body_no = self.params['lyapunov']['body_no']
+
+    def build(fig):
+      ax = fig.subplots()
+      fig.set_size_inches((10, 10))
+      plot_color =  'red' if body_no == 1 \
+             else 'green' if body_no == 2 \
+             else 'blue'
+      line, = ax.plot([], [], color=plot_color, marker='o', linestyle='dashed')
+      ax.set_ylabel('Lyapunov exponent')
+      ax.grid(True)
+      return {'ax': ax, 'line': line}
+
+    def update(artists):
+      ax = artists['ax']
+      artists['line'].set_data(self.xs, self.ys)
+      ax.set_title(self.params['title'] + f", Lyapunov exponent for parameter $x_0$ of body {body_no}" if self.params['title'] else '')
+      ax.set_xlabel(self.params['lyapunov']['param'] + ' of body ' + str(body_no))
+      ax.relim()
+      ax.autoscale_view()
+
+    self.renderer.render('lyapunov', body_no, build, update, self.lyapunov_path, self.show)
     self.logger.info(f"Lyapunov plot saved as \"{self.lyapunov_path}\"")
-    if not self.quiet and self.interactive_supported:
-      plt.show()
+
+class StabilityMapPlotter:
+  """Class that implements plotting of 2D stability maps"""
+  def __init__(self, xs, ys, values, params, renderer=None):
+    ## Simulator parameters
+    self.params = params
+    ## Global logger reference
+    self.logger = logging.getLogger('main')
+    ## Plot will be saved here
+    self.stability_map_path = params['stability_map_file']
+    ## Values of first scanned parameter
+    self.xs = xs
+    ## Values of second scanned parameter
+    self.ys = ys
+    ## Indicator values, array of shape `(len(xs), len(ys))`
+    self.values = values
+    ## If set to true script will not show an interactive window
+    self.quiet = params['quiet']
+    ## Renderer reusing figure templates between plots
+    self.renderer = renderer or default_renderer
+    if "DISPLAY" not in os.environ:
+      self.logger.warning("Interactive plots not supported")
+      self.interactive_supported = False
+    else:
+      self.logger.info("Interactive plots supported")
+      self.interactive_supported = True
+    ## Whether plots are shown in an interactive window after saving
+    self.show = not self.quiet and self.interactive_supported
+
+  def plot_stability_map(self):
+    """Plot stability map as an image over both scanned parameters.
+    Plot is saved to file specified in `--stability-map-file` cmdline argument or to default one.
+    Plot is shown is `--quiet` was not passed.
+    """
+    # check if stability map params are set, otherwise exit
+    if not self.params.get('stability_map', None):
+      return
+    settings = self.params['stability_map']
+    labels = {
+      'escape': 'Escape time [s]',
+      'collision': 'Collision time [s]',
+      'chaos': 'Lyapunov exponent'
+    }
+
+    indicator = settings.get('indicator', 'escape')
+
+    def build(fig):
+      ax = fig.subplots()
+      fig.set_size_inches((10, 10))
+      # failed cells hold NaN and are drawn in a neutral colour
+      cmap = plt.get_cmap('viridis').with_extremes(bad='lightgrey')
+      image = ax.imshow(np.zeros((1, 1)), origin='lower', aspect='auto', interpolation='nearest', cmap=cmap)
+      fig.colorbar(image, ax=ax, label=labels[indicator])
+      return {'ax': ax, 'image': image}
+
+    def update(artists):
+      ax, image = artists['ax'], artists['image']
+      image.set_data(np.ma.masked_invalid(self.values.T))
+      image.set_extent((self.xs[0], self.xs[-1], self.ys[0], self.ys[-1]))
+      image.norm.vmin = image.norm.vmax = None
+      image.autoscale()
+      ax.set_title(self.params['title'] + ', stability map' if self.params['title'] else '')
+      ax.set_xlabel(f"${settings['x'][1]}$ of body {settings['x'][0]}")
+      ax.set_ylabel(f"${settings['y'][1]}$ of body {settings['y'][0]}")
+
+    self.renderer.render('stability_map', indicator, build, update, self.stability_map_path, self.show)
+    self.logger.info(f"Stability map saved as \"{self.stability_map_path}\"")
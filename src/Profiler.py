@@ -0,0 +1,114 @@
+""" @package Profiler
+
+@brief Per-stage timing and metrics of a program run
+
+@details This module defines Profiler class which measures wall time, CPU time and peak resident memory of named
+stages (solve, each plot, animation encoding, Lyapunov sweep) and collects arbitrary metrics attached to them,
+like number of right hand side evaluations. Metrics are saved to JSON or CSV file (chosen by file extension)
+and summarized in the log.
+
+Disabled profiler is free: `stage` returns a shared no-op context manager and `record` returns immediately,
+so instrumentation can stay in place in every run.
+
+Usage example:
+@code
+  profiler = Profiler(enabled=True)
+  with profiler.stage('solve'):
+    solution = sim.solve_system_of_equations()
+  profiler.record('solve', nfev=solution.nfev)
+  profiler.save('profile.json')
+@endcode
+"""
+
+import contextlib
+import csv
+import json
+import logging
+import sys
+import time
+
+try:
+  import resource
+except ImportError:
+  resource = None
+
+## Shared context manager returned by disabled profiler
+_NO_OP = contextlib.nullcontext()
+
+def peak_rss():
+  """Peak resident set size of this process and its finished children in bytes, `None` if unavailable"""
+  if resource is None:
+    return None
+  # ru_maxrss is in kilobytes on Linux, in bytes on macOS
+  scale = 1 if sys.platform == 'darwin' else 1024
+  own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+  return max(own, children) * scale
+
+class Profiler:
+  """Class that collects per-stage timings and metrics"""
+  def __init__(self, enabled=False):
+    ## If not set, profiler does nothing
+    self.enabled = enabled
+    ## Map `{stage: {metric: value}}`, in order of stage start
+    self.stages = {}
+    ## Global logger reference
+    self.logger = logging.getLogger("main")
+
+  def stage(self, name):
+    """Measure a stage, to be used as a context manager
+    @param name Stage name, repeated stages accumulate their times
+    @returns Context manager
+    """
+    if not self.enabled:
+      return _NO_OP
+    return self._measure(name)
+
+  @contextlib.contextmanager
+  def _measure(self, name):
+    """Context manager measuring wall time, CPU time and peak memory of a stage"""
+    metrics = self.stages.setdefault(name, {'wall_time': 0.0, 'cpu_time': 0.0, 'calls': 0})
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+      yield
+    finally:
+      metrics['wall_time'] += time.perf_counter() - wall
+      metrics['cpu_time'] += time.process_time() - cpu
+      metrics['calls'] += 1
+      metrics['peak_rss'] = peak_rss()
+
+  def record(self, name, **metrics):
+    """Attach metrics to a stage
+    @param name Stage name
+    @param metrics Metrics as keyword arguments, e.g. `nfev=1234`
+    """
+    if not self.enabled:
+      return
+    self.stages.setdefault(name, {}).update(metrics)
+
+  def save(self, path):
+    """Save metrics to a file and log a summary
+    @param path Output file, CSV if it ends with `.csv`, JSON otherwise
+    """
+    if not self.enabled:
+      return
+    if path.endswith('.csv'):
+      columns = sorted({key for metrics in self.stages.values() for key in metrics})
+      with open(path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['stage'] + columns)
+        for name, metrics in self.stages.items():
+          writer.writerow([name] + [metrics.get(column, '') for column in columns])
+    else:
+      with open(path, 'w') as file:
+        json.dump({'stages': self.stages, 'peak_rss': peak_rss()}, file, indent=2, default=float)
+
+    self.logger.info("Profile summary:")
+    for name, metrics in self.stages.items():
+      extra = ', '.join(f"{key}={value}" for key, value in metrics.items() if key not in ('wall_time', 'cpu_time', 'calls', 'peak_rss'))
+      timing = f"wall {metrics['wall_time']:.3f}s, cpu {metrics['cpu_time']:.3f}s" if 'wall_time' in metrics else ''
+      self.logger.info(f"  {name}: {timing}{', ' if timing and extra else ''}{extra}")
+    rss = peak_rss()
+    if rss is not None:
+      self.logger.info(f"  peak RSS: {rss / 2**20:.1f} MiB")
+    self.logger.info(f"Profile saved as \"{path}\"")
@@ -0,0 +1,109 @@
+""" @package Renderer
+
+@brief Reusable figure templates
+
+@details This module defines FigureRenderer class which keeps one figure per plot type and layout, so repeated
+plots (e.g. every configuration of a batch) do not rebuild figures, axes, labels and legends from scratch.
+A template is built once by a plotter-supplied `build` function, later plots only swap line data, texts and
+axis limits with an `update` function before saving. Layout (`tight_layout`) is recomputed only when tick labels,
+titles or axis labels change, as only they change sizes of decorations around axes.
+
+Templates are plain `matplotlib.figure.Figure` objects which are never registered with pyplot, so they do not
+accumulate in pyplot's figure list. At most `max_templates` are kept, least recently used ones are dropped first,
+and `close` drops all of them. Interactive plots are drawn on a pyplot figure which is closed once its window is.
+
+Usage example:
+@code
+  def build(figure):
+    ax = figure.subplots()
+    line, = ax.plot([], [])
+    return {'ax': ax, 'line': line}
+
+  def update(artists):
+    artists['line'].set_data(x, y)
+    artists['ax'].relim()
+    artists['ax'].autoscale_view()
+
+  default_renderer.render('my_plot', (), build, update, 'plot.png')
+@endcode
+"""
+
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from matplotlib.figure import Figure
+
+import matplotlib.pyplot as plt
+
+@dataclass
+class FigureTemplate:
+  """Class that holds a figure built once and its artists"""
+  ## Template figure
+  figure: Figure
+  ## Artists returned by `build` function, updated for every plot
+  artists: dict
+  ## Texts which determined last layout, `None` before first layout
+  signature: tuple = field(default=None)
+
+class FigureRenderer:
+  """Class that renders plots by updating cached figure templates"""
+  def __init__(self, max_templates=16):
+    """Constructor for FigureRenderer
+    @param max_templates Largest number of kept templates
+    """
+    ## Largest number of kept templates
+    self.max_templates = max_templates
+    ## Templates by `(kind, key)`, least recently used first
+    self.templates = OrderedDict()
+
+  @staticmethod
+  def signature(figure):
+    """Texts which determine layout of a figure: tick labels, titles and axis labels"""
+    texts = [text.get_text() for text in figure.texts]
+    for ax in figure.axes:
+      texts += [ax.get_title(), ax.get_xlabel(), ax.get_ylabel()]
+      for axis in (ax.xaxis, ax.yaxis):
+        formatter = axis.get_major_formatter()
+        texts += formatter.format_ticks(axis.get_majorticklocs()) + [formatter.get_offset()]
+    return tuple(texts)
+
+  def render(self, kind, key, build, update, path, show=False, tight=True):
+    """Render a plot and save it
+    @param kind Plot type, e.g. `detailed`
+    @param key Hashable description of layout (e.g. number of bodies), figures with different keys are not shared
+    @param build Function building artists on an empty figure, returns a dictionary of them
+    @param update Function updating artists returned by `build` with new data
+    @param path File the plot is saved to
+    @param show Whether an interactive window is shown after saving, such figure is not cached
+    @param tight Whether `tight_layout` is applied
+    """
+    if show:
+      figure = plt.figure()
+      update(build(figure))
+      if tight:
+        figure.tight_layout()
+      figure.savefig(path)
+      plt.show()
+      plt.close(figure)
+      return
+
+    template = self.templates.pop((kind, key), None)
+    if template is None:
+      figure = Figure()
+      template = FigureTemplate(figure, build(figure))
+    self.templates[(kind, key)] = template
+    while len(self.templates) > self.max_templates:
+      self.templates.popitem(last=False)
+
+    update(template.artists)
+    signature = self.signature(template.figure)
+    if tight and signature != template.signature:
+      template.figure.tight_layout()
+      template.signature = signature
+    template.figure.savefig(path)
+
+  def close(self):
+    """Drop all templates"""
+    self.templates.clear()
+
+## Renderer shared by all plotters of a process
+default_renderer = FigureRenderer()
@@ -0,0 +1,235 @@
+""" @package Scenarios
+
+@brief Configurations and initial condition tables stored in data files
+
+@details This module loads scenario files, i.e. configurations written as TOML or JSON instead of functions in
+`src/Configurations.py`, and reads tables of initial conditions from CSV or `.npy` files.
+
+Scenario file holds the same keys as a params dictionary (see `src/Configurations.py`), except that bodies are
+listed in `bodies` array, in order, and converted to `ObjectParams2D` (fields `x_0`, `y_0`, `vx_0`, `vy_0`, `m`)
+or `ObjectParams3D` (additionally `z_0` and `vz_0`). Large numbers of bodies can be read from a table instead,
+`bodies_file` names a CSV or `.npy` file (relative to scenario file) with one body per row and columns named as
+dataclass fields; they are appended after bodies listed in `bodies`. Lyapunov `range` is either a list of values
+or a table `{start, stop, points}`. Unknown keys and malformed bodies are rejected when loading.
+
+Example TOML scenario:
+@code
+  title = "Burrau problem"
+  G = 6.67430e-11
+  days = 80
+  frames = 500
+
+  bodies = [
+    {x_0 = 0, y_0 = 0, vx_0 = 0, vy_0 = 0, m = 5},
+    {x_0 = -3, y_0 = 0, vx_0 = 0, vy_0 = 0, m = 4},
+    {x_0 = 0, y_0 = 4, vx_0 = 0, vy_0 = 0, m = 3},
+  ]
+
+  [lyapunov]
+  body_no = 2
+  param = '$x_0$'
+  range = {start = -3, stop = -0.001, points = 20}
+  days = 20
+@endcode
+
+Tables of initial conditions are read by InitialConditionTable. CSV files name their columns in a header row,
+`.npy` files are either structured arrays (field names are column names) or plain 2D arrays with column names
+given separately. Table is never loaded whole, it is read in chunks (`.npy` files are memory-mapped).
+
+Usage example:
+@code
+  params = load_scenario('burrau.toml')
+  table = InitialConditionTable('ics.npy')
+  for start, rows in table.chunks(1024):
+    ...
+@endcode
+"""
+
+from .Utils import *
+
+import csv
+import dataclasses
+import json
+import os
+
+try:
+  import tomllib
+except ImportError:
+  # Python < 3.11
+  try:
+    import tomli as tomllib
+  except ImportError:
+    tomllib = None
+
+## Extensions of scenario files
+SCENARIO_EXTENSIONS = ('.toml', '.json')
+
+## Top level keys accepted in scenario files, besides `bodies` and `bodies_file`
+SCENARIO_KEYS = (
+  'G', 'days', 'softening', 'force_solver', 'opening_angle', 'rtol', 'atol', 'plot_bodies', 'frames', 'title',
+  'phase_detailed_x', 'lyapunov', 'stability_map', 'parareal', 'model_reduction',
+  'output_policy'
+)
+
+## Fields of bodies moving in a plane
+FIELDS_2D = tuple(field.name for field in dataclasses.fields(ObjectParams2D))
+## Fields of bodies moving in 3D
+FIELDS_3D = tuple(field.name for field in dataclasses.fields(ObjectParams3D))
+
+def is_scenario_file(name):
+  """Check if a configuration name refers to an existing scenario file
+  @param name Configuration name or path
+  """
+  return name.endswith(SCENARIO_EXTENSIONS) and os.path.isfile(name)
+
+def make_body(fields, where):
+  """Convert a mapping of fields to a body
+  @param fields Mapping `{field: value}`
+  @param where Description of body location used in error messages
+  @returns `ObjectParams2D` or `ObjectParams3D`
+  @throws ValueError Thrown if fields match neither dataclass or a value is not a finite number
+  """
+  names = set(fields)
+  if names == set(FIELDS_2D):
+    cls = ObjectParams2D
+  elif names == set(FIELDS_3D):
+    cls = ObjectParams3D
+  else:
+    raise ValueError(f"{where} must have fields {', '.join(FIELDS_2D)} (2D) or {', '.join(FIELDS_3D)} (3D), got {', '.join(sorted(names))}")
+  values = {}
+  for name, value in fields.items():
+    if isinstance(value, bool) or not isinstance(value, (int, float, np.number)) or not np.isfinite(value):
+      raise ValueError(f"{where}: field \"{name}\" must be a finite number, got {value!r}")
+    values[name] = float(value)
+  if values['m'] <= 0:
+    raise ValueError(f"{where}: mass must be positive")
+  return cls(**values)
+
+def load_scenario(path):
+  """Load a scenario file and convert it to a params dictionary
+  @param path Path to `.toml` or `.json` file
+  @returns Dictionary with simulation parameters, as returned by functions in `src/Configurations.py`
+  @throws ValueError Thrown if file contains unknown keys or malformed bodies
+  @throws ImportError Thrown when loading TOML on Python < 3.11 without `tomli` package
+  """
+  if path.endswith('.toml'):
+    if tomllib is None:
+      raise ImportError("Loading TOML scenarios requires Python 3.11 or \"tomli\" package")
+    with open(path, 'rb') as file:
+      scenario = tomllib.load(file)
+  else:
+    with open(path) as file:
+      scenario = json.load(file)
+
+  return parse_scenario(scenario, f"Scenario \"{path}\"", os.path.dirname(path))
+
+def parse_scenario(scenario, source='Scenario', directory='.'):
+  """Convert a scenario mapping, e.g. loaded from a file or received in a request, to a params dictionary
+  @param scenario Mapping with scenario keys, modified in place
+  @param source Description of scenario origin used in error messages
+  @param directory Directory `bodies_file` is relative to
+  @returns Dictionary with simulation parameters
+  @throws ValueError Thrown if scenario contains unknown keys or malformed bodies
+  """
+  unknown = set(scenario) - set(SCENARIO_KEYS) - {'bodies', 'bodies_file'}
+  if unknown:
+    raise ValueError(f"{source} has unknown keys: {', '.join(sorted(unknown))}")
+  for key in ('G', 'days'):
+    if key not in scenario:
+      raise ValueError(f"{source} has no \"{key}\"")
+
+  bodies = [make_body(fields, f"{source}, body {i}") for i, fields in enumerate(scenario.get('bodies', []), start=1)]
+  if 'bodies_file' in scenario:
+    table_path = os.path.join(directory, scenario['bodies_file'])
+    table = InitialConditionTable(table_path)
+    for start, rows in table.chunks(4096):
+      for offset, row in enumerate(rows):
+        bodies.append(make_body(dict(zip(table.columns, row)), f"\"{table_path}\", row {start + offset + 1}"))
+  if len(bodies) < 2:
+    raise ValueError(f"{source} needs at least two bodies")
+
+  params = {key: value for key, value in scenario.items() if key not in ('bodies', 'bodies_file')}
+  for body_no, body in enumerate(bodies, start=1):
+    params[str(body_no)] = body
+  lyapunov = params.get('lyapunov', None)
+  if lyapunov and isinstance(lyapunov.get('range', None), dict):
+    lyapunov['range'] = np.linspace(lyapunov['range']['start'], lyapunov['range']['stop'], lyapunov['range']['points'])
+  elif lyapunov and 'range' in lyapunov:
+    lyapunov['range'] = np.asarray(lyapunov['range'], dtype=float)
+  return params
+
+class InitialConditionTable:
+  """Class that reads a table of initial conditions from a CSV or `.npy` file in chunks"""
+  def __init__(self, path, columns=None):
+    """Constructor for InitialConditionTable, checks file layout without reading the data
+    @param path Path to `.csv` or `.npy` file
+    @param columns Column names of a plain 2D `.npy` array, ignored for CSV files and structured arrays
+    @throws ValueError Thrown if file has unsupported format or column names do not match its shape
+    """
+    ## Path to table file
+    self.path = path
+    ## Memory-mapped array of `.npy` table, `None` for CSV tables
+    self.array = None
+    if path.endswith('.csv'):
+      with open(path, newline='') as file:
+        header = next(csv.reader(file), None)
+      if not header:
+        raise ValueError(f"Table \"{path}\" has no header row")
+      ## Column names
+      self.columns = [name.strip() for name in header]
+    elif path.endswith('.npy'):
+      self.array = np.load(path, mmap_mode='r')
+      if self.array.dtype.names:
+        self.columns = list(self.array.dtype.names)
+      elif self.array.ndim == 2 and np.issubdtype(self.array.dtype, np.number):
+        if columns is None or len(columns) != self.array.shape[1]:
+          raise ValueError(f"Table \"{path}\" has {self.array.shape[1]} columns, names of all of them are needed")
+        self.columns = list(columns)
+      else:
+        raise ValueError(f"Table \"{path}\" must be a structured array or a 2D numeric array")
+    else:
+      raise ValueError(f"Table \"{path}\" must be a .csv or .npy file")
+    if len(set(self.columns)) != len(self.columns):
+      raise ValueError(f"Table \"{path}\" has duplicate column names")
+
+  def __len__(self):
+    """Number of rows, counting rows of a CSV table requires reading it once"""
+    if self.array is not None:
+      return len(self.array)
+    with open(self.path, newline='') as file:
+      return sum(1 for _ in csv.reader(file)) - 1
+
+  def chunks(self, chunk_size):
+    """Iterate over table in chunks
+    @param chunk_size Number of rows per chunk
+    @returns Generator of `(start_row, rows)` tuples, rows are 2D `np.float64` arrays ordered as `columns`
+    @throws ValueError Thrown if a CSV row has wrong number of values or a non-numeric value
+    """
+    if self.array is not None:
+      for start in range(0, len(self.array), chunk_size):
+        rows = self.array[start:start + chunk_size]
+        if rows.dtype.names:
+          rows = np.stack([rows[name] for name in self.columns], axis=1)
+        yield start, np.asarray(rows, dtype=np.float64)
+      return
+
+    with open(self.path, newline='') as file:
+      reader = csv.reader(file)
+      next(reader)
+      start, rows = 0, []
+      for row in reader:
+        if len(row) != len(self.columns):
+          raise ValueError(f"Table \"{self.path}\", line {reader.line_num} has {len(row)} values, expected {len(self.columns)}")
+        rows.append(row)
+        if len(rows) == chunk_size:
+          yield start, self._convert(rows, start)
+          start, rows = start + len(rows), []
+      if rows:
+        yield start, self._convert(rows, start)
+
+  def _convert(self, rows, start):
+    """Convert CSV rows to an array of numbers"""
+    try:
+      return np.array(rows, dtype=np.float64)
+    except ValueError as e:
+      raise ValueError(f"Table \"{self.path}\" has a non-numeric value in rows {start + 1}-{start + len(rows)}: {e}")
@@ -0,0 +1,433 @@
+""" @package Service
+
+@brief Local simulation service with a job queue
+
+@details This module defines SimulationService class, a long-lived asyncio HTTP/JSON server (on a TCP port or
+a Unix socket) which runs simulations on demand. Jobs are queued, executed in a warm process pool and their
+results are kept in memory until they are fetched, so clients neither pay interpreter and import startup nor
+parse file names of generated plots.
+
+Endpoints:
+- `POST /jobs` - submit a job described by a JSON body, responds with job status (`202`, or `200` when it is already done)
+- `GET /jobs/<id>` - job status and result
+- `GET /jobs/<id>/figure.png` - rendered figure of a finished `figure` job
+- `DELETE /jobs/<id>` - cancel a job
+- `GET /health` - numbers of queued, running and kept jobs
+
+`POST /jobs` and `GET /jobs/<id>` accept `?wait=<seconds>` query, which holds the response until the job
+finishes or the time runs out.
+
+Job description:
+- `configuration` - name of a configuration, or
+- `params` - inline scenario, same format as scenario files (see `src/Scenarios.py`) but without `bodies_file`
+- `kind` - `trajectory` (default), `lyapunov` or `figure`
+- `figure` - plot rendered by `figure` jobs: `detailed`, `phase`, `phase_detailed_x`, `positions` or `lyapunov`
+- `points` - number of evenly spaced samples returned by `trajectory` jobs, at least `2`, defaults to `1000`
+- `days`, `rtol`, `atol` - optional overrides of configuration parameters
+
+Identical descriptions are deduplicated: submitting a job which is already queued, running or done returns
+the existing job. Services are reachable over the network, so jobs never name local files: scenario file paths
+and `bodies_file` are rejected. Invalid descriptions and `wait` values are rejected with `400` before anything is
+queued. At most `workers` jobs run at once, at most `max_queue` wait in the queue (further submissions
+are rejected with `503`). Cancelling a queued job removes it from the queue, cancelling a running job discards its
+result; its worker process cannot be interrupted, so the slot is freed only once the computation ends.
+
+Usage example:
+@code
+  # server
+  python main.py serve --port 8765 --workers 4
+  # client
+  curl -X POST 'localhost:8765/jobs?wait=60' -d '{"configuration": "butterfly", "points": 200}'
+  curl -X POST localhost:8765/jobs -d '{"configuration": "burrau", "kind": "figure", "figure": "lyapunov"}'
+  curl localhost:8765/jobs/<id>/figure.png > lyapunov.png
+@endcode
+"""
+
+from .Pipeline import _init_worker
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from urllib.parse import urlsplit, parse_qs
+
+import asyncio
+import base64
+import copy
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+import uuid
+
+## Job kinds
+KINDS = ('trajectory', 'lyapunov', 'figure')
+
+## Figures rendered by `figure` jobs, mapped to plotter methods
+FIGURES = {
+  'detailed': 'plot_detailed',
+  'phase': 'plot_phase',
+  'phase_detailed_x': 'plot_phase_detailed_x',
+  'positions': 'plot_positions',
+  'lyapunov': 'plot_lyapunov',
+}
+
+## Reason phrases of used HTTP status codes
+REASONS = {200: 'OK', 202: 'Accepted', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 409: 'Conflict', 503: 'Service Unavailable'}
+
+def request_params(request):
+  """Build simulation parameters of a job description
+  @param request Job description
+  @returns Params dictionary
+  @throws ValueError Thrown if description is invalid
+  """
+  from .ArgsHandler import ThreeBodyArgParser
+  from .Scenarios import parse_scenario
+
+  if ('configuration' in request) == ('params' in request):
+    raise ValueError("Job needs either \"configuration\" or \"params\"")
+  if 'configuration' in request:
+    parser = ThreeBodyArgParser()
+    # scenario files are not served, a network client must not make the service open local files
+    if str(request['configuration']) not in parser.mode_names:
+      raise ValueError(f"Unknown configuration \"{request['configuration']}\"")
+    params = parser.get_configuration(str(request['configuration']))()
+  else:
+    if not isinstance(request['params'], dict):
+      raise ValueError("\"params\" must be a JSON object")
+    if 'bodies_file' in request['params']:
+      raise ValueError("\"bodies_file\" is not accepted by the service, list bodies under \"bodies\"")
+    try:
+      params = parse_scenario(copy.deepcopy(request['params']), "Inline params")
+    except (KeyError, TypeError, AttributeError, IndexError) as e:
+      raise ValueError(f"Inline params are malformed: {type(e).__name__}: {e}")
+  for key in ('days', 'rtol', 'atol'):
+    if key in request:
+      params[key] = float(request[key])
+  return params
+
+def wait_timeout(query):
+  """Seconds to hold a response, from `wait` query parameter
+  @param query Parsed query
+  @returns Timeout in seconds, `0` if not requested
+  @throws ValueError Thrown if `wait` is not a number
+  """
+  try:
+    return float(query.get('wait', ['0'])[0])
+  except ValueError:
+    raise ValueError(f"\"wait\" must be a number of seconds, got \"{query['wait'][0]}\"")
+
+def _run_request(request):
+  """Run a job, executed in worker processes
+  @param request Validated job description
+  @returns JSON serializable result
+  """
+  from .Simulator import ThreeBodySimulator, LyapunovAnalyzer
+  from .Plotter import ThreeBodyPlotter, LyapunovPlotter
+  import matplotlib.pyplot as plt
+
+  params = request_params(request)
+  kind = request.get('kind', 'trajectory')
+  figure = request.get('figure', None)
+
+  if kind == 'lyapunov' or figure == 'lyapunov':
+    if not params.get('lyapunov', None):
+      raise ValueError("Configuration has no Lyapunov analysis parameters")
+    analyzer = LyapunovAnalyzer(params)
+    xs, exponents = analyzer.analyze_x0()
+    if kind == 'lyapunov':
+      return {
+        'range': xs.tolist(),
+        'exponents': exponents.tolist(),
+        'stop_times': analyzer.stop_times,
+        'stop_reasons': analyzer.stop_reasons,
+        'nfev': analyzer.nfev,
+      }
+  else:
+    if kind == 'trajectory':
+      # only requested points are stored, dense output is not kept
+      params = params | {'output_policy': (params.get('output_policy', None) or {}) | {'grid': request.get('points', 1000)}}
+    sim = ThreeBodySimulator(params)
+    solution = sim.solve_system_of_equations()
+    if not solution.success:
+      raise RuntimeError(f"Solver failed: {solution.message}")
+    if kind == 'trajectory':
+      return {
+        't': solution.t.tolist(),
+        'y': solution.y.tolist(),
+        'masses': sim.bodies.masses.tolist(),
+        'dim': sim.bodies.dim,
+        'nfev': int(solution.nfev),
+      }
+  if figure == 'phase_detailed_x' and not params.get('phase_detailed_x', None):
+    raise ValueError("Configuration has no zoomed phase plot parameters")
+
+  with tempfile.TemporaryDirectory() as directory:
+    path = os.path.join(directory, 'figure.png')
+    plot_params = {
+      'detailed_file': path,
+      'trajectories_file': path,
+      'phase_file': path,
+      'detailed_phase_file': path,
+      'animation_file': os.path.join(directory, 'animation.gif'),
+      'lyapunov_file': path,
+      'quiet': True,
+    }
+    try:
+      if figure == 'lyapunov':
+        LyapunovPlotter(xs, exponents, params | plot_params).plot_lyapunov()
+      else:
+        getattr(ThreeBodyPlotter(solution, params | plot_params), FIGURES[figure])()
+    finally:
+      plt.close('all')
+    with open(path, 'rb') as file:
+      return {'figure': figure, 'png': base64.b64encode(file.read()).decode('ascii')}
+
+@dataclass
+class Job:
+  """Class that holds state of a single job"""
+  ## Job identifier
+  id: str
+  ## Deduplication key, hash of job description
+  key: str
+  ## Job description
+  request: dict
+  ## `queued`, `running`, `done`, `failed` or `cancelled`
+  status: str = 'queued'
+  ## Result of a finished job
+  result: dict = None
+  ## Error message of a failed job
+  error: str = None
+  ## Submission time
+  submitted: float = field(default_factory=time.time)
+  ## Time of finishing, failing or cancelling
+  finished: float = None
+  ## Set once job leaves queued and running states
+  event: asyncio.Event = field(default_factory=asyncio.Event)
+
+  def summary(self):
+    """Job status as a JSON serializable dictionary"""
+    summary = {'id': self.id, 'status': self.status, 'submitted': self.submitted, 'finished': self.finished}
+    if self.error is not None:
+      summary['error'] = self.error
+    if self.result is not None:
+      summary['result'] = self.result
+    return summary
+
+class SimulationService:
+  """Class that queues simulation jobs and serves them over HTTP"""
+  def __init__(self, workers=None, max_queue=100, max_jobs=1000):
+    """Constructor for SimulationService
+    @param workers Number of concurrently running jobs and size of a process pool, defaults to number of available cores
+    @param max_queue Largest number of queued jobs
+    @param max_jobs Largest number of kept jobs, oldest finished jobs are forgotten first
+    """
+    ## Number of concurrently running jobs
+    self.workers = workers or os.cpu_count()
+    ## Largest number of queued jobs
+    self.max_queue = max_queue
+    ## Largest number of kept jobs
+    self.max_jobs = max_jobs
+    ## Jobs by identifier, in order of submission
+    self.jobs = OrderedDict()
+    ## Identifiers of jobs by deduplication key
+    self.keys = {}
+    ## Queue of jobs waiting for a free worker, created once event loop runs
+    self.queue = None
+    ## Process pool running jobs
+    self.executor = None
+    ## Global logger reference
+    self.logger = logging.getLogger("main")
+
+  def submit(self, request):
+    """Validate and queue a job, or find an identical one
+    @param request Job description
+    @returns Job object
+    @throws ValueError Thrown if description is invalid
+    @throws asyncio.QueueFull Thrown if queue is full, cancelled jobs still in the queue do not count
+    """
+    if not isinstance(request, dict):
+      raise ValueError("Job description must be a JSON object")
+    kind = request.get('kind', 'trajectory')
+    if kind not in KINDS:
+      raise ValueError(f"Unknown job kind \"{kind}\", available: {', '.join(KINDS)}")
+    if kind == 'figure' and request.get('figure', None) not in FIGURES:
+      raise ValueError(f"Figure jobs need \"figure\", one of: {', '.join(FIGURES)}")
+    points = request.get('points', 1000)
+    if isinstance(points, bool) or not isinstance(points, int) or points < 2:
+      raise ValueError(f"\"points\" must be an integer of at least 2, got {points!r}")
+    # fail fast on invalid configurations, before the job occupies a worker
+    request_params(request)
+
+    key = hashlib.sha256(json.dumps(request, sort_keys=True).encode()).hexdigest()
+    existing = self.jobs.get(self.keys.get(key, None), None)
+    if existing is not None and existing.status not in ('failed', 'cancelled'):
+      return existing
+
+    queued = sum(job.status == 'queued' for job in self.jobs.values())
+    if queued >= self.max_queue:
+      raise asyncio.QueueFull
+    job = Job(uuid.uuid4().hex, key, request)
+    self.queue.put_nowait(job)
+    self.jobs[job.id] = job
+    self.keys[key] = job.id
+    self.forget()
+    self.logger.info(f"Job {job.id} queued ({kind}, {queued + 1} in queue)")
+    return job
+
+  def cancel(self, job):
+    """Cancel a queued or running job
+    @param job Job object
+    @returns `True` if job was cancelled, `False` if it had already finished
+    """
+    if job.status not in ('queued', 'running'):
+      return False
+    self.finish(job, 'cancelled')
+    return True
+
+  def finish(self, job, status, result=None, error=None):
+    """Move a job to a final state and wake up clients waiting for it"""
+    job.status, job.result, job.error = status, result, error
+    job.finished = time.time()
+    job.event.set()
+    self.logger.info(f"Job {job.id} {status}{': ' + error if error else ''}")
+
+  def forget(self):
+    """Drop oldest finished jobs above `max_jobs`"""
+    finished = [job for job in self.jobs.values() if job.status in ('done', 'failed', 'cancelled')]
+    for job in finished[:max(0, len(self.jobs) - self.max_jobs)]:
+      del self.jobs[job.id]
+      if self.keys.get(job.key, None) == job.id:
+        del self.keys[job.key]
+
+  async def worker(self):
+    """Take jobs from the queue and run them in the process pool, one at a time"""
+    loop = asyncio.get_running_loop()
+    while True:
+      job = await self.queue.get()
+      if job.status != 'queued':
+        # cancelled while waiting
+        continue
+      job.status = 'running'
+      try:
+        result = await loop.run_in_executor(self.executor, _run_request, job.request)
+      except Exception as e:
+        result, error = None, f"{type(e).__name__}: {e}"
+      else:
+        error = None
+      # worker process cannot be interrupted, result of a job cancelled while running is discarded
+      if job.status == 'cancelled':
+        continue
+      self.finish(job, 'failed' if error else 'done', result=result, error=error)
+
+  async def wait(self, job, timeout):
+    """Wait for a job to finish if requested by `wait` query parameter
+    @param job Job object
+    @param timeout Seconds to wait at most, see `wait_timeout`
+    """
+    if timeout > 0:
+      try:
+        await asyncio.wait_for(asyncio.shield(job.event.wait()), timeout)
+      except asyncio.TimeoutError:
+        pass
+
+  async def route(self, method, target, body):
+    """Handle a single HTTP request
+    @param method HTTP method
+    @param target Request target, path with optional query
+    @param body Request body
+    @returns Tuple `(status, content type, payload bytes)`
+    """
+    url = urlsplit(target)
+    query = parse_qs(url.query)
+    parts = [part for part in url.path.split('/') if part]
+
+    def reply(status, payload):
+      return status, 'application/json', json.dumps(payload).encode()
+
+    if parts == ['health']:
+      statuses = [job.status for job in self.jobs.values()]
+      return reply(200, {'queued': statuses.count('queued'), 'running': statuses.count('running'), 'jobs': len(statuses), 'workers': self.workers})
+
+    try:
+      timeout = wait_timeout(query)
+    except ValueError as e:
+      return reply(400, {'error': str(e)})
+
+    if parts == ['jobs'] and method == 'POST':
+      try:
+        job = self.submit(json.loads(body or b'{}'))
+      except (ValueError, TypeError, KeyError, AttributeError, OSError) as e:
+        return reply(400, {'error': str(e)})
+      except asyncio.QueueFull:
+        return reply(503, {'error': f"Queue is full ({self.max_queue} jobs), try again later"})
+      await self.wait(job, timeout)
+      return reply(200 if job.event.is_set() else 202, job.summary())
+
+    if len(parts) < 2 or parts[0] != 'jobs' or parts[1] not in self.jobs:
+      return reply(404, {'error': 'Not found'})
+    job = self.jobs[parts[1]]
+
+    if len(parts) == 3 and parts[2] == 'figure.png' and method == 'GET':
+      if job.status != 'done' or 'png' not in job.result:
+        return reply(409, {'error': f"Job is {job.status}, figure is not available"})
+      return 200, 'image/png', base64.b64decode(job.result['png'])
+    if len(parts) != 2:
+      return reply(404, {'error': 'Not found'})
+    if method == 'GET':
+      await self.wait(job, timeout)
+      return reply(200, job.summary())
+    if method == 'DELETE':
+      if not self.cancel(job):
+        return reply(409, {'error': f"Job is already {job.status}"})
+      return reply(200, job.summary())
+    return reply(405, {'error': f"Method {method} not allowed"})
+
+  async def handle(self, reader, writer):
+    """Read an HTTP/1.1 request from a connection, respond and close it"""
+    try:
+      request_line = (await reader.readline()).decode('latin-1').split()
+      headers = {}
+      while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+      body = await reader.readexactly(int(headers.get('content-length', 0)))
+      if len(request_line) != 3:
+        raise ValueError("Malformed request line")
+      status, content_type, payload = await self.route(request_line[0].upper(), request_line[1], body)
+    except (ValueError, asyncio.IncompleteReadError) as e:
+      status, content_type, payload = 400, 'application/json', json.dumps({'error': str(e)}).encode()
+    except ConnectionError:
+      return
+    head = f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: {content_type}\r\nContent-Length: {len(payload)}\r\nConnection: close\r\n\r\n"
+    try:
+      writer.write(head.encode('latin-1') + payload)
+      await writer.drain()
+      writer.close()
+    except ConnectionError:
+      pass
+
+  async def serve(self, host='127.0.0.1', port=8765, socket=None):
+    """Run service until interrupted
+    @param host Interface to listen on
+    @param port TCP port to listen on
+    @param socket Path of a Unix socket to listen on instead of TCP
+    """
+    # queue length is limited in `submit`, counting only jobs which were not cancelled meanwhile
+    self.queue = asyncio.Queue()
+    self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker)
+    workers = [asyncio.create_task(self.worker()) for _ in range(self.workers)]
+    if socket:
+      server = await asyncio.start_unix_server(self.handle, path=socket)
+      self.logger.info(f"Serving on unix socket \"{socket}\" with {self.workers} workers")
+    else:
+      server = await asyncio.start_server(self.handle, host, port)
+      self.logger.info(f"Serving on http://{host}:{port} with {self.workers} workers")
+    try:
+      async with server:
+        await server.serve_forever()
+    finally:
+      for task in workers:
+        task.cancel()
+      self.executor.shutdown(wait=False, cancel_futures=True)
@@ -4,6 +4,21 @@
 
 @details These functions return `OdeSolution` object containing vectors of solutions to all variables in a three body problem
 
+By default every solver step is stored in `solution.y` and dense output is kept in `solution.sol`. Runs which only
+produce plots can store less with `params['output_policy']` dictionary:
+- `grid` - number of evenly spaced output times (at least 2), or an increasing sequence of output times in days
+  within `[0, days]`, passed as `t_eval`
+- `events` - if set, closest approaches of every pair of individually plotted bodies are stored (in `t_events`,
+  `y_events` and merged into `t`, `y`), besides initial and final states and `grid` if given
+- `dense` - whether dense output is kept, defaults to `True` unless `grid` or `events` is set
+- `dtype` - `float32` stores states in single precision for consumers which only visualize them, times are kept
+  in double precision
+
+Stored times are then not solver steps, so solutions carry the number of solver steps in `steps`: accepted steps
+when they are known, step attempts derived from `nfev` when `solve_ivp` kept neither steps nor dense output.
+Plotters interpolate stored states linearly when dense output is not kept. Simulators which do not pass output
+options to the solver (Parareal, model reduction, live view) apply the same policy to their complete solution.
+
 Example usage:
 @code
   chosen_mode, plot_params = ThreeBodyArgParser().handle_args()
@@ -18,82 +33,167 @@ Example usage:
 
 
 from .Utils import *
+from .Bodies import *
+from .BarnesHut import BarnesHutSolver
 
-from scipy.integrate import solve_ivp
-from tqdm import tqdm
+from scipy.integrate import solve_ivp, RK45
+from scipy.optimize import brentq
 
 import logging
 import sys
 import copy
 
 class ThreeBodySimulator:
-  """Class that generates solution of a three body problem given simulation parameters"""
+  """Class that generates solution of a three body problem given simulation parameters
+  @note Any number of bodies in 2D or 3D is supported, see `src/Bodies.py`
+  """
   def __init__(self, system_params):
     ## Simulator parameters
     self.params = system_params
     ## Global logger reference
     self.logger = logging.getLogger("main")
+    ## Acceleration kernel, direct summation or Barnes-Hut tree for large numbers of bodies
+    self.accelerations = pairwise_accelerations
+    if system_params.get('force_solver', 'direct') == 'barnes_hut':
+      self.accelerations = BarnesHutSolver(theta=system_params.get('opening_angle', 0.5)).accelerations
+    self.initial_conditions()
 
   def system_of_equations(self, t, state):
-    """Defines a system of 6 coupled 2nd order differential equations.
+    """Defines a system of coupled 2nd order differential equations of N gravitating bodies.
     @param t (float): Time
-    @param Y (array): State vector 
-    [x1, x2, x3, x4, x5, x6, 
-      dx1/dt, dx2/dt, dx3/dt, dx4/dt, dx5/dt, dx6/dt]
+    @param state (array): State vector, positions followed by velocities
+    [x1, y1, x2, y2, x3, y3, 
+      dx1/dt, dy1/dt, dx2/dt, dy2/dt, dx3/dt, dy3/dt] for three bodies in 2D
     @returns:
     array: Derivatives for each variable
     """
-    # Unpack the state vector
-    x_1, y_1, x_2, y_2, x_3, y_3, \
-    dx_1, dy_1, dx_2, dy_2, dx_3, dy_3 = state
+    half = len(state) // 2
+    positions = state[:half].reshape(self.bodies.n, self.bodies.dim)
+    accelerations = self.accelerations(
+      positions,
+      self.bodies.masses,
+      self.params['G'],
+      self.params.get('softening', 0.0)
+    )
+
+    # first derivatives are velocities, second derivatives are accelerations
+    return np.concatenate((state[half:], accelerations.ravel()))
+
+  def initial_conditions(self):
+    """Build body table from current parameters and initial state vector from it
+    @returns Array in order of
+    [x1, y1, x2, y2, x3, y3, dx1/dt, dy1/dt, dx2/dt, dy2/dt, dx3/dt, dy3/dt] for three bodies in 2D
+    """
+    ## Struct-of-arrays table of bodies, used by equations of motion
+    self.bodies = BodyTable.from_params(self.params)
+    return self.bodies.state()
+
+  def output_policy(self):
+    """Output policy of current parameters, see module documentation
+    @returns Dictionary, empty if every solver step and dense output are stored
+    """
+    return self.params.get('output_policy', None) or {}
+
+  def output_options(self, t_end):
+    """Keyword arguments of `solve_ivp` selecting stored output according to output policy
+    @param t_end End of time span in seconds
+    @returns Dictionary with `dense_output` and optionally `t_eval` and `events`
+    @throws ValueError Thrown if output grid has less than 2 points, is not increasing or leaves time span
+    """
+    policy = self.output_policy()
+    events = policy.get('events', False)
+    options = {'dense_output': policy.get('dense', 'grid' not in policy and not events)}
+    if 'grid' in policy:
+      grid = policy['grid']
+      if np.isscalar(grid):
+        if int(grid) < 2:
+          raise ValueError(f"Output grid needs at least 2 points, got {grid}")
+        options['t_eval'] = np.linspace(0, t_end, int(grid))
+      else:
+        t_eval = np.asarray(grid, dtype=float) * 24 * 3600
+        if t_eval.ndim != 1 or not t_eval.size:
+          raise ValueError("Output grid must be a non-empty sequence of times in days")
+        if np.any(np.diff(t_eval) <= 0):
+          raise ValueError("Output grid times must be strictly increasing")
+        if t_eval[0] < 0 or t_eval[-1] > t_end:
+          raise ValueError(f"Output grid times must lie within [0, {t_end / (24 * 3600):g}] days, got [{grid[0]:g}, {grid[-1]:g}]")
+        options['t_eval'] = t_eval
+    elif events:
+      # only initial and final states are stored besides events
+      options['t_eval'] = np.array([0, t_end])
+    if events:
+      options['events'] = self.close_approaches()
+    return options
+
+  def close_approaches(self):
+    """Event functions of closest approaches of every pair of individually plotted bodies
+    @returns List of functions of `(t, state)` which cross zero from below at closest approach of a pair
+    """
+    n, dim = self.bodies.n, self.bodies.dim
+    plotted = min(self.params.get('plot_bodies', n), n)
+    events = []
+    for i in range(plotted):
+      for j in range(i + 1, plotted):
+        def approach(t, state, i=i, j=j):
+          # radial velocity of a pair, distance is smallest where it turns positive
+          separation = state[j * dim:(j + 1) * dim] - state[i * dim:(i + 1) * dim]
+          relative_velocity = state[(n + j) * dim:(n + j + 1) * dim] - state[(n + i) * dim:(n + i + 1) * dim]
+          return np.dot(separation, relative_velocity)
+        approach.direction = 1
+        events.append(approach)
+    return events
+
+  def compact_output(self, solution):
+    """Merge event states into stored output and convert precision according to output policy
+    @param solution Solution obtained with `output_options`
+    @returns The same solution
+    """
+    policy = self.output_policy()
+    if policy.get('events', False) and solution.t_events is not None:
+      size = len(solution.y)
+      t = np.concatenate([solution.t] + [np.asarray(times) for times in solution.t_events])
+      y = np.concatenate([solution.y] + [np.reshape(states, (-1, size)).T for states in solution.y_events], axis=1)
+      order = np.argsort(t, kind='stable')
+      solution.t, solution.y = t[order], y[:, order]
+    if policy.get('dtype', 'float64') != 'float64':
+      solution.y = solution.y.astype(policy['dtype'])
+      if solution.y_events is not None:
+        solution.y_events = [np.asarray(states, dtype=policy['dtype']) for states in solution.y_events]
+    return solution
+
+  def reduce_output(self, solution):
+    """Apply output policy to a complete solution, i.e. one holding every step and dense output.
+    Used by integrators which do not take `solve_ivp` output options, events are located on dense output.
+    @param solution Complete solution
+    @returns The same solution with output selected by output policy
+    """
+    if not self.output_policy() or solution.sol is None:
+      return solution
+    solution.steps = len(solution.t) - 1
+    t_end = solution.t[-1]
+    options = self.output_options(self.params['days'] * 24 * 3600)
+    if 'events' in options:
+      solution.t_events, solution.y_events = [], []
+      for event in options['events']:
+        values = np.array([event(t, state) for t, state in zip(solution.t, solution.y.T)])
+        crossings = np.nonzero((values[:-1] < 0) & (values[1:] >= 0))[0]
+        times = np.array([brentq(lambda t: event(t, solution.sol(t)), solution.t[k], solution.t[k + 1]) for k in crossings])
+        solution.t_events.append(times)
+        solution.y_events.append(solution.sol(times).T if len(times) else np.empty((0, len(solution.y))))
+    if 't_eval' in options:
+      # a solve which failed early only covers output times up to its last step
+      t_eval = options['t_eval'] if 'grid' in self.output_policy() else np.array([0, t_end])
+      t_eval = t_eval[t_eval <= t_end]
+      solution.t, solution.y = t_eval, solution.sol(t_eval)
+    if not options['dense_output']:
+      solution.sol = None
+    return self.compact_output(solution)
 
-    r12 = np.sqrt((x_1 - x_2)**2 + (y_1 - y_2)**2)
-    r13 = np.sqrt((x_1 - x_3)**2 + (y_1 - y_3)**2)
-    r23 = np.sqrt((x_2 - x_3)**2 + (y_2 - y_3)**2)
-    
-    # Second derivatives (from three-body problem equations)
-    d2x1_dt2 = -self.params['G'] * self.params['2'].m * (x_1 - x_2)/r12**3 - \
-                self.params['G'] * self.params['3'].m * (x_1 - x_3)/r13**3
-    d2y1_dt2 = -self.params['G'] * self.params['2'].m * (y_1 - y_2)/r12**3 - \
-                self.params['G'] * self.params['3'].m * (y_1 - y_3)/r13**3
-    d2x2_dt2 = -self.params['G'] * self.params['3'].m * (x_2 - x_3)/r23**3 - \
-                self.params['G'] * self.params['1'].m * (x_2 - x_1)/r12**3
-    d2y2_dt2 = -self.params['G'] * self.params['3'].m * (y_2 - y_3)/r23**3 - \
-                self.params['G'] * self.params['1'].m * (y_2 - y_1)/r12**3
-    d2x3_dt2 = -self.params['G'] * self.params['1'].m * (x_3 - x_1)/r13**3 - \
-                self.params['G'] * self.params['2'].m * (x_3 - x_2)/r23**3
-    d2y3_dt2 = -self.params['G'] * self.params['1'].m * (y_3 - y_1)/r13**3 - \
-                self.params['G'] * self.params['2'].m * (y_3 - y_2)/r23**3
-
-    # Return derivatives in order: 
-    # dx1/dt, dx2/dt, dx3/dt, dx4/dt, dx5/dt, dx6/dt, 
-    # d2x1/dt2, d2x2/dt2, d2x3/dt2, d2x4/dt2, d2x5/dt2, d2x6/dt2
-    return np.array([
-        dx_1, dy_1, dx_2, dy_2, dx_3, dy_3,  # First derivatives
-        d2x1_dt2, d2y1_dt2, d2x2_dt2, d2y2_dt2, d2x3_dt2, d2y3_dt2  # Second derivatives
-    ])
-  
   def solve_system_of_equations(self):
     """Solve system of PDEs reflecting a three body problem
     @returns `OdeSolution` object containing solutions for all parameters
     """
-    # Initial conditions:
-    # [x1, x2, x3, x4, x5, x6, dx1/dt, dx2/dt, dx3/dt, dx4/dt, dx5/dt, dx6/dt]    
-    initial_conditions = [
-      self.params['1'].x_0,
-      self.params['1'].y_0,
-      self.params['2'].x_0,
-      self.params['2'].y_0,
-      self.params['3'].x_0,
-      self.params['3'].y_0,
-
-      self.params['1'].vx_0,
-      self.params['1'].vy_0,
-      self.params['2'].vx_0,
-      self.params['2'].vy_0,
-      self.params['3'].vx_0,
-      self.params['3'].vy_0
-    ]
+    initial_conditions = self.initial_conditions()
     
     # Time span for integration
     t_span = (0, self.params['days'] * 24 * 3600)
@@ -104,38 +204,91 @@ class ThreeBodySimulator:
         self.system_of_equations, 
         t_span, 
         initial_conditions,
-        dense_output=True,  # Allow interpolation of solution
-        rtol=1e-8,  # Relative tolerance
-        atol=1e-8   # Absolute tolerance
+        rtol=self.params.get('rtol', 1e-8),  # Relative tolerance
+        atol=self.params.get('atol', 1e-8),  # Absolute tolerance
+        **self.output_options(t_span[1])  # Dense output, output grid and events
     )
     self.logger.info("Solving done")
+    if solution.sol is not None:
+      solution.steps = len(solution.sol.ts) - 1
+    else:
+      # every RK45 step attempt costs n_stages evaluations, two more are spent choosing the first step
+      solution.steps = max(solution.nfev - 2, 0) // RK45.n_stages
 
-    return solution
+    return self.compact_output(solution)
+
+  def stream_states(self, samples):
+    """Integrate step by step, yielding states at evenly spaced times as soon as solver reaches them.
+    Solver takes exactly the same steps as `solve_system_of_equations`, once generator is exhausted
+    `self.solution` holds the same result it would return.
+    @param samples Number of evenly spaced output times over the whole time span
+    @returns Generator of `(t, state)` tuples
+    """
+    t_end = self.params['days'] * 24 * 3600
+    solver = RK45(
+      self.system_of_equations,
+      0,
+      self.initial_conditions(),
+      t_end,
+      rtol=self.params.get('rtol', 1e-8),
+      atol=self.params.get('atol', 1e-8)
+    )
+    times = np.linspace(0, t_end, samples)
+    ts, ys, interpolants = [solver.t], [solver.y], []
+    self.logger.info("Solving problem (live)...")
+    yield times[0], solver.y
+    sample = 1
+
+    while solver.status == 'running':
+      solver.step()
+      if solver.status == 'failed':
+        break
+      interpolant = solver.dense_output()
+      ts.append(solver.t)
+      ys.append(solver.y)
+      interpolants.append(interpolant)
+      while sample < samples and times[sample] <= solver.t:
+        yield times[sample], interpolant(times[sample])
+        sample += 1
+    self.logger.info("Solving done")
+
+    from scipy.integrate import OdeSolution
+    from scipy.optimize import OptimizeResult
+    ## Solution integrated by the last `stream_states` call, same fields as returned by `solve_ivp`
+    self.solution = OptimizeResult(
+      t=np.array(ts),
+      y=np.array(ys).T,
+      sol=OdeSolution(ts, interpolants) if interpolants else None,
+      t_events=None,
+      y_events=None,
+      nfev=solver.nfev,
+      njev=solver.njev,
+      nlu=solver.nlu,
+      status=0 if solver.status == 'finished' else -1,
+      message='The solver successfully reached the end of the integration interval.' if solver.status == 'finished' else 'Required step size is less than spacing between numbers.',
+      success=solver.status == 'finished'
+    )
+    self.solution = self.reduce_output(self.solution)
 
 class LyapunovAnalyzer(ThreeBodySimulator):
   """Class that generates an array of Lyapunov exponents for a given range of x0 parameters for a specified body"""
+  def __init__(self, system_params):
+    super().__init__(system_params)
+    ## Total number of right hand side evaluations since the last analysis started
+    self.nfev = 0
+    ## Total number of solver steps since the last analysis started
+    self.steps = 0
+    ## Stopping time of every point of the last analysis, in days
+    self.stop_times = []
+    ## Stopping reason of every point of the last analysis, see `estimate_exponent`
+    self.stop_reasons = []
+
   def solve_system_of_equations(self):
     """Modified solver, with looser tolerances, disabled dense output, disabled logging and using Lyapunov days range.
     It is meant to run faster and quieter, making it suitable for calling in a loop.
     @returns OdeSolution object containing solutions for all parameters
     """
-    # Initial conditions:
-    # [x1, x2, x3, x4, x5, x6, dx1/dt, dx2/dt, dx3/dt, dx4/dt, dx5/dt, dx6/dt]    
-    initial_conditions = [
-      self.params['1'].x_0,
-      self.params['1'].y_0,
-      self.params['2'].x_0,
-      self.params['2'].y_0,
-      self.params['3'].x_0,
-      self.params['3'].y_0,
-
-      self.params['1'].vx_0,
-      self.params['1'].vy_0,
-      self.params['2'].vx_0,
-      self.params['2'].vy_0,
-      self.params['3'].vx_0,
-      self.params['3'].vy_0
-    ]
+    initial_conditions = self.initial_conditions()
     
     # Time span for integration
     t_span = (0, self.params['lyapunov']['days'] * 24 * 3600)
@@ -152,6 +305,76 @@ class LyapunovAnalyzer(ThreeBodySimulator):
 
     return solution
 
+  def estimate_exponent(self):
+    """Integrate current parameters step by step, updating Lyapunov indicator on the fly and stopping once it converges.
+    Running estimate is checked every `check_steps` solver steps. Its error is estimated as the difference between
+    current estimate and estimate from half as many steps, integration stops once this error stays below `tol` for
+    `patience` consecutive checks, or once estimate crosses optional `regular_below`/`chaotic_above` thresholds.
+    Integration also stops once solver stalls, i.e. advances by less than `stall` times the time span over the last
+    `check_steps` steps. This happens in close encounters the solver cannot resolve: its step size collapses and it
+    crawls for hundreds of thousands of steps before it fails, which is most of the cost of a chaotic range.
+    Solver takes exactly the same steps as `solve_system_of_equations`, so an estimate which never stops early
+    is identical to the one computed from a full solution.
+    @returns A tuple containing:
+    - Lyapunov indicator, mean of `log|dx|` over solver steps of x position of analyzed body, `NaN` if solver
+      failed before completing a single step
+    - stopping time in days
+    - stopping reason, `converged`, `regular`, `chaotic`, `stalled`, `failed` if solver could not continue
+      (e.g. a collision) or `end` if whole time span was integrated
+    """
+    settings = self.params['lyapunov']
+    early_stopping = settings.get('early_stopping', True)
+    check_steps = settings.get('check_steps', 1000)
+    tol = settings.get('tol', 5e-2)
+    patience = settings.get('patience', 3)
+    regular_below = settings.get('regular_below', None)
+    chaotic_above = settings.get('chaotic_above', None)
+    stall = settings.get('stall', 1e-9)
+
+    t_end = settings['days'] * 24 * 3600
+    solver = RK45(self.system_of_equations, 0, self.initial_conditions(), t_end, rtol=1e-6, atol=1e-6)
+    index = self.bodies.position_index(settings['body_no'], 0)
+    previous_x = solver.y[index]
+    total, steps = 0.0, 0
+    estimates, stable = [], 0
+    window_start = solver.t
+    reason = 'end'
+    while solver.status == 'running':
+      solver.step()
+      if solver.status == 'failed':
+        reason = 'failed'
+        break
+      steps += 1
+      total += np.log(np.abs(solver.y[index] - previous_x))
+      previous_x = solver.y[index]
+      if not early_stopping or steps % check_steps or solver.status != 'running':
+        continue
+      if stall is not None and solver.t - window_start < stall * t_end:
+        reason = 'stalled'
+        break
+      window_start = solver.t
+
+      estimate = total / steps
+      estimates.append(estimate)
+      # estimate from half of the steps, mean converges like 1/steps so their difference bounds remaining error
+      halfway = estimates[len(estimates) // 2 - 1] if len(estimates) > 1 else None
+      stable = stable + 1 if halfway is not None and abs(estimate - halfway) < tol else 0
+      if regular_below is not None and estimate < regular_below:
+        reason = 'regular'
+      elif chaotic_above is not None and estimate > chaotic_above:
+        reason = 'chaotic'
+      elif stable >= patience:
+        reason = 'converged'
+      else:
+        continue
+      break
+
+    self.nfev += solver.nfev
+    self.steps += steps
+    if steps == 0:
+      return np.nan, solver.t / (24 * 3600), 'failed'
+    return total / steps, solver.t / (24 * 3600), reason
+
   def analyze_x0(self):
     """Calculate Lyapunov exponents from x0s of a given body
     @returns A tuple containing:
@@ -161,6 +384,7 @@ class LyapunovAnalyzer(ThreeBodySimulator):
     # check if Lyapunov exponent params are set, if not exit
     if not self.params.get('lyapunov', None):
       return
+    from tqdm import tqdm
     body_no =  self.params['lyapunov']['body_no']
     
     params_bak = copy.deepcopy(self.params)
@@ -170,17 +394,25 @@ class LyapunovAnalyzer(ThreeBodySimulator):
 
     self.logger.warning(f"Calculating Lyapunov exponents for range ({parameter_range[0]:.2f}, {parameter_range[-1]:.2f}, {len(parameter_range)}), it will take some time")
     exponents = []
+    self.nfev = 0
+    self.steps = 0
+    self.stop_times = []
+    self.stop_reasons = []
     for new_x_0 in tqdm(parameter_range, total=parameter_range.size, file=sys.stdout):
       self.logger.debug(f"new_x_0={new_x_0}")
 
       local_params[str(body_no)].x_0 = new_x_0
       self.params = copy.deepcopy(local_params)
 
-      solution = self.solve_system_of_equations()
-      x_0_s = solution.y[2*(body_no-1)]
-
       # calculate lyapunov exponent from x_0s of appropriate body
-      exponents.append(np.mean(np.log(np.abs(np.diff(x_0_s)))))
+      exponent, stop_time, reason = self.estimate_exponent()
+      exponents.append(exponent)
+      self.stop_times.append(stop_time)
+      self.stop_reasons.append(reason)
 
     self.params = params_bak
+    days = self.params['lyapunov']['days']
+    for new_x_0, stop_time, reason in zip(parameter_range, self.stop_times, self.stop_reasons):
+      self.logger.info(f"x_0={new_x_0:.4f}: stopped after {stop_time:.4g}/{days:.4g} days ({reason})")
+    self.logger.info(f"Lyapunov analysis integrated {sum(self.stop_times) / (days * len(parameter_range)):.0%} of full time span")
     return parameter_range, np.array(exponents)
\ No newline at end of file
@@ -0,0 +1,289 @@
+""" @package StabilityMap
+
+@brief Adaptive 2D stability and escape-time maps
+
+@details This module defines StabilityMapAnalyzer class which scans a 2D slice of initial condition space.
+Any two fields of bodies' `ObjectParams2D` (e.g. `x_0` of body 3 and `y_0` of body 3) span the slice and
+every cell of a map holds one of indicators:
+- `escape` - time after which any body leaves a sphere of `escape_radius` around centre of mass, `days` if none does
+- `collision` - time after which any two bodies come closer than `collision_radius`, `days` if they never do
+- `chaos` - Lyapunov indicator used by `LyapunovAnalyzer`, computed from x positions of the first scanned body
+
+Cells whose integration fails before reaching `days` hold `NaN`, they are left blank on a plot and ignored when
+neighbouring cells are interpolated.
+
+Map is computed adaptively. A coarse grid is computed first, then each refinement level halves grid spacing,
+but only blocks whose corners disagree (differ by more than `threshold` times the spread of coarse values) are
+actually integrated, remaining cells are filled with bilinear interpolation. This concentrates computation
+on boundaries between regular and chaotic regions.
+
+Results are stored in memory-mapped `.npy` files, flushed after every tile of cells, so an interrupted
+run picks up where it stopped when started again with the same parameters:
+- `<file>.values.npy` - indicator values, `NaN` for cells not computed yet
+- `<file>.state.npy` - `0` for pending, `1` for computed and `2` for interpolated cells
+- `<file>.json` - map parameters, checked when resuming, including a fingerprint of the base configuration (bodies,
+  `G`, force solver) and the classification parameters (radii, threshold), so cells of a different run are never reused
+
+Map parameters are held in `params['stability_map']` dictionary:
+- `x`/`y` - tuples `(body_no, field)` choosing scanned parameters, e.g. `(3, 'x_0')`
+- `xrange`/`yrange` - tuples `(min, max)` of scanned parameters
+- `indicator` - `escape` (default), `collision` or `chaos`
+- `days` - simulation time of every cell
+- `coarse` - number of cells per axis of coarse grid, defaults to `9`
+- `levels` - number of refinement levels, defaults to `3`, final map has `(coarse - 1) * 2**levels + 1` cells per axis
+- `threshold` - relative disagreement of block corners which triggers refinement, defaults to `0.05`
+- `escape_radius` - defaults to 5 times initial largest distance of a body from centre of mass
+- `collision_radius` - defaults to `1e-3` times initial smallest distance between bodies
+- `file` - prefix of result files, defaults to `stability_map`
+- `tile` - number of cells integrated between flushes, defaults to `16`
+- `workers` - size of a process pool, defaults to `1` (no pool)
+
+Usage example:
+@code
+  analyzer = StabilityMapAnalyzer(params)
+  xs, ys, values = analyzer.analyze()
+
+  plotter = StabilityMapPlotter(xs, ys, values, params)
+  plotter.plot_stability_map()
+@endcode
+"""
+
+from .Simulator import ThreeBodySimulator
+from .Sweep import check_parameter_path
+from .Bodies import system_fingerprint
+
+from concurrent.futures import ProcessPoolExecutor
+from scipy.integrate import solve_ivp
+from tqdm import tqdm
+
+import numpy as np
+import copy
+import json
+import os
+import sys
+
+def _evaluate_cells(analyzer, cells):
+  """Evaluate indicator for a list of cells, executed in worker processes
+  @param analyzer StabilityMapAnalyzer object
+  @param cells List of `(x, y)` parameter values
+  @returns List of indicator values
+  """
+  return [analyzer.evaluate_cell(x, y) for x, y in cells]
+
+class StabilityMapAnalyzer(ThreeBodySimulator):
+  """Class that computes a 2D map of stability indicators with adaptive grid refinement"""
+  def __init__(self, system_params):
+    """
+    @param system_params Simulation parameters with `stability_map` dictionary
+    @throws ValueError Thrown if indicator is unknown or a scanned parameter refers to a missing body or unknown field
+    """
+    super().__init__(system_params)
+    settings = system_params['stability_map']
+    for axis in ('x', 'y'):
+      body_no, field = settings[axis]
+      check_parameter_path(system_params, f"{body_no}.{field}")
+    ## Indicator computed for every cell
+    self.indicator = settings.get('indicator', 'escape')
+    if self.indicator not in ('escape', 'collision', 'chaos'):
+      raise ValueError(f"Unknown stability map indicator \"{self.indicator}\"")
+    ## Final number of cells per axis
+    self.size = (settings.get('coarse', 9) - 1) * 2**settings.get('levels', 3) + 1
+    ## Scanned values of first parameter
+    self.xs = np.linspace(*settings['xrange'], self.size)
+    ## Scanned values of second parameter
+    self.ys = np.linspace(*settings['yrange'], self.size)
+
+    positions, masses = self.bodies.positions, self.bodies.masses
+    com = masses @ positions / masses.sum()
+    separation = np.linalg.norm(positions[:, np.newaxis] - positions, axis=2)
+    ## Distance from centre of mass which counts as an escape
+    self.escape_radius = settings.get('escape_radius', 5 * np.max(np.linalg.norm(positions - com, axis=1)))
+    ## Distance between bodies which counts as a collision
+    self.collision_radius = settings.get('collision_radius', 1e-3 * np.min(separation[np.triu_indices(self.bodies.n, 1)]))
+
+  def cell_params(self, x, y):
+    """Copy of simulation parameters with scanned fields replaced
+    @param x Value of first scanned parameter
+    @param y Value of second scanned parameter
+    @returns Params dictionary
+    """
+    settings = self.params['stability_map']
+    params = copy.deepcopy(self.params)
+    for (body_no, field), value in ((settings['x'], x), (settings['y'], y)):
+      setattr(params[str(body_no)], field, value)
+    return params
+
+  def evaluate_cell(self, x, y):
+    """Integrate a single cell and compute its indicator
+    @param x Value of first scanned parameter
+    @param y Value of second scanned parameter
+    @returns Indicator value, `NaN` if integration failed
+    """
+    cell = ThreeBodySimulator(self.cell_params(x, y))
+    state = cell.initial_conditions()
+    n, dim = cell.bodies.n, cell.bodies.dim
+    masses = cell.bodies.masses
+    t_end = self.params['stability_map']['days'] * 24 * 3600
+
+    def escape(t, state):
+      positions = state[:n*dim].reshape(n, dim)
+      com = masses @ positions / masses.sum()
+      return self.escape_radius - np.max(np.linalg.norm(positions - com, axis=1))
+    escape.terminal = True
+
+    def collision(t, state):
+      positions = state[:n*dim].reshape(n, dim)
+      separation = np.linalg.norm(positions[:, np.newaxis] - positions, axis=2)
+      return np.min(separation[np.triu_indices(n, 1)]) - self.collision_radius
+    collision.terminal = True
+
+    events = {'escape': escape, 'collision': collision, 'chaos': None}[self.indicator]
+    solution = solve_ivp(
+      cell.system_of_equations,
+      (0, t_end),
+      state,
+      events=events,
+      dense_output=False,
+      rtol=1e-6,
+      atol=1e-6
+    )
+    if solution.status == -1:
+      self.logger.warning(f"Integration of cell ({x:g}, {y:g}) failed at t={solution.t[-1]:g}s: {solution.message}")
+      return np.nan
+    if self.indicator == 'chaos':
+      body_no = self.params['stability_map']['x'][0]
+      x_0_s = solution.y[cell.bodies.position_index(int(body_no), 0)]
+      return np.mean(np.log(np.abs(np.diff(x_0_s))))
+    if len(solution.t_events[0]):
+      return solution.t_events[0][0]
+    return t_end
+
+  def open_storage(self):
+    """Open memory-mapped result files, creating them if necessary
+    @returns Tuple of `(values, state)` memory-mapped arrays
+    @throws ValueError Thrown if existing files were created with different parameters
+    """
+    settings = self.params['stability_map']
+    prefix = settings.get('file', 'stability_map')
+    metadata = {
+      'x': [str(part) for part in settings['x']],
+      'y': [str(part) for part in settings['y']],
+      'xrange': [float(value) for value in settings['xrange']],
+      'yrange': [float(value) for value in settings['yrange']],
+      'size': self.size,
+      'indicator': self.indicator,
+      'days': float(settings['days']),
+      'threshold': float(settings.get('threshold', 0.05)),
+      'escape_radius': float(self.escape_radius),
+      'collision_radius': float(self.collision_radius),
+      'system': system_fingerprint(self.params),
+    }
+    paths = [f"{prefix}.values.npy", f"{prefix}.state.npy", f"{prefix}.json"]
+    if all(os.path.exists(path) for path in paths):
+      with open(paths[2]) as file:
+        if json.load(file) != metadata:
+          raise ValueError(f"Stability map files \"{prefix}.*\" were created with different parameters, remove them to start over")
+      self.logger.info(f"Resuming stability map from \"{prefix}.*\"")
+      values = np.lib.format.open_memmap(paths[0], mode='r+')
+      state = np.lib.format.open_memmap(paths[1], mode='r+')
+    else:
+      values = np.lib.format.open_memmap(paths[0], mode='w+', dtype=np.float64, shape=(self.size, self.size))
+      values[:] = np.nan
+      state = np.lib.format.open_memmap(paths[1], mode='w+', dtype=np.uint8, shape=(self.size, self.size))
+      with open(paths[2], 'w') as file:
+        json.dump(metadata, file)
+    return values, state
+
+  def compute(self, cells, values, state, executor):
+    """Integrate all pending cells from a list, tile by tile, flushing results after each tile
+    @param cells Array of `(i, j)` grid indices
+    @param values Memory-mapped array of indicator values
+    @param state Memory-mapped array of cell states
+    @param executor Process pool or `None`
+    """
+    cells = [(i, j) for i, j in cells if state[i, j] != 1]
+    tile = self.params['stability_map'].get('tile', 16)
+    tiles = [cells[start:start + tile] for start in range(0, len(cells), tile)]
+    arguments = [[(self.xs[i], self.ys[j]) for i, j in part] for part in tiles]
+    if executor is None:
+      results = (_evaluate_cells(self, part) for part in arguments)
+    else:
+      results = executor.map(_evaluate_cells, [self] * len(arguments), arguments)
+    with tqdm(total=len(cells), file=sys.stdout) as progress:
+      for part, result in zip(tiles, results):
+        for (i, j), value in zip(part, result):
+          values[i, j] = value
+          state[i, j] = 1
+        values.flush()
+        state.flush()
+        progress.update(len(part))
+
+  def analyze(self):
+    """Compute stability map
+    @returns A tuple containing:
+    - values of first scanned parameter
+    - values of second scanned parameter
+    - `np.array` of indicator values of shape `(len(xs), len(ys))`
+    """
+    settings = self.params['stability_map']
+    levels = settings.get('levels', 3)
+    threshold = settings.get('threshold', 0.05)
+    values, state = self.open_storage()
+    workers = settings.get('workers', 1)
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+
+    try:
+      stride = 2**levels
+      self.logger.warning(f"Calculating {self.indicator} map, coarse grid {self.size // stride + 1}x{self.size // stride + 1}, it will take some time")
+      grid = np.arange(0, self.size, stride)
+      self.compute([(i, j) for i in grid for j in grid], values, state, executor)
+      coarse = values[::stride, ::stride]
+      spread = np.nanmax(coarse) - np.nanmin(coarse)
+
+      for level in range(1, levels + 1):
+        half = stride // 2
+        # corners of every block of the previous level
+        corners = np.stack((
+          values[:-stride:stride, :-stride:stride], values[stride::stride, :-stride:stride],
+          values[:-stride:stride, stride::stride], values[stride::stride, stride::stride]
+        ))
+        disagree = (np.nanmax(corners, axis=0) - np.nanmin(corners, axis=0)) > threshold * spread
+        disagree |= np.isnan(corners).any(axis=0) & ~np.isnan(corners).all(axis=0)
+
+        # new points of refined blocks: two edge midpoints on each side and the centre
+        cells = set()
+        for bi, bj in zip(*np.nonzero(disagree)):
+          i, j = bi * stride, bj * stride
+          for di, dj in ((half, 0), (0, half), (half, half), (half, stride), (stride, half)):
+            cells.add((i + di, j + dj))
+        self.logger.info(f"Refinement level {level}: {len(cells)} cells to integrate, {np.count_nonzero(disagree)}/{disagree.size} blocks refined")
+        self.compute(sorted(cells), values, state, executor)
+
+        # everything else on the new level is interpolated from its block's corners, failed corners are skipped
+        new = np.zeros((self.size, self.size), dtype=bool)
+        new[::half, ::half] = True
+        new[::stride, ::stride] = False
+        for i, j in zip(*np.nonzero(new & (np.asarray(state) != 1))):
+          i0, j0 = (i // stride) * stride, (j // stride) * stride
+          i1, j1 = min(i0 + stride, self.size - 1), min(j0 + stride, self.size - 1)
+          u = (i - i0) / stride
+          w = (j - j0) / stride
+          corner_values = np.array([values[i0, j0], values[i1, j0], values[i0, j1], values[i1, j1]])
+          weights = np.array([(1-u)*(1-w), u*(1-w), (1-u)*w, u*w])
+          valid = ~np.isnan(corner_values)
+          if weights[valid].sum() > 0:
+            values[i, j] = weights[valid] @ corner_values[valid] / weights[valid].sum()
+          state[i, j] = 2
+        values.flush()
+        state.flush()
+        stride = half
+    finally:
+      if executor is not None:
+        executor.shutdown()
+
+    computed = np.count_nonzero(np.asarray(state) == 1)
+    self.logger.info(f"Stability map done, {computed}/{self.size**2} cells integrated")
+    failed = np.count_nonzero((np.asarray(state) == 1) & np.isnan(values))
+    if failed:
+      self.logger.warning(f"Integration failed in {failed} cells, they are left blank")
+    return self.xs, self.ys, np.array(values)
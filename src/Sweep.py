@@ -0,0 +1,263 @@
+""" @package Sweep
+
+@brief Declarative multi-parameter sweeps
+
+@details This module defines ParameterSweep class which evaluates a configuration for many combinations of
+parameters in a single process pool. A sweep is described by a dictionary (usually loaded from a JSON file):
+- `configuration` - name of a base configuration from `src/Configurations.py`
+- `parameters` - map of parameter paths to their ranges, path is either `G`, `days` or `<body_no>.<field>`,
+  where field is any `ObjectParams2D`/`ObjectParams3D` member (e.g. `2.x_0`, `3.vy_0`, `1.m`), range is either
+  `{"range": [min, max], "points": k}` or `{"values": [v1, v2, ...]}` (explicit values are supported by `grid` design only)
+- `design` - `grid` (cartesian product, default), `lhs` (Latin hypercube) or `sobol` (scrambled Sobol sequence)
+- `samples` - number of points of `lhs` and `sobol` designs, Sobol rounds it up to a power of 2
+- `seed` - random seed of `lhs` and `sobol` designs, defaults to `0`
+- `observables` - list of computed quantities, defaults to all of them:
+  - `lyapunov` - Lyapunov indicator computed as in `LyapunovAnalyzer`, for body `lyapunov_body` (defaults to `1`)
+  - `energy_error` - relative change of total energy between first and last step
+  - `min_distance` - smallest distance between any two bodies over all steps
+  - `nfev` - number of right hand side evaluations
+- `rtol`/`atol` - solver tolerances, default to `1e-6` as in `LyapunovAnalyzer`
+- `output` - CSV file results are appended to, one column per parameter and observable, followed by `status` of
+  the solver (`0` success, `-1` failure) and `fingerprint` of the base configuration and settings, defaults to `sweep.csv`
+- `workers` - size of a process pool, defaults to number of available cores
+
+Points already present in the output file are skipped, so a sweep can be extended or resumed by running it again.
+Only successful rows with the current fingerprint count as present: points whose solver failed are retried and
+changing the base configuration, `days`, tolerances or `lyapunov_body` computes every point again, rows of both runs
+stay in the same file. Each result row is written and flushed as soon as its point finishes.
+
+Usage example:
+@code
+  spec = {
+    "configuration": "burrau",
+    "design": "sobol",
+    "samples": 256,
+    "parameters": {"2.x_0": {"range": [-3, 0]}, "G": {"range": [6e-11, 7e-11]}}
+  }
+  ParameterSweep(spec, Configurations.burrau()).run()
+@endcode
+"""
+
+from .Simulator import ThreeBodySimulator
+from .Bodies import *
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from scipy.integrate import solve_ivp
+from scipy.stats import qmc
+from tqdm import tqdm
+
+import copy
+import csv
+import dataclasses
+import itertools
+import logging
+import os
+import sys
+
+## Observables computed by default
+OBSERVABLES = ('lyapunov', 'energy_error', 'min_distance', 'nfev')
+
+def apply_parameter(params, path, value):
+  """Set a single swept parameter in params dictionary
+  @param params Simulation parameters, modified in place
+  @param path `G`, `days` or `<body_no>.<field>`
+  @param value New value
+  """
+  if '.' in path:
+    body, field = path.split('.', 1)
+    setattr(params[body], field, value)
+  else:
+    params[path] = value
+
+def check_parameter_path(params, path):
+  """Check that a parameter path can be set with `apply_parameter`
+  @param params Simulation parameters
+  @param path `G`, `days` or `<body_no>.<field>`
+  @throws ValueError Thrown if path refers to a missing body, unknown field or unsupported parameter
+  """
+  if '.' in path:
+    body, field = path.split('.', 1)
+    if body not in params:
+      raise ValueError(f"Parameter \"{path}\" refers to missing body {body}")
+    if field not in [member.name for member in dataclasses.fields(params[body])]:
+      raise ValueError(f"Parameter \"{path}\" refers to unknown field \"{field}\"")
+  elif path not in ('G', 'days'):
+    raise ValueError(f"Parameter \"{path}\" is not supported, use G, days or <body_no>.<field>")
+
+def _run_point(base_params, point, observables, rtol, atol, lyapunov_body):
+  """Integrate a single sweep point and compute its observables, executed in worker processes
+  @param base_params Base simulation parameters
+  @param point Dictionary `{path: value}`
+  @param observables List of observables names
+  @param rtol Relative tolerance
+  @param atol Absolute tolerance
+  @param lyapunov_body Body used by `lyapunov` observable
+  @returns Tuple of `(point, {observable: value}, solver status)`
+  """
+  params = copy.deepcopy(base_params)
+  for path, value in point.items():
+    apply_parameter(params, path, value)
+  sim = ThreeBodySimulator(params)
+  solution = solve_ivp(
+    sim.system_of_equations,
+    (0, params['days'] * 24 * 3600),
+    sim.initial_conditions(),
+    dense_output=False,
+    rtol=rtol,
+    atol=atol
+  )
+  bodies = sim.bodies
+  softening = params.get('softening', 0.0)
+  results = {}
+  if 'lyapunov' in observables:
+    x_0_s = solution.y[bodies.position_index(lyapunov_body, 0)]
+    results['lyapunov'] = np.mean(np.log(np.abs(np.diff(x_0_s))))
+  if 'energy_error' in observables:
+    energy = state_energy(solution.y[:, [0, -1]], bodies, params['G'], softening)
+    results['energy_error'] = abs((energy[1] - energy[0]) / energy[0])
+  if 'min_distance' in observables:
+    half = bodies.n * bodies.dim
+    positions = solution.y[:half].reshape(bodies.n, bodies.dim, -1)
+    i, j = np.triu_indices(bodies.n, 1)
+    results['min_distance'] = np.min(np.sqrt(np.sum((positions[i] - positions[j])**2, axis=1)))
+  if 'nfev' in observables:
+    results['nfev'] = solution.nfev
+  return point, results, solution.status
+
+class ParameterSweep:
+  """Class that runs a declarative sweep over arbitrary simulation parameters"""
+  def __init__(self, spec, params):
+    """Constructor for ParameterSweep, validates the whole specification up front
+    @param spec Sweep specification, see module documentation
+    @param params Base simulation parameters
+    @throws ValueError Thrown if specification is invalid
+    """
+    ## Sweep specification
+    self.spec = spec
+    ## Base simulation parameters
+    self.params = params
+    ## Global logger reference
+    self.logger = logging.getLogger("main")
+    ## Swept parameter paths, in column order
+    self.paths = list(spec['parameters'])
+    ## Computed observables
+    self.observables = list(spec.get('observables', OBSERVABLES))
+    ## Design of experiment
+    self.design = spec.get('design', 'grid')
+    ## Output CSV file
+    self.output = spec.get('output', 'sweep.csv')
+    ## Solver tolerances
+    self.tolerances = (spec.get('rtol', 1e-6), spec.get('atol', 1e-6))
+    ## Body used by `lyapunov` observable
+    self.lyapunov_body = int(spec.get('lyapunov_body', 1))
+
+    if not self.paths:
+      raise ValueError("Sweep has no parameters")
+    if self.design not in ('grid', 'lhs', 'sobol'):
+      raise ValueError(f"Unknown sweep design \"{self.design}\"")
+    for observable in self.observables:
+      if observable not in OBSERVABLES:
+        raise ValueError(f"Unknown observable \"{observable}\", available: {', '.join(OBSERVABLES)}")
+    for path, definition in spec['parameters'].items():
+      check_parameter_path(params, path)
+      if 'values' in definition and self.design != 'grid':
+        raise ValueError(f"Explicit values of \"{path}\" are only supported by grid design")
+      if 'values' not in definition and len(definition.get('range', ())) != 2:
+        raise ValueError(f"Swept parameter \"{path}\" needs either \"values\" or a [min, max] \"range\"")
+
+  def points(self):
+    """Generate design points
+    @returns List of dictionaries `{path: value}`
+    """
+    definitions = [self.spec['parameters'][path] for path in self.paths]
+    if self.design == 'grid':
+      axes = [
+        definition['values'] if 'values' in definition
+        else np.linspace(*definition['range'], definition.get('points', 10))
+        for definition in definitions
+      ]
+      samples = list(itertools.product(*axes))
+    else:
+      lower = [definition['range'][0] for definition in definitions]
+      upper = [definition['range'][1] for definition in definitions]
+      count = self.spec.get('samples', 64)
+      seed = self.spec.get('seed', 0)
+      if self.design == 'lhs':
+        unit = qmc.LatinHypercube(d=len(self.paths), seed=seed).random(count)
+      else:
+        unit = qmc.Sobol(d=len(self.paths), seed=seed).random_base2(int(np.ceil(np.log2(count))))
+      samples = qmc.scale(unit, lower, upper)
+    return [{path: float(value) for path, value in zip(self.paths, sample)} for sample in samples]
+
+  def fingerprint(self):
+    """Fingerprint of base configuration and settings every point depends on, see `system_fingerprint`"""
+    return system_fingerprint(
+      self.params, days=self.params['days'], tolerances=self.tolerances, lyapunov_body=self.lyapunov_body
+    )[:16]
+
+  def columns(self):
+    """Columns of output file"""
+    return self.paths + self.observables + ['status', 'fingerprint']
+
+  def key(self, point):
+    """Deduplication key of a point, values are compared with their CSV representation
+    @param point Dictionary `{path: value}`
+    """
+    return tuple(repr(float(point[path])) for path in self.paths)
+
+  def completed(self):
+    """Keys of points successfully computed with current fingerprint and present in output file
+    @returns Set of keys
+    @throws ValueError Thrown if output file has different columns
+    """
+    if not os.path.exists(self.output):
+      return set()
+    fingerprint = self.fingerprint()
+    with open(self.output, newline='') as file:
+      reader = csv.DictReader(file)
+      if reader.fieldnames != self.columns():
+        raise ValueError(f"Output file \"{self.output}\" has different columns, choose another one")
+      return {
+        tuple(repr(float(row[path])) for path in self.paths) for row in reader
+        if row['fingerprint'] == fingerprint and int(row['status']) == 0
+      }
+
+  def run(self):
+    """Run all points which are not present in output file yet
+    @returns Number of computed points
+    """
+    done = self.completed()
+    pending, seen = [], set(done)
+    for point in self.points():
+      if self.key(point) not in seen:
+        seen.add(self.key(point))
+        pending.append(point)
+    self.logger.warning(f"Sweeping {len(pending)} points ({len(done)} already computed) with {self.design} design, it will take some time")
+
+    new_file = not os.path.exists(self.output)
+    workers = self.spec.get('workers', os.cpu_count())
+    arguments = (self.observables, *self.tolerances, self.lyapunov_body)
+    fingerprint = self.fingerprint()
+    failed = 0
+    with open(self.output, 'a', newline='') as file, ProcessPoolExecutor(max_workers=workers) as executor:
+      writer = csv.writer(file)
+      if new_file:
+        writer.writerow(self.columns())
+      futures = [executor.submit(_run_point, self.params, point, *arguments) for point in pending]
+      for future in tqdm(as_completed(futures), total=len(futures), file=sys.stdout):
+        try:
+          point, results, status = future.result()
+        except Exception as e:
+          self.logger.error(f"Sweep point failed, it will be retried on next run: {e}")
+          continue
+        failed += status != 0
+        writer.writerow(
+          [repr(point[path]) for path in self.paths] + [repr(float(results[name])) for name in self.observables]
+          + [status, fingerprint]
+        )
+        file.flush()
+
+    if failed:
+      self.logger.warning(f"Solver failed in {failed} points, they are marked with status -1 and retried on next run")
+    self.logger.info(f"Sweep done, results saved to \"{self.output}\"")
+    return len(pending)
@@ -1,6 +1,7 @@
-"""This module defines a dataclass which holds initial conditions of a body in three body problem.
+"""This module defines dataclasses which hold initial conditions of a body in three body problem.
 
-`ObjectParams2D` objects are expected to be held inside a dictionary under keys `1`, `2` and `3`.
+`ObjectParams2D` objects are expected to be held inside a dictionary under keys `1`, `2` and `3`
+(more bodies can be added under consecutive keys `4`, `5`, ...).
 Each aprameter is mandatory, they can be provided in every standard way supported by `dataclasses` module.
 
 Members overview:
@@ -25,6 +26,9 @@ Usage example:
     earth_mass
   )
 @endcode
+
+`ObjectParams3D` additionally holds `z_0` and `vz_0`, position and velocity in z axis.
+If any body in a simulation is described by `ObjectParams3D`, whole simulation runs in 3D.
 """
 
 from dataclasses import dataclass
@@ -39,3 +43,14 @@ class ObjectParams2D:
   vx_0: np.float64
   vy_0: np.float64
   m: np.float64
+
+@dataclass
+class ObjectParams3D:
+  """Class that holds information about a body moving in 3D"""
+  x_0: np.float64
+  y_0: np.float64
+  z_0: np.float64
+  vx_0: np.float64
+  vy_0: np.float64
+  vz_0: np.float64
+  m: np.float64
@@ -0,0 +1,319 @@
+""" @package WorkQueue
+
+@brief Work queue on a shared directory, for splitting Lyapunov analyses between machines
+
+@details This module defines WorkQueue class which splits a Lyapunov analysis (see `LyapunovAnalyzer` in
+`src/Simulator.py`) into shards of its parameter range and distributes them through a directory shared by all
+nodes (e.g. NFS), without any broker. Coordinator creates the queue, any number of workers on any node claim
+and compute shards, and a final merge returns the same `(parameter_range, exponents)` pair as `analyze_x0`.
+
+Queue directory layout:
+- `queue.json` - number of shards and lease time
+- `params.pkl` - pickled simulation parameters, shared by all shards
+- `pending/<shard>.json` - shards waiting for a worker, each holds `start` and `stop` indices of the parameter range
+- `claimed/<shard>.<token>.json` - shards being computed, `token` is unique to every claim and file
+  modification time is the lease heartbeat
+- `results/<shard>.npz` - computed shards
+- `failed/<shard>.json` - shards which raised an exception, with error message
+
+Workers claim a shard by renaming it from `pending/` to `claimed/` under a fresh token; rename is atomic, so
+exactly one worker gets it, and a worker only ever touches or removes the file of its own claim. While computing,
+a worker touches its claimed file every third of the lease time. Any worker finding a claimed shard whose file
+was not touched for longer than the lease (its worker died or lost the shared directory) moves it back to
+`pending/`. Results are written to a temporary file and renamed into `results/`,
+so a shard computed twice after a late recovery is harmless and merge never reads a partial file. Lease time
+should be well above clock differences between nodes.
+
+Usage example:
+@code
+  # coordinator
+  WorkQueue('/shared/burrau').create(Configurations.burrau(), shard_size=4)
+  # on every node
+  WorkQueue('/shared/burrau').work()
+  # once all shards are done
+  parameter_range, exponents = WorkQueue('/shared/burrau').merge()
+@endcode
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+import copy
+import json
+import logging
+import os
+import pickle
+import socket
+import threading
+import time
+import uuid
+
+import numpy as np
+
+class WorkQueue:
+  """Class that distributes shards of a Lyapunov analysis through a shared directory"""
+  def __init__(self, directory):
+    """Constructor for WorkQueue
+    @param directory Shared queue directory
+    """
+    ## Shared queue directory
+    self.directory = directory
+    ## Global logger reference
+    self.logger = logging.getLogger("main")
+    ## Identifier of this worker, used in log messages
+    self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+
+  def path(self, *parts):
+    """Path inside queue directory"""
+    return os.path.join(self.directory, *parts)
+
+  def shards(self, state):
+    """Names of shards in a given state
+    @param state `pending`, `claimed`, `results` or `failed`
+    @returns Sorted list of shard names
+    """
+    try:
+      return sorted(os.path.splitext(name)[0] for name in os.listdir(self.path(state)) if not name.startswith('.'))
+    except FileNotFoundError:
+      return []
+
+  def claims(self):
+    """Claims of shards being computed
+    @returns Sorted list of `(shard name, token)` tuples
+    """
+    return [tuple(name.split('.', 1)) for name in self.shards('claimed')]
+
+  def settings(self):
+    """Queue settings written by coordinator
+    @throws ValueError Thrown if directory holds no queue
+    """
+    try:
+      with open(self.path('queue.json')) as file:
+        return json.load(file)
+    except FileNotFoundError:
+      raise ValueError(f"\"{self.directory}\" is not a work queue, create it first")
+
+  def params(self):
+    """Simulation parameters shared by all shards"""
+    with open(self.path('params.pkl'), 'rb') as file:
+      return pickle.load(file)
+
+  def create(self, params, shard_size=1, lease=600):
+    """Split Lyapunov analysis of a configuration into shards and write them to queue directory
+    @param params Simulation parameters, must define `lyapunov`
+    @param shard_size Number of parameter values per shard
+    @param lease Seconds after which a shard claimed by a silent worker is given to another one
+    @returns Number of shards
+    @throws ValueError Thrown if configuration has no Lyapunov analysis or directory already holds a queue
+    """
+    if not params.get('lyapunov', None):
+      raise ValueError("Configuration has no Lyapunov analysis parameters")
+    if os.path.exists(self.path('queue.json')):
+      raise ValueError(f"\"{self.directory}\" already holds a work queue")
+    points = len(params['lyapunov']['range'])
+    starts = range(0, points, shard_size)
+    for state in ('pending', 'claimed', 'results', 'failed'):
+      os.makedirs(self.path(state), exist_ok=True)
+    with open(self.path('params.pkl'), 'wb') as file:
+      pickle.dump(params, file)
+    for number, start in enumerate(starts):
+      with open(self.path('pending', f"shard_{number:06d}.json"), 'w') as file:
+        json.dump({'start': start, 'stop': min(start + shard_size, points)}, file)
+    # written last, workers treat the queue as ready once it exists
+    self._write_atomic(self.path('queue.json'), json.dumps({'shards': len(starts), 'points': points, 'lease': lease}).encode())
+    self.logger.info(f"Work queue \"{self.directory}\" created, {points} points in {len(starts)} shards")
+    return len(starts)
+
+  def _write_atomic(self, path, data):
+    """Write a file under a temporary name and rename it into place"""
+    temporary = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.{self.worker_id.replace(':', '-')}.tmp")
+    with open(temporary, 'wb') as file:
+      file.write(data)
+    os.replace(temporary, path)
+
+  def recover(self):
+    """Move shards with expired leases back to pending
+    @returns Number of recovered shards
+    """
+    lease = self.settings()['lease']
+    done = set(self.shards('results'))
+    recovered = 0
+    for name, token in self.claims():
+      claimed = self.path('claimed', f"{name}.{token}.json")
+      try:
+        if time.time() - os.path.getmtime(claimed) < lease:
+          continue
+        if name in done:
+          os.remove(claimed)
+          continue
+        os.rename(claimed, self.path('pending', f"{name}.json"))
+      except FileNotFoundError:
+        # finished or recovered by someone else meanwhile
+        continue
+      self.logger.warning(f"Lease of {name} expired, shard returned to queue")
+      recovered += 1
+    return recovered
+
+  def claim(self):
+    """Claim a pending shard
+    @returns Tuple `(name, token, shard)`, or `None` if no shard is pending
+    """
+    self.recover()
+    done = set(self.shards('results'))
+    for name in self.shards('pending'):
+      token = uuid.uuid4().hex[:12]
+      pending = self.path('pending', f"{name}.json")
+      claimed = self.path('claimed', f"{name}.{token}.json")
+      try:
+        # rename keeps modification time, refresh it first so a fresh claim never looks expired
+        os.utime(pending)
+        os.rename(pending, claimed)
+      except FileNotFoundError:
+        # claimed by another worker
+        continue
+      if name in done:
+        os.remove(claimed)
+        continue
+      with open(claimed) as file:
+        return name, token, json.load(file)
+    return None
+
+  def heartbeat(self, name, token, stop):
+    """Touch a claimed shard until `stop` event is set, executed in a thread"""
+    interval = self.settings()['lease'] / 3
+    while not stop.wait(interval):
+      try:
+        os.utime(self.path('claimed', f"{name}.{token}.json"))
+      except FileNotFoundError:
+        self.logger.warning(f"Lease of {name} was lost, its result may be computed twice")
+        return
+
+  def compute(self, params, shard):
+    """Compute Lyapunov exponents of a shard
+    @param params Simulation parameters
+    @param shard Dictionary with `start` and `stop` indices of the parameter range
+    @returns Dictionary of result arrays
+    """
+    from .Simulator import LyapunovAnalyzer
+
+    params = copy.deepcopy(params)
+    params['lyapunov']['range'] = np.asarray(params['lyapunov']['range'])[shard['start']:shard['stop']]
+    analyzer = LyapunovAnalyzer(params)
+    xs, exponents = analyzer.analyze_x0()
+    return {
+      'range': xs,
+      'exponents': exponents,
+      'stop_times': np.array(analyzer.stop_times),
+      'stop_reasons': np.array(analyzer.stop_reasons),
+      'nfev': analyzer.nfev,
+    }
+
+  def work(self, poll=5.0):
+    """Claim and compute shards until none is left
+    @param poll Seconds between checks while remaining shards are claimed by other workers
+    @returns Number of shards computed by this worker
+    """
+    import io
+
+    params = self.params()
+    computed = 0
+    while True:
+      claimed = self.claim()
+      if claimed is None:
+        if not self.claims():
+          break
+        # others are still computing, their shards come back if they die
+        time.sleep(poll)
+        continue
+
+      name, token, shard = claimed
+      self.logger.info(f"Worker {self.worker_id} computing {name} (points {shard['start']}-{shard['stop'] - 1})")
+      stop = threading.Event()
+      heartbeat = threading.Thread(target=self.heartbeat, args=(name, token, stop), daemon=True)
+      heartbeat.start()
+      try:
+        result = self.compute(params, shard)
+      except Exception as e:
+        self.logger.error(f"Shard {name} failed: {type(e).__name__}: {e}")
+        self._write_atomic(self.path('failed', f"{name}.json"), json.dumps(shard | {'error': f"{type(e).__name__}: {e}", 'worker': self.worker_id}).encode())
+        result = None
+      finally:
+        stop.set()
+        heartbeat.join()
+
+      if result is not None:
+        buffer = io.BytesIO()
+        np.savez(buffer, **result)
+        self._write_atomic(self.path('results', f"{name}.npz"), buffer.getvalue())
+        computed += 1
+      try:
+        # only this claim's file is removed, a recovered shard claimed again by another worker keeps its claim
+        os.remove(self.path('claimed', f"{name}.{token}.json"))
+      except FileNotFoundError:
+        pass
+
+    self.logger.info(f"Worker {self.worker_id} done, {computed} shards computed")
+    return computed
+
+  def status(self):
+    """Number of shards in every state
+    @returns Dictionary `{state: count}`, `total` is number of all shards
+    """
+    counts = {state: len(self.shards(state)) for state in ('pending', 'claimed', 'results', 'failed')}
+    counts['total'] = self.settings()['shards']
+    return counts
+
+  def requeue_failed(self):
+    """Move failed shards back to pending, e.g. after fixing their cause
+    @returns Number of requeued shards
+    """
+    names = self.shards('failed')
+    for name in names:
+      with open(self.path('failed', f"{name}.json")) as file:
+        shard = json.load(file)
+      self._write_atomic(self.path('pending', f"{name}.json"), json.dumps({'start': shard['start'], 'stop': shard['stop']}).encode())
+      os.remove(self.path('failed', f"{name}.json"))
+    return len(names)
+
+  def merge(self):
+    """Combine results of all shards
+    @returns Tuple `(parameter_range, exponents)`, as returned by `LyapunovAnalyzer.analyze_x0`
+    @throws ValueError Thrown if some shards are not computed yet
+    """
+    settings = self.settings()
+    done = self.shards('results')
+    if len(done) != settings['shards']:
+      failed = self.shards('failed')
+      raise ValueError(f"Only {len(done)} of {settings['shards']} shards are computed" + (f", failed: {', '.join(failed)}" if failed else ""))
+    xs, exponents, stop_times, stop_reasons, nfev = [], [], [], [], 0
+    for name in done:
+      with np.load(self.path('results', f"{name}.npz")) as result:
+        xs.append(result['range'])
+        exponents.append(result['exponents'])
+        stop_times.append(result['stop_times'])
+        stop_reasons.append(result['stop_reasons'])
+        nfev += int(result['nfev'])
+    ## Stopping time of every point, in days, filled by `merge`
+    self.stop_times = np.concatenate(stop_times).tolist()
+    ## Stopping reason of every point, filled by `merge`
+    self.stop_reasons = np.concatenate(stop_reasons).tolist()
+    ## Total number of right hand side evaluations, filled by `merge`
+    self.nfev = nfev
+    self.logger.info(f"Merged {len(done)} shards, {settings['points']} points")
+    return np.concatenate(xs), np.concatenate(exponents)
+
+def _work(directory, poll):
+  """Run a worker, executed in worker processes"""
+  return WorkQueue(directory).work(poll)
+
+def run_workers(directory, workers=1, poll=5.0):
+  """Run several workers of a queue on this machine
+  @param directory Shared queue directory
+  @param workers Number of worker processes
+  @param poll Seconds between checks while remaining shards are claimed by other workers
+  @returns Number of shards computed by all workers
+  """
+  WorkQueue(directory).settings()
+  if workers == 1:
+    return _work(directory, poll)
+  with ProcessPoolExecutor(max_workers=workers) as executor:
+    return sum(executor.map(_work, [directory] * workers, [poll] * workers))